@@ -0,0 +1,180 @@
+"""Shared memory transport benchmark for rosboxes.
+
+Measures the throughput between two containers on the same host, without ROS:
+  - udp: messages over UDP loopback, what DDS falls back to without shared memory
+  - shm: messages through a ring buffer in /dev/shm, only possible when the containers
+         share the host IPC namespace like rosboxes created with `--shm`
+
+    python benchmarks/bench_shm.py [--image python:3.11-slim] [--size 1M] [--seconds 5]
+    python benchmarks/bench_shm.py --local    # same peers as local processes, no docker needed
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the peer runs inside the containers with `python3 -c`, so it only uses the standard library
+PEER = r'''
+import json, mmap, os, socket, struct, sys, time
+
+role, mode, size, seconds = sys.argv[1], sys.argv[2], int(sys.argv[3]), float(sys.argv[4])
+port = 47811
+chunk = 60000
+shm_path = '/dev/shm/rosbox-bench'
+slots = 8
+header = 64
+sched_yield = getattr(os, 'sched_yield', lambda: time.sleep(0))
+
+def report(received, start):
+    if start is None:
+        print(json.dumps({'mode': mode, 'error': 'no data received'}), flush=True)
+    else:
+        print(json.dumps({'mode': mode, 'bytes': received, 'seconds': time.perf_counter() - start}), flush=True)
+
+if mode == 'udp' and role == 'recv':
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    sock.bind(('127.0.0.1', port))
+    sock.settimeout(seconds + 10)
+    received = 0
+    start = None
+    while True:
+        try:
+            data = sock.recv(65536)
+        except socket.timeout:
+            break
+        if start is None:
+            start = time.perf_counter()
+        if data == b'done':
+            break
+        received += len(data)
+    report(received, start)
+elif mode == 'udp':
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8 * 1024 * 1024)
+    message = os.urandom(size)
+    time.sleep(0.5)
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        for offset in range(0, size, chunk):
+            sock.sendto(message[offset:offset + chunk], ('127.0.0.1', port))
+    for _ in range(10):
+        sock.sendto(b'done', ('127.0.0.1', port))
+        time.sleep(0.05)
+elif role == 'recv':
+    # header: messages written, messages read, done flag; then `slots` message slots
+    with open(shm_path, 'w+b') as f:
+        f.truncate(header + slots * size)
+    with open(shm_path, 'r+b') as f:
+        buf = mmap.mmap(f.fileno(), header + slots * size)
+    received = 0
+    read = 0
+    start = None
+    # like the timeout of the UDP receiver, a sender that never shows up doesn't block forever
+    deadline = time.perf_counter() + seconds + 10
+    while True:
+        written, _, done = struct.unpack_from('QQQ', buf, 0)
+        if written == read:
+            if done or time.perf_counter() > deadline:
+                break
+            # yield instead of spinning, the peers may share a single core
+            sched_yield()
+            continue
+        if start is None:
+            start = time.perf_counter()
+        slot = header + (read % slots) * size
+        # slicing the mmap copies the message out, like a subscriber taking a sample
+        received += len(buf[slot:slot + size])
+        read += 1
+        struct.pack_into('Q', buf, 8, read)
+    report(received, start)
+    os.remove(shm_path)
+else:
+    while not os.path.exists(shm_path) or os.path.getsize(shm_path) < header + slots * size:
+        time.sleep(0.01)
+    with open(shm_path, 'r+b') as f:
+        buf = mmap.mmap(f.fileno(), header + slots * size)
+    message = os.urandom(size)
+    written = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        if written - struct.unpack_from('Q', buf, 8)[0] >= slots:
+            sched_yield()
+            continue
+        slot = header + (written % slots) * size
+        buf[slot:slot + size] = message
+        written += 1
+        struct.pack_into('Q', buf, 0, written)
+    struct.pack_into('Q', buf, 16, 1)
+'''
+
+def parse_size(size):
+    sys.path.insert(0, repo_root)
+    from rosbox.workspaceCache import parse_size as parse
+    return parse(size)
+
+def run_local(mode, size, seconds):
+    receiver = subprocess.Popen([sys.executable, '-c', PEER, 'recv', mode, str(size), str(seconds)], stdout=subprocess.PIPE, encoding='utf-8')
+    sender = subprocess.Popen([sys.executable, '-c', PEER, 'send', mode, str(size), str(seconds)])
+    sender.wait()
+    output, _ = receiver.communicate(timeout=seconds + 20)
+    return json.loads(output.strip().splitlines()[-1])
+
+def run_containers(client, image, mode, size, seconds):
+    # both modes use the host network like a default rosbox, the shm mode adds the host IPC namespace
+    options = {"network_mode": "host", "detach": True, "entrypoint": ["python3", "-c", PEER]}
+    if mode == 'shm':
+        options["ipc_mode"] = "host"
+    receiver = client.containers.run(image, ['recv', mode, str(size), str(seconds)], **options)
+    sender = client.containers.run(image, ['send', mode, str(size), str(seconds)], **options)
+    try:
+        sender.wait(timeout=seconds + 30)
+        receiver.wait(timeout=seconds + 30)
+        output = receiver.logs(stdout=True, stderr=False).decode('utf-8')
+        return json.loads(output.strip().splitlines()[-1])
+    finally:
+        for container in (sender, receiver):
+            container.remove(force=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='rosbox shared memory transport benchmark')
+    parser.add_argument('--image', default='python:3.11-slim', help='any image with python3')
+    parser.add_argument('--size', default='1M', help='message size')
+    parser.add_argument('--seconds', type=float, default=5.0, help='send duration per mode')
+    parser.add_argument('--modes', default='udp,shm')
+    parser.add_argument('--local', action='store_true', help='run the peers as local processes instead of containers')
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    client = None
+    if not args.local:
+        import docker
+        client = docker.from_env()
+        try:
+            client.images.get(args.image)
+        except docker.errors.ImageNotFound:
+            print(f"Pulling {args.image}...")
+            client.images.pull(args.image)
+
+    print(f"{'MODE':<6} | {'MESSAGES':>9} | {'THROUGHPUT':>14}")
+    print("-" * 36)
+    results = {}
+    for mode in args.modes.split(','):
+        if args.local:
+            result = run_local(mode, size, args.seconds)
+        else:
+            result = run_containers(client, args.image, mode, size, args.seconds)
+        if 'error' in result:
+            print(f"Error: {result['error']} in the {mode} mode")
+            exit(1)
+        throughput = result['bytes'] / result['seconds'] / 1024 ** 2 if result['seconds'] else 0.0
+        results[mode] = throughput
+        print(f"{mode:<6} | {result['bytes'] // size:>9} | {throughput:>9.1f} MB/s")
+    if 'udp' in results and 'shm' in results and results['udp']:
+        print(f"\nshm is {results['shm'] / results['udp']:.1f}x the UDP loopback throughput")
+
+if __name__ == '__main__':
+    main()
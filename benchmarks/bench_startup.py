@@ -0,0 +1,65 @@
+"""Startup benchmark for the rosbox CLI.
+
+Runs `rosbox --help` in a fresh interpreter a number of times and fails when the
+median wall time goes over the budget, or when a heavy dependency (docker, jinja2,
+pick) is imported just to parse the command line.
+
+    python benchmarks/bench_startup.py [--runs 10] [--budget-ms 150]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+heavy_modules = ['docker', 'jinja2', 'pick', 'requests']
+
+def time_command(command, runs):
+    env = dict(os.environ, PYTHONPATH=repo_root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def heavy_imports():
+    code = ("import sys, runpy\n"
+            "sys.argv = ['rosbox', '--help']\n"
+            "try:\n"
+            "    runpy.run_module('rosbox.rosbox', run_name='__main__')\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            f"print(','.join(m for m in {heavy_modules!r} if m in sys.modules), file=sys.stderr)\n")
+    env = dict(os.environ, PYTHONPATH=repo_root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, encoding='utf-8', check=True)
+    return [m for m in result.stderr.strip().split(',') if m]
+
+def main():
+    parser = argparse.ArgumentParser(description='rosbox CLI startup benchmark')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=150.0, help='maximum median time of `rosbox --help`')
+    args = parser.parse_args()
+
+    baseline = statistics.median(time_command([sys.executable, '-c', 'pass'], args.runs))
+    timings = time_command([sys.executable, '-m', 'rosbox.rosbox', '--help'], args.runs)
+    median = statistics.median(timings)
+    print(f"python startup:  {baseline * 1000:7.1f} ms")
+    print(f"rosbox --help:   {median * 1000:7.1f} ms (median of {args.runs}, min {min(timings) * 1000:.1f} ms)")
+
+    failed = False
+    imported = heavy_imports()
+    if imported:
+        print(f"FAIL: `rosbox --help` imports {', '.join(imported)}")
+        failed = True
+    if median * 1000 > args.budget_ms:
+        print(f"FAIL: `rosbox --help` took {median * 1000:.1f} ms, budget is {args.budget_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""Benchmark suite for the rosbox CLI, with an in-process fake docker daemon.
+
+Cases:
+  - startup: `rosbox --help` in a fresh interpreter
+  - render.<image>: DockerfileGenerator.generate_dockerfile for every DEFAULT_IMAGES entry
+  - list: list_containers_docker with --containers rosboxes
+  - bulk.create: `rosbox up` of a manifest with --containers rosboxes
+  - bulk.up_noop: `rosbox up` again when nothing changed
+  - bulk.stop / bulk.start / bulk.remove: the bulk commands on all rosboxes
+  - update_check.cached: the digest check of `create` answered from its TTL cache
+    (its answers are tested in tests/test_updateCheck.py)
+
+The docker calls go to benchmarks/fake_docker.py with --latency-ms per call, so the
+timings show how the code scales with the number of rosboxes and daemon round trips
+without a docker daemon.
+
+    python benchmarks/bench_suite.py [--runs 5] [--containers 300] [--save baseline.json]
+    python benchmarks/bench_suite.py --compare baseline.json [--threshold 0.25]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_root)
+
+from fake_docker import FakeDockerClient
+from bench_startup import time_command
+
+# a case is only a regression when it is also this much slower, the scheduling of the bulk threads alone moves a few ms
+noise_floor_ms = 2.0
+
+def measure(function, runs, setup=None):
+    """Return the timings of `function(state)` in ms, `setup()` makes a fresh state for every run outside the timing."""
+    timings = []
+    for _ in range(runs):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        # the rosbox output would dominate the timing of the fast cases
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            result = function(state)
+        # a bulk command that failed on some rosboxes would be timed on less work
+        if result is False:
+            print(output.getvalue())
+            raise SystemExit("FAIL: a benchmark case did not succeed")
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def bench_config():
+    from rosbox.config import DEFAULT_CONFIG
+    # no X11 or /dev mounts, nothing that depends on the machine running the benchmark
+    return dict(DEFAULT_CONFIG, use_x11=False, mount_dev_dir=False, bulk_jobs=8, pool_size=0)
+
+def make_manager(config, client, workdir):
+    from rosbox.rosbox import ContainerManager
+    from rosbox.containerIndex import ContainerIndex
+    index = ContainerIndex(path=os.path.join(workdir, f"containers.{id(client)}.json"), suffix=ContainerManager.rosbox_suffix)
+    return ContainerManager(config, client=client, index=index)
+
+def write_manifest(workdir, count):
+    path = os.path.join(workdir, 'rosbox.json')
+    boxes = {f"box{i:04d}": {"image": "rosbox-desktop:bench", "custom": True} for i in range(count)}
+    with open(path, 'w') as f:
+        json.dump({"boxes": boxes}, f)
+    return path
+
+def bulk_args(command, jobs):
+    return argparse.Namespace(command=command, jobs=jobs, timeout=0)
+
+def cached_update_check(workdir, latency):
+    from rosbox.updateCheck import UpdateChecker
+    image = 'docker.io/sterren642/rosbox:sim-latest'
+    # the first check asks the stand-in registry and fills the cache, the timed ones are answered from it
+    checker = UpdateChecker(FakeDockerClient(latency), ttl=3600, cache_file=os.path.join(workdir, 'update_check.json'),
+                            fetch_remote_digest=lambda image_name: 'sha256:' + '1' * 64)
+    checker.needs_update(image)
+    def cached(_):
+        checker.needs_update(image)
+    return cached
+
+def run_suite(args):
+    from rosbox.defaults import DEFAULT_IMAGES
+    from rosbox.defaults import entrypoint_template
+    from rosbox.imageBuilder import DockerfileGenerator
+    from rosbox.rosbox import run_bulk_command
+    from rosbox.rosboxManifest import ManifestReconciler
+
+    results = {}
+    def record(name, timings):
+        results[name] = {'median_ms': round(statistics.median(timings), 3), 'min_ms': round(min(timings), 3), 'runs': len(timings)}
+        print(f"{name:<28} {results[name]['median_ms']:>10.2f} ms (min {results[name]['min_ms']:.2f})", flush=True)
+
+    workdir = tempfile.mkdtemp(prefix='rosbox-bench-')
+    latency = args.latency_ms / 1000
+    count = args.containers
+    config = bench_config()
+
+    if not args.skip_startup:
+        record('startup', [t * 1000 for t in time_command([sys.executable, '-m', 'rosbox.rosbox', '--help'], args.runs)])
+
+    for image, image_config in DEFAULT_IMAGES.items():
+        output = os.path.join(workdir, f"Dockerfile.{image}")
+        record(f"render.{image}", measure(
+            lambda _: DockerfileGenerator().generate_dockerfile(image_config["base"], image_config["ros"], entrypoint_template(image), output, image_config["default"]),
+            args.runs))
+
+    def listing():
+        client = FakeDockerClient(latency)
+        client.add_rosboxes(count)
+        return make_manager(config, client, workdir)
+    record('list', measure(lambda manager: manager.list_containers_docker(), args.runs, listing))
+
+    manifest = write_manifest(workdir, count)
+    def empty():
+        return make_manager(config, FakeDockerClient(latency), workdir)
+    def created():
+        manager = empty()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ManifestReconciler(manager, manifest).up(jobs=args.jobs)
+        return manager
+    def all_names(manager):
+        return sorted(manager.backend.list())
+    record('bulk.create', measure(lambda manager: ManifestReconciler(manager, manifest).up(jobs=args.jobs), args.runs, empty))
+    record('bulk.up_noop', measure(lambda manager: ManifestReconciler(manager, manifest).up(jobs=args.jobs), args.runs, created))
+    record('bulk.stop', measure(lambda manager: run_bulk_command(manager, bulk_args('stop', args.jobs), all_names(manager)), args.runs, created))
+    def stopped():
+        manager = created()
+        for container in manager.client.state.values():
+            container.status = 'exited'
+        return manager
+    record('bulk.start', measure(lambda manager: run_bulk_command(manager, bulk_args('start', args.jobs), all_names(manager)), args.runs, stopped))
+    record('bulk.remove', measure(lambda manager: run_bulk_command(manager, bulk_args('remove', args.jobs), all_names(manager)), args.runs, stopped))
+    record('update_check.cached', measure(cached_update_check(workdir, latency), args.runs))
+    return results
+
+def compare(results, baseline, threshold):
+    """Print the change against the baseline and return the cases that got slower than the threshold."""
+    # the fastest run is compared, the median of the bulk cases moves with the thread scheduling
+    regressions = []
+    print(f"\n{'CASE (MIN MS)':<28} {'BASELINE':>10} {'NOW':>10} {'CHANGE':>8}")
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:<28} {'-':>10} {result['min_ms']:>10.2f} {'new':>8}")
+            continue
+        change = (result['min_ms'] - before['min_ms']) / before['min_ms'] if before['min_ms'] else 0.0
+        slower = result['min_ms'] > before['min_ms'] * (1 + threshold) and result['min_ms'] - before['min_ms'] > noise_floor_ms
+        print(f"{name:<28} {before['min_ms']:>10.2f} {result['min_ms']:>10.2f} {change * 100:>+7.0f}%" + ("  REGRESSION" if slower else ""))
+        if slower:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='rosbox benchmark suite with a fake docker daemon')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--containers', type=int, default=300, help='number of rosboxes in the list and bulk cases')
+    parser.add_argument('--jobs', type=int, default=8, help='parallel rosboxes in the bulk cases, like bulk_jobs')
+    parser.add_argument('--latency-ms', type=float, default=1.0, help='time of every fake daemon call')
+    parser.add_argument('--skip-startup', action='store_true', help='leave out the startup case')
+    parser.add_argument('--save', help='write the results as a baseline to this file', default=None)
+    parser.add_argument('--compare', help='compare with a baseline written by --save', default=None)
+    parser.add_argument('--threshold', type=float, default=0.25, help='slowdown against the baseline that counts as a regression (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    results = run_suite(args)
+    failed = False
+    if args.compare:
+        try:
+            with open(args.compare, 'r') as f:
+                baseline = json.load(f)
+        except (IOError, json.JSONDecodeError) as e:
+            print(f"No baseline to compare with ({e})")
+        else:
+            if baseline.get('settings') != vars_of(args):
+                print(f"Warning: the baseline was measured with {baseline.get('settings')}")
+            regressions = compare(results, baseline, args.threshold)
+            if regressions:
+                print(f"FAIL: {', '.join(regressions)} slower than the baseline by more than {args.threshold * 100:.0f}%")
+                failed = True
+            else:
+                print("OK")
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'settings': vars_of(args), 'python': platform.python_version(), 'machine': platform.machine(), 'results': results}, f, indent=4)
+        print(f"Baseline written to {args.save}")
+    sys.exit(1 if failed else 0)
+
+# the settings that change the results, a baseline is only comparable with the same ones
+def vars_of(args):
+    return {'runs': args.runs, 'containers': args.containers, 'jobs': args.jobs, 'latency_ms': args.latency_ms}
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""In-process stand-in for the docker client, for the benchmarks.
+
+Implements the part of docker-py that rosbox uses for the container lifecycle
+(client.containers, client.api.containers, images, info, ping) on plain dicts.
+Every call sleeps `latency` seconds like a round trip to a local daemon, so code
+that makes one call per rosbox shows up in the timings the way it does against
+a real daemon.
+"""
+import itertools
+import threading
+import time
+import uuid
+
+import docker.errors
+
+class FakeContainer:
+    def __init__(self, daemon, name, image, labels):
+        self.daemon = daemon
+        self.id = uuid.uuid4().hex + uuid.uuid4().hex
+        self.name = name
+        self.image = image
+        self.labels = dict(labels or {})
+        self.status = 'created'
+        self.host_config = {}
+
+    @property
+    def attrs(self):
+        return {'Id': self.id, 'Name': '/' + self.name, 'HostConfig': dict(self.host_config), 'Config': {'Labels': self.labels}}
+
+    def start(self):
+        self.daemon.call()
+        self.status = 'running'
+
+    def stop(self, timeout=None):
+        self.daemon.call()
+        self.status = 'exited'
+
+    def remove(self, force=False):
+        self.daemon.call()
+        with self.daemon.lock:
+            self.daemon.state.pop(self.name, None)
+
+    def update(self, **kwargs):
+        self.daemon.call()
+        self.host_config.update(kwargs)
+
+    def summary(self):
+        return {'Id': self.id, 'Names': ['/' + self.name], 'Image': self.image, 'State': self.status, 'Labels': self.labels}
+
+class FakeContainers:
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def get(self, name):
+        self.daemon.call()
+        with self.daemon.lock:
+            container = self.daemon.state.get(name)
+            if container is None:
+                container = next((c for c in self.daemon.state.values() if c.id.startswith(name)), None)
+        if container is None:
+            raise docker.errors.NotFound(f"No such container: {name}")
+        return container
+
+    def create(self, image, name=None, labels=None, **kwargs):
+        self.daemon.call()
+        with self.daemon.lock:
+            if name in self.daemon.state:
+                raise docker.errors.APIError(f"Conflict. The container name \"/{name}\" is already in use")
+            container = FakeContainer(self.daemon, name or f"fake_{next(self.daemon.counter)}", image, labels)
+            self.daemon.state[container.name] = container
+        return container
+
+    def list(self, all=False, filters=None):
+        return [self.get(summary['Id']) for summary in self.daemon.api.containers(all=all, filters=filters)]
+
+def label_matches(labels, wanted):
+    for label in wanted if isinstance(wanted, list) else [wanted]:
+        key, _, value = label.partition('=')
+        if key not in labels or (value and labels[key] != value):
+            return False
+    return True
+
+class FakeAPI:
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def containers(self, all=False, filters=None):
+        self.daemon.call()
+        filters = filters or {}
+        with self.daemon.lock:
+            containers = list(self.daemon.state.values())
+        summaries = []
+        for container in containers:
+            if not all and container.status != 'running':
+                continue
+            if 'label' in filters and not label_matches(container.labels, filters['label']):
+                continue
+            if 'status' in filters and container.status != filters['status']:
+                continue
+            summaries.append(container.summary())
+        return summaries
+
+    def rename(self, container_id, name):
+        self.daemon.call()
+        with self.daemon.lock:
+            container = next(c for c in self.daemon.state.values() if c.id == container_id)
+            if name in self.daemon.state:
+                raise docker.errors.APIError(f"name {name} is already in use")
+            del self.daemon.state[container.name]
+            container.name = name
+            self.daemon.state[name] = container
+
+    def start(self, container_id):
+        self.daemon.container_by_id(container_id).start()
+
+    def remove_container(self, container_id, force=False):
+        self.daemon.container_by_id(container_id).remove(force)
+
+class FakeImage:
+    def __init__(self, tag):
+        self.id = 'sha256:' + uuid.uuid5(uuid.NAMESPACE_URL, tag).hex
+        self.tags = [tag]
+        self.attrs = {'Id': self.id, 'RepoTags': [tag], 'RepoDigests': []}
+
+class FakeImages:
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def get(self, tag):
+        self.daemon.call()
+        return FakeImage(tag)
+
+class FakeDockerClient:
+    """The docker.DockerClient methods rosbox calls, against an in-memory daemon."""
+    def __init__(self, latency=0.0, cpus=8, memory=16 * 1024 ** 3):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        # the containers by name
+        self.state = {}
+        self.host = {'NCPU': cpus, 'MemTotal': memory}
+        self.api = FakeAPI(self)
+        self.containers = FakeContainers(self)
+        self.images = FakeImages(self)
+        self.calls = 0
+
+    def call(self):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def container_by_id(self, container_id):
+        with self.lock:
+            return next(c for c in self.state.values() if c.id == container_id)
+
+    def ping(self):
+        self.call()
+        return True
+
+    def info(self):
+        self.call()
+        return dict(self.host)
+
+    def add_rosboxes(self, count, suffix='rosbox', status='running'):
+        """Create `count` rosboxes directly, without latency, as the state a benchmark starts from."""
+        with self.lock:
+            for i in range(count):
+                container = FakeContainer(self, f"box{i:04d}_{suffix}", 'rosbox-desktop', {'type': 'rosbox'})
+                container.status = status
+                self.state[container.name] = container
@@ -0,0 +1,265 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from functools import lru_cache
+
+from .defaults import DEFAULT_IMAGES, DEFAULT_DOCKERHUB_IMAGES
+from .workspaceCache import CACHE_KINDS, parse_cache_kinds
+from .resourceProfiles import resources_help, resolve_profile
+
+# Container backends, selected with the `container_manager` config key.
+# ContainerManager dispatches the container lifecycle through the backend, so the commands and the bulk
+# operations behave the same for docker and distrobox. Commands a backend can't run are rejected up front.
+
+# the executables and the engine are looked up once per process
+@lru_cache(maxsize=None)
+def find_executable(name):
+    return shutil.which(name)
+
+@lru_cache(maxsize=None)
+def distrobox_engine():
+    # the same order distrobox itself uses: DBX_CONTAINER_MANAGER, then podman, then docker
+    preferred = os.environ.get('DBX_CONTAINER_MANAGER')
+    for engine in ([preferred] if preferred else []) + ['podman', 'docker']:
+        if find_executable(engine):
+            return engine
+    return None
+
+def create_image_help():
+    return ('If no flags: default images {' + ', '.join(DEFAULT_IMAGES.keys()) + '}. ' +
+            'If --custom: full Docker image name. ' +
+            'If --build: name default images to build locally')
+
+# how long until the shell of `enter` is usable: an interactive bash reads .bashrc (and with it the ROS setup),
+# the same shell with --norc shows what the exec itself costs
+def print_shell_timing(ready_seconds, run, runs=3):
+    def measure(command):
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            run(command)
+            samples.append(time.perf_counter() - start)
+        return sorted(samples)[len(samples) // 2]
+    shell = measure(['bash', '-i', '-c', 'true'])
+    bare = measure(['bash', '--norc', '-i', '-c', 'true'])
+    print(f"Shell ready after {(ready_seconds + shell) * 1000:.0f}ms: container {ready_seconds * 1000:.0f}ms, "
+          f"shell {shell * 1000:.0f}ms of which .bashrc {max(shell - bare, 0) * 1000:.0f}ms (median of {runs})")
+
+class DockerBackend:
+    name = 'docker'
+    builds_images = True
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def supports(self, command):
+        return True
+
+    @staticmethod
+    def add_create_arguments(parser, config):
+        parser.add_argument('name', help='name of the rosbox')
+        parser.add_argument('--custom', '-c', help='Use a custom Docker image (provide full image name)', action='store_true')
+        parser.add_argument('--build', '-b', help='Use locally built default image instead of prebuilt one', action='store_true')
+        parser.add_argument('--ros_ws', '-w', help='path to the ROS workspace', default=None)
+        parser.add_argument('--no_start', help='disable container autostart wen created', action='store_true')
+        parser.add_argument('--ssh_keys', '-s', help='mount the ssh dir from host to container', action='store_true')
+        parser.add_argument('--no_host_net', help='do not use the host network', action='store_true')
+        parser.add_argument('--offline', help='never contact the registry, use the local image as is', action='store_true')
+        parser.add_argument('--cache', help='mount shared build cache volumes, comma separated from {' + ', '.join(CACHE_KINDS) + '} (default from the config)',
+                            nargs='?', const=','.join(config["cache_kinds"]), default=None)
+        parser.add_argument('--shm', help='share the host IPC namespace and use the FastDDS shared memory transport (default from the config)', action='store_true')
+        parser.add_argument('--no_pool', help='always create a new container, never take one from the pool', action='store_true')
+        parser.add_argument('--resources', '-r', help=resources_help(config) + ' (default of the image), none for no limits', default=None)
+        parser.add_argument('--ws_volume', help='keep the workspace in a docker volume and mirror it to --ros_ws with `rosbox sync` instead of a bind mount', action='store_true')
+
+    # the image of `create` and `pool fill`
+    def resolve_image(self, args):
+        manager = self.manager
+        if args.offline:
+            manager.update_checker.offline = True
+        if args.custom:
+            return args.image
+        elif args.build:
+            return manager.select_default_image(args.image, False)
+        return manager.select_default_image(args.image, True)
+
+    def create(self, args):
+        manager = self.manager
+        image = self.resolve_image(args)
+        caches = parse_cache_kinds(args.cache) if args.cache else None
+        resources = resolve_profile(manager.config, args.resources, args.image, args.custom)
+        manager.create_container_docker(image, args.name, args.ros_ws, not args.no_start, args.ssh_keys, not args.no_host_net,
+                                        caches=caches, shm=args.shm or manager.config["shm"], use_pool=not args.no_pool, ws_volume=args.ws_volume, resources=resources)
+
+    def start(self, name):
+        return self.manager.start_container(name)
+
+    def stop(self, name, timeout=None):
+        return self.manager.stop_container(name, timeout)
+
+    def enter(self, name, timing=False):
+        return self.manager.enter_container_docker(name, timing)
+
+    def exec(self, name, command, interactive=False, prefix=None):
+        return self.manager.exec_container(name, command, interactive, prefix)
+
+    def remove(self, name):
+        return self.manager.remove_container_docker(name)
+
+    def list(self):
+        # one batched call for all rosboxes, which also refreshes the local index
+        return self.manager.index.sync(self.manager.client)
+
+    def print_list(self):
+        self.manager.list_containers_docker()
+
+class DistroboxBackend:
+    name = 'distrobox'
+    builds_images = False
+    # the docker specific features (caches, image transfer, ...) need the docker API
+    commands = {'create', 'start', 'enter', 'exec', 'stop', 'list', 'remove', 'build', 'ibuilder'}
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.suffix = manager.rosbox_suffix
+
+    def supports(self, command):
+        return command in self.commands
+
+    @staticmethod
+    def add_create_arguments(parser, config):
+        parser.add_argument('name', help='name of the rosbox')
+        parser.add_argument('--ros_home', '-w', help='path to the container home', default=None)
+        parser.add_argument('--custom', '-c', help='Use a custom image (provide full image name)', action='store_true')
+        parser.add_argument('--gpu', help='Enable NVIDIA GPU support', action='store_true')
+
+    def container_name(self, name):
+        return f"{name}_{self.suffix}"
+
+    def check_installed(self):
+        if find_executable('distrobox') is None:
+            print("Error: distrobox is not installed. Please install distrobox first!")
+            exit(1)
+
+    def engine(self):
+        engine = distrobox_engine()
+        if engine is None:
+            print("Error: no container engine for distrobox found (podman or docker)")
+            exit(1)
+        return engine
+
+    def run(self, command):
+        return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8')
+
+    def create(self, args):
+        if os.name != 'posix':
+            print("Distrobox is only supported on Linux")
+            exit(1)
+        self.check_installed()
+        image = args.image if args.custom else DEFAULT_DOCKERHUB_IMAGES[args.image]
+        print(f"Selected image: {image}")
+        command = ['distrobox', 'create', '--yes', '-i', image, '-n', self.container_name(args.name)]
+        # Add home directory if specified
+        if args.ros_home:
+            command.extend(['--home', os.path.abspath(args.ros_home)])
+        # Add NVIDIA GPU support if requested
+        if args.gpu:
+            command.append('--nvidia')
+            print("NVIDIA GPU support enabled")
+        result = self.run(command)
+        if result.returncode != 0:
+            print(f"Error creating distrobox container: {result.stderr}")
+            exit(1)
+        print(f"Distrobox container {args.name} created successfully")
+
+    def start(self, name):
+        # distrobox has no start command, the container is started through its engine
+        self.check_installed()
+        result = self.run([self.engine(), 'start', self.container_name(name)])
+        if result.returncode != 0:
+            raise Exception(result.stderr.strip())
+        print(f"Distrobox container {name} started successfully")
+
+    def stop(self, name, timeout=None):
+        self.check_installed()
+        result = self.run(['distrobox', 'stop', '--yes', self.container_name(name)])
+        if result.returncode != 0:
+            raise Exception(result.stderr.strip())
+        print(f"Distrobox container {name} stopped successfully")
+
+    def enter(self, name, timing=False):
+        self.check_installed()
+        if timing:
+            # the first enter also starts the container
+            start = time.perf_counter()
+            self.run(['distrobox', 'enter', self.container_name(name), '--', 'true'])
+            print_shell_timing(time.perf_counter() - start, lambda command: self.run(['distrobox', 'enter', self.container_name(name), '--'] + command))
+        subprocess.run(['distrobox', 'enter', self.container_name(name)])
+
+    def exec(self, name, command, interactive=False, prefix=None):
+        self.check_installed()
+        command = ['distrobox', 'enter', self.container_name(name), '--'] + command
+        if prefix is None:
+            return subprocess.run(command).returncode
+        from .execSession import PrefixedWriter, output_lock
+        writer = PrefixedWriter(prefix, sys.stdout.buffer, output_lock)
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        for line in process.stdout:
+            writer.write(line)
+        writer.close()
+        return process.wait()
+
+    def remove(self, name):
+        self.check_installed()
+        result = self.run(['distrobox', 'rm', '--yes', self.container_name(name)])
+        if result.returncode != 0:
+            raise Exception(result.stderr.strip())
+        print(f"Distrobox container {name} removed successfully")
+        return True
+
+    def list(self):
+        """Return the rosbox distrobox containers from the engine, selected by the label distrobox sets."""
+        engine = self.engine()
+        containers = {}
+        if engine == 'docker':
+            summaries = self.manager.client.api.containers(all=True, filters={"label": "manager=distrobox"})
+            entries = [(summary['Names'][0].lstrip('/'), summary['Id'], summary['State'], summary['Image']) for summary in summaries]
+        else:
+            result = self.run([engine, 'ps', '--all', '--filter', 'label=manager=distrobox', '--format', 'json'])
+            if result.returncode != 0:
+                raise Exception(result.stderr.strip())
+            entries = [(entry['Names'][0], entry['Id'], entry['State'], entry['Image']) for entry in json.loads(result.stdout or '[]')]
+        for container_name, container_id, state, image in entries:
+            if container_name.endswith('_' + self.suffix):
+                containers[container_name[:-len('_' + self.suffix)]] = {'id': container_id, 'status': state, 'image': image}
+        return containers
+
+    def print_list(self):
+        try:
+            containers = self.list()
+        except Exception as e:
+            print(f"Error listing distrobox containers: {str(e)}")
+            return
+        if not containers:
+            print(f"No distrobox containers with _{self.suffix} suffix found.")
+            return
+        print(f"{'ID':<12} | {'NAME':<20} | {'STATUS':<20} | {'IMAGE':<20}")
+        print("-" * 72)
+        for name, container in sorted(containers.items()):
+            print(f"{container['id'][:12]:<12} | {name:<20} | {container['status']:<20} | {container['image']:<20}")
+        print(("-" * 72) + "\n")
+
+BACKENDS = {
+    'docker': DockerBackend,
+    'distrobox': DistroboxBackend,
+}
+
+def get_backend_class(config):
+    backend = BACKENDS.get(config["container_manager"])
+    if backend is None:
+        print(f"Error: unknown container_manager '{config['container_manager']}', choose from {', '.join(BACKENDS)}")
+        exit(1)
+    return backend
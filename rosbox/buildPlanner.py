@@ -0,0 +1,183 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import docker
+
+from .defaults import DEFAULT_IMAGES, entrypoint_template
+from .dockerfileOptimizer import optimize_dockerfile
+from .imageBuilder import fingerprint_label, image_label, fingerprint_version
+
+# intermediate stages are tagged by content, so an existing tag means the stage can be reused
+stage_repository = 'rosbox-stage'
+
+# one stage of the build graph: a Dockerfile built on top of the image of its parent stage
+class BuildStage:
+    def __init__(self, key, kind, template, dockerfile, assets, fingerprint, parent=None):
+        self.key = key
+        self.kind = kind
+        self.template = template
+        self.dockerfile = dockerfile
+        self.assets = assets
+        self.fingerprint = fingerprint
+        self.parent = parent
+        self.children = []
+        self.images = []
+        self.leaf_image = None
+        self.tag = f"{stage_repository}-{kind}:{fingerprint[:16]}"
+        self.labels = {fingerprint_label: fingerprint}
+        self.status = 'pending'
+        self.seconds = 0.0
+        self.cached_steps = 0
+        self.total_steps = 0
+        self.finished_at = None
+        self.log = []
+        self.profile = None
+
+    @property
+    def name(self):
+        if self.leaf_image:
+            return f"{self.kind}:{self.template} -> {self.leaf_image}"
+        return f"{self.kind}:{self.template}"
+
+# turns DEFAULT_IMAGES into a DAG of base -> ros -> default -> entrypoint stages and builds it in parallel
+class BuildPlanner:
+    def __init__(self, generator, image_builder, client, optimize=True, profile=False, fast_env=False):
+        self.generator = generator
+        self.image_builder = image_builder
+        self.client = client
+        self.optimize = optimize
+        self.profile = profile
+        self.fast_env = fast_env
+        self.stages = {}
+        self.leaves = {}
+        self.print_lock = threading.Lock()
+
+    def plan(self, images):
+        for image in images:
+            config = DEFAULT_IMAGES[image]
+            entrypoint = entrypoint_template(image, self.fast_env)
+            rendered = self.generator.render_stages(config["base"], config["ros"], entrypoint, config["default"])
+            templates = {'base': config["base"], 'ros': config["ros"], 'default': config["default"], 'entrypoint': entrypoint}
+            parent = None
+            for index, (kind, chunk) in enumerate(rendered):
+                dockerfile = chunk if parent is None else f"FROM {parent.tag}\n{chunk}"
+                if self.optimize:
+                    dockerfile, _ = optimize_dockerfile(dockerfile)
+                # the stage hash chains the parent hash, so a changed base invalidates everything on top of it
+                digest = hashlib.sha256()
+                digest.update(f"{fingerprint_version}:{parent.fingerprint if parent else ''}:{kind}".encode())
+                digest.update(dockerfile.encode())
+                assets = self.generator.collect_assets(dockerfile)
+                for arcname, path in sorted(assets.items()):
+                    with open(path, 'rb') as file:
+                        digest.update(arcname.encode() + hashlib.sha256(file.read()).digest())
+                fingerprint = digest.hexdigest()
+                is_leaf = index == len(rendered) - 1
+                key = ('leaf', image) if is_leaf else fingerprint
+                stage = self.stages.get(key)
+                if stage is None:
+                    stage = BuildStage(key, kind, templates[kind], dockerfile, assets, fingerprint, parent)
+                    self.stages[key] = stage
+                    if parent is not None:
+                        parent.children.append(stage)
+                stage.images.append(image)
+                parent = stage
+            # the leaf is tagged with the image name and carries the same fingerprint as a single `rosbox build`
+            parent.tag = config["image-name"]
+            parent.leaf_image = image
+            parent.labels = {
+                fingerprint_label: self.generator.compute_fingerprint(config["base"], config["ros"], entrypoint, config["default"], self.optimize),
+                image_label: image,
+            }
+            self.leaves[image] = parent
+        return self.stages
+
+    def is_cached(self, stage):
+        try:
+            local_image = self.client.images.get(stage.tag)
+        except docker.errors.ImageNotFound:
+            return False
+        return (local_image.labels or {}).get(fingerprint_label) == stage.labels[fingerprint_label]
+
+    def say(self, stage, message):
+        with self.print_lock:
+            print(f"[{stage.name}] {message}")
+
+    def build_stage(self, stage, force):
+        start = time.perf_counter()
+        if not force and self.is_cached(stage):
+            stage.status = 'cached'
+            self.say(stage, f"up to date ({stage.tag})")
+            return stage
+
+        def on_event(event):
+            if event['type'] == 'step':
+                stage.total_steps += 1
+                self.say(stage, f"[{event['step']}/{event['total']}] {event['instruction'][:100]}")
+            elif event['type'] == 'cache':
+                stage.cached_steps += 1
+            elif event['type'] == 'log':
+                stage.log.append(event['message'])
+
+        if self.profile:
+            from .buildProfiler import BuildProfile
+            # a leaf stage is stored under its image name, like a `rosbox build` of that image, so both share one history
+            stage.profile = BuildProfile(stage.leaf_image or stage.name, stage.labels[fingerprint_label])
+            on_event = stage.profile.wrap(on_event)
+        try:
+            self.image_builder.build_image(stage.tag, stage.assets, on_event, stage.labels, stage.dockerfile)
+            stage.status = 'built'
+        except Exception as e:
+            stage.status = 'failed'
+            with self.print_lock:
+                print(f"[{stage.name}] build failed: {str(e)}")
+                for line in stage.log[-30:]:
+                    print(f"[{stage.name}]     {line}")
+        finally:
+            stage.seconds = time.perf_counter() - start
+            if stage.profile is not None:
+                stage.profile.finish()
+        return stage
+
+    def skip_descendants(self, stage):
+        for child in stage.children:
+            child.status = 'skipped'
+            self.skip_descendants(child)
+
+    def build(self, jobs, force=False):
+        start = time.perf_counter()
+        roots = [stage for stage in self.stages.values() if stage.parent is None]
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            running = {pool.submit(self.build_stage, stage, force) for stage in roots}
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = future.result()
+                    stage.finished_at = time.perf_counter() - start
+                    if stage.status == 'failed':
+                        self.skip_descendants(stage)
+                        continue
+                    for child in stage.children:
+                        running.add(pool.submit(self.build_stage, child, force))
+        return all(leaf.status in ('built', 'cached') for leaf in self.leaves.values())
+
+    def print_report(self):
+        print(f"\n{'STAGE':<40} | {'STATUS':<8} | {'TIME':>8} | {'CACHED STEPS':<12} | IMAGES")
+        print("-" * 108)
+        for stage in self.stages.values():
+            steps = f"{stage.cached_steps}/{stage.total_steps}" if stage.status == 'built' else '-'
+            print(f"{stage.name:<40} | {stage.status:<8} | {stage.seconds:>7.1f}s | {steps:<12} | {', '.join(stage.images)}")
+        print(f"\n{'IMAGE':<20} | {'STATUS':<8} | {'WALL TIME':>9} | CACHED STAGES")
+        print("-" * 60)
+        for image, leaf in self.leaves.items():
+            chain = []
+            stage = leaf
+            while stage is not None:
+                chain.append(stage)
+                stage = stage.parent
+            cached = sum(1 for stage in chain if stage.status == 'cached')
+            wall = f"{leaf.finished_at:>8.1f}s" if leaf.finished_at is not None else f"{'-':>9}"
+            print(f"{image:<20} | {leaf.status:<8} | {wall} | {cached}/{len(chain)}")
+        print()
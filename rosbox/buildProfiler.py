@@ -0,0 +1,173 @@
+import json
+import os
+import statistics
+import time
+
+from .config import get_state_file
+
+# Per-step build timings.
+# The build event stream is timed step by step, every build is stored in a JSON history per image
+# (tagged with the template fingerprint) and compared with the previous builds of the same steps.
+
+build_profile_file = 'build_profiles.json'
+history_limit = 20
+# a step is a regression when it is this much slower than its median, and at least min_regression_seconds
+regression_ratio = 1.25
+min_regression_seconds = 5.0
+
+def step_key(instruction):
+    # step numbers shift when templates change, the instruction itself identifies a step across builds
+    return ' '.join(instruction.split())
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds >= 60:
+        return f"{int(seconds // 60)}m{seconds % 60:04.1f}s"
+    return f"{seconds:.1f}s"
+
+# records the steps of one build from the events of parse_build_output
+class BuildProfile:
+    def __init__(self, name, fingerprint=None):
+        self.name = name
+        self.fingerprint = fingerprint
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.steps = []
+        self.seconds = None
+        self.current = None
+
+    def finish_step(self, now):
+        if self.current is not None:
+            self.current['seconds'] = now - self.current.pop('started')
+            self.current = None
+
+    def record(self, event):
+        now = time.perf_counter()
+        if event['type'] == 'step':
+            self.finish_step(now)
+            self.current = {'step': event['step'], 'instruction': event['instruction'], 'cached': False, 'started': now}
+            self.steps.append(self.current)
+        elif event['type'] == 'cache' and self.current is not None:
+            self.current['cached'] = True
+
+    def wrap(self, on_event):
+        def handler(event):
+            self.record(event)
+            on_event(event)
+        return handler
+
+    def finish(self):
+        if self.seconds is not None:
+            return
+        self.finish_step(time.perf_counter())
+        self.seconds = time.perf_counter() - self.start
+
+    def to_dict(self):
+        return {
+            'fingerprint': self.fingerprint,
+            'started_at': self.started_at,
+            'seconds': self.seconds,
+            'commit': os.environ.get('GITHUB_SHA'),
+            'steps': self.steps,
+        }
+
+class ProfileHistory:
+    def __init__(self, path=None):
+        self.path = path if path is not None else get_state_file(build_profile_file)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (IOError, json.JSONDecodeError):
+            return {}
+
+    def save(self, history):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(history, f, indent=4)
+        except IOError as e:
+            print(f"Warning: could not save build profile history: {e}")
+
+    def add(self, profile):
+        """Store a finished build and return the builds before it."""
+        history = self.load()
+        runs = history.get(profile.name, [])
+        previous = list(runs)
+        runs.append(profile.to_dict())
+        history[profile.name] = runs[-history_limit:]
+        self.save(history)
+        return previous
+
+def compare(profile, previous):
+    """Compare every step with the median of its uncached runs in the previous builds."""
+    baselines = {}
+    for run in previous:
+        for step in run['steps']:
+            if not step['cached'] and step.get('seconds') is not None:
+                baselines.setdefault(step_key(step['instruction']), []).append(step['seconds'])
+    rows = []
+    for step in profile.steps:
+        samples = baselines.get(step_key(step['instruction']))
+        baseline = statistics.median(samples) if samples else None
+        regression = (baseline is not None and not step['cached']
+                      and step['seconds'] > baseline * regression_ratio
+                      and step['seconds'] - baseline >= min_regression_seconds)
+        rows.append(dict(step, baseline=baseline, regression=regression))
+    totals = [run['seconds'] for run in previous if run.get('seconds') is not None]
+    return {
+        'name': profile.name,
+        'fingerprint': profile.fingerprint,
+        'seconds': profile.seconds,
+        'previous_seconds': statistics.median(totals) if totals else None,
+        'previous_runs': len(previous),
+        'fingerprint_changed': bool(previous) and previous[-1].get('fingerprint') != profile.fingerprint,
+        'cached_steps': sum(1 for step in profile.steps if step['cached']),
+        'steps': rows,
+    }
+
+def print_profile_report(report, top=10):
+    previous = f", median of {report['previous_runs']} previous builds {format_seconds(report['previous_seconds'])}" if report['previous_runs'] else ', no previous builds'
+    print(f"\nBuild profile of {report['name']}: {format_seconds(report['seconds'])}{previous}")
+    print(f"{report['cached_steps']}/{len(report['steps'])} steps cached" + (", templates changed since the last build" if report['fingerprint_changed'] else ''))
+    print(f"{'STEP':>4} | {'TIME':>9} | {'BASELINE':>9} | {'DELTA':>8} | {'':<6} | INSTRUCTION")
+    print("-" * 110)
+    for row in sorted(report['steps'], key=lambda r: -(r['seconds'] or 0))[:top]:
+        delta = f"{row['seconds'] - row['baseline']:+.1f}s" if row['baseline'] is not None else '-'
+        flag = 'cached' if row['cached'] else ('SLOWER' if row['regression'] else '')
+        print(f"{row['step']:>4} | {format_seconds(row['seconds']):>9} | {format_seconds(row['baseline']):>9} | {delta:>8} | {flag:<6} | {row['instruction'][:60]}")
+    regressions = [row for row in report['steps'] if row['regression']]
+    if regressions:
+        print(f"\n{len(regressions)} step(s) got slower than {regression_ratio:.2f}x their median:")
+        for row in regressions:
+            print(f"  step {row['step']}: {format_seconds(row['baseline'])} -> {format_seconds(row['seconds'])}  {row['instruction'][:70]}")
+    print()
+
+def write_step_summary(report, top=10):
+    # GitHub Actions renders this file as the summary of the job
+    path = os.environ.get('GITHUB_STEP_SUMMARY')
+    if not path:
+        return
+    lines = [f"### Build profile: {report['name']}", '',
+             f"Total {format_seconds(report['seconds'])}"
+             + (f" (median of previous builds {format_seconds(report['previous_seconds'])})" if report['previous_runs'] else '')
+             + f", {report['cached_steps']}/{len(report['steps'])} steps cached", '',
+             '| Step | Time | Baseline | | Instruction |', '|---:|---:|---:|---|---|']
+    for row in sorted(report['steps'], key=lambda r: -(r['seconds'] or 0))[:top]:
+        flag = 'cached' if row['cached'] else (':warning: slower' if row['regression'] else '')
+        instruction = row['instruction'][:80].replace('|', '\\|')
+        lines.append(f"| {row['step']} | {format_seconds(row['seconds'])} | {format_seconds(row['baseline'])} | {flag} | `{instruction}` |")
+    with open(path, 'a') as f:
+        f.write('\n'.join(lines) + '\n\n')
+
+def report_build(profile, history_path=None, top=10):
+    """Finish a profile, store it in the history and print the comparison with the previous builds."""
+    profile.finish()
+    previous = ProfileHistory(history_path).add(profile)
+    report = compare(profile, previous)
+    print_profile_report(report, top)
+    write_step_summary(report, top)
+    return report
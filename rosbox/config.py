@@ -6,7 +6,21 @@ from pathlib import Path
 DEFAULT_CONFIG = {
     "container_manager": "docker",
     "use_x11": True,
-    "mount_dev_dir": True
+    "mount_dev_dir": True,
+    "update_check_ttl": 3600,
+    "offline": False,
+    "stop_timeout": 10,
+    "bulk_jobs": 8,
+    "cache_kinds": ["ccache"],
+    "cache_max_size": "5G",
+    "shm": False,
+    "shm_size": "64M",
+    "pool_size": 2,
+    "fleet": {},
+    "fleet_timeout": 10,
+    "sync_ignore": ["/build", "/install", "/log"],
+    "sync_interval": 2,
+    "resource_profiles": {}
 }
 
 def get_config_dir():
@@ -24,6 +38,10 @@ def get_config_file():
     """Get the path to the config file."""
     return os.path.join(get_config_dir(), "config.json")
 
+def get_state_file(filename):
+    """Get the path to a state/cache file stored next to the config file."""
+    return os.path.join(get_config_dir(), filename)
+
 def load_config():
     """Load the configuration file or create default if not exists."""
     config_file = get_config_file()
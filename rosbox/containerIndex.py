@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+import time
+
+from .config import get_state_file
+
+container_index_file = 'containers.json'
+rosbox_label_filter = {"label": "type=rosbox"}
+
+# Local index of the rosbox containers (id, status, image and the options they were created with).
+# It is rewritten from one batched daemon call on `list` and kept up to date by the other commands,
+# so shell completion can answer without touching the daemon.
+class ContainerIndex:
+    def __init__(self, path=None, suffix='rosbox'):
+        self.path = path if path is not None else get_state_file(container_index_file)
+        self.suffix = suffix
+        self.synced_at = None
+        self.containers = {}
+        # bulk operations update the index from several threads
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.synced_at = data.get('synced_at')
+            self.containers = data.get('containers', {})
+        except (IOError, json.JSONDecodeError):
+            self.synced_at = None
+            self.containers = {}
+
+    def save(self):
+        # write to a temporary file first so a concurrent reader never sees a half written index
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with self.lock:
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump({'synced_at': self.synced_at, 'containers': self.containers}, f, indent=4)
+                os.replace(tmp_path, self.path)
+            except IOError as e:
+                print(f"Warning: could not save container index: {e}")
+
+    def short_name(self, container_name):
+        return container_name.lstrip('/').replace('_' + self.suffix, '')
+
+    def sync(self, client):
+        """Revalidate the index against the daemon with a single list call."""
+        summaries = client.api.containers(all=True, filters=rosbox_label_filter)
+        containers = {}
+        for summary in summaries:
+            # idle containers of the pool are no rosboxes until `create` renames them
+            if not summary['Names'][0].endswith('_' + self.suffix):
+                continue
+            name = self.short_name(summary['Names'][0])
+            entry = self.containers.get(name, {})
+            if entry.get('id') != summary['Id']:
+                # a container recreated outside of rosbox, its options are unknown
+                entry = {}
+            entry.update({
+                'id': summary['Id'],
+                'status': summary['State'],
+                'image': summary['Image'],
+            })
+            containers[name] = entry
+        self.containers = containers
+        self.synced_at = time.time()
+        self.save()
+        return self.containers
+
+    def update(self, name, **fields):
+        with self.lock:
+            self.containers.setdefault(name, {}).update(fields)
+            self.save()
+
+    def remove(self, name):
+        with self.lock:
+            if self.containers.pop(name, None) is not None:
+                self.save()
+
+    def names(self):
+        return sorted(self.containers.keys())
+
+# argcomplete completer for rosbox names, reads the index only
+def complete_rosbox_names(prefix, **kwargs):
+    return [name for name in ContainerIndex().names() if name.startswith(prefix)]
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import get_state_file
+from .tracing import traced
+
+# Pre-warmed rosboxes.
+# `rosbox pool fill` creates and starts generic containers per image, `rosbox create` renames one of them
+# instead of creating and starting a new container. Docker can't add mounts to an existing container, so a
+# pooled container is only taken when it was created with the same options (workspace, ssh keys, network,
+# caches, shm) from the same image id. Anything else falls back to a normal create.
+
+pool_label = 'rosbox.pool'
+pool_image_label = 'rosbox.pool.image'
+pool_prefix = 'rosbox-pool-'
+pool_hostname = 'rosbox'
+pool_stats_file = 'pool_stats.json'
+samples_limit = 50
+
+def pool_key(image_id, options, config):
+    """Return the key of the containers that can serve a create with these options."""
+    data = {
+        'image': image_id,
+        'options': dict(options, caches=sorted(options.get('caches') or [])),
+        'use_x11': config["use_x11"],
+        'mount_dev_dir': config["mount_dev_dir"],
+        # the Xauthority file is mounted from its path in the host session
+        'xauthority': os.environ.get('XAUTHORITY') if config["use_x11"] else None,
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+
+def empty_stats():
+    return {'hits': 0, 'misses': 0, 'hit_seconds': [], 'miss_seconds': []}
+
+def median_ms(samples):
+    return f"{statistics.median(samples) * 1000:.0f}ms" if samples else '-'
+
+class ContainerPool:
+    def __init__(self, manager, path=None):
+        self.manager = manager
+        self.path = path if path is not None else get_state_file(pool_stats_file)
+        # the bulk commands create rosboxes in parallel, each one updates the stats file
+        self.lock = threading.Lock()
+
+    @property
+    def client(self):
+        return self.manager.client
+
+    def key(self, image_tag, options):
+        return pool_key(self.client.images.get(image_tag).id, options, self.manager.config)
+
+    def members(self, key=None, image_tag=None):
+        """Return the idle pool containers, optionally only the ones of a key or an image."""
+        labels = [f"{pool_label}={key}" if key else pool_label]
+        if image_tag:
+            labels.append(f"{pool_image_label}={image_tag}")
+        summaries = self.client.api.containers(all=True, filters={"label": labels})
+        # claimed containers keep their labels, only the pool names are idle
+        return [summary for summary in summaries if summary['Names'][0].lstrip('/').startswith(pool_prefix)]
+
+    def create_member(self, image_tag, options, key):
+        manager = self.manager
+        create_options = manager.container_create_options(image_tag, pool_hostname, options['ros_ws'], options['ssh_keys'],
+                                                          options['host_net'], options['caches'], options['shm'], resources=options.get('resources'))
+        create_options['labels'].update({pool_label: key, pool_image_label: image_tag})
+        container = self.client.containers.create(image_tag, name=pool_prefix + uuid.uuid4().hex[:12], **create_options)
+        container.start()
+        if options['caches']:
+            manager.workspace_cache.prepare(container, options['caches'])
+        return container.id
+
+    def fill(self, image_tag, options, size, jobs):
+        key = self.key(image_tag, options)
+        missing = size - len(self.members(key))
+        self.track(image_tag)
+        if missing <= 0:
+            print(f"Pool of {image_tag} already has {size} rosboxes")
+            return True
+        start = time.perf_counter()
+        def create(_):
+            try:
+                self.create_member(image_tag, options, key)
+                return None
+            except Exception as e:
+                return str(e)
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, missing))) as pool:
+            errors = [error for error in pool.map(create, range(missing)) if error is not None]
+        for error in errors:
+            print(f"Error creating a pool rosbox: {error}")
+        print(f"Added {missing - len(errors)} rosboxes to the pool of {image_tag} in {time.perf_counter() - start:.1f}s")
+        return not errors
+
+    @traced('pool.claim')
+    def claim(self, image_tag, options, container_name):
+        """Rename an idle pool container to container_name and return its id, or None."""
+        import docker
+        candidates = self.members(self.key(image_tag, options))
+        # running ones first, they are ready for a shell right away
+        for summary in sorted(candidates, key=lambda s: s['State'] != 'running'):
+            try:
+                # the rename is atomic, a concurrent create that took the same container makes it fail
+                self.client.api.rename(summary['Id'], container_name)
+            except docker.errors.APIError:
+                continue
+            if summary['State'] != 'running':
+                self.client.api.start(summary['Id'])
+            left = len(candidates) - 1
+            print(f"{left} rosbox{'es' if left != 1 else ''} left in the pool of {image_tag}" + (", refill it with `rosbox pool fill`" if left == 0 else ''))
+            return summary['Id']
+        return None
+
+    def wait_ready(self, container_id):
+        # the first exec is what `rosbox enter` waits for
+        exec_id = self.client.api.exec_create(container_id, ['true'])['Id']
+        self.client.api.exec_start(exec_id)
+
+    def drain(self, image_tag=None, jobs=8):
+        members = self.members(image_tag=image_tag)
+        def remove(summary):
+            try:
+                self.client.api.remove_container(summary['Id'], force=True)
+                return None
+            except Exception as e:
+                return f"{summary['Names'][0].lstrip('/')}: {e}"
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(members) or 1))) as pool:
+            errors = [error for error in pool.map(remove, members) if error is not None]
+        for error in errors:
+            print(f"Error removing a pool rosbox: {error}")
+        print(f"Removed {len(members) - len(errors)} rosboxes from the pool")
+        # a drained image is no longer pooled, its creates skip the pool again
+        with self.lock:
+            stats = self.load()
+            self.save({} if image_tag is None else {tag: entry for tag, entry in stats.items() if tag != image_tag})
+        return not errors
+
+    # the hit rate and the time to a usable shell, per pooled image
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (IOError, json.JSONDecodeError):
+            return {}
+
+    def save(self, stats):
+        # write to a temporary file first so a concurrent reader never sees a half written file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(stats, f, indent=4)
+            os.replace(tmp_path, self.path)
+        except IOError as e:
+            print(f"Warning: could not save pool stats: {e}")
+
+    def track(self, image_tag):
+        with self.lock:
+            stats = self.load()
+            if image_tag not in stats:
+                stats[image_tag] = empty_stats()
+                self.save(stats)
+
+    def tracks(self, image_tag):
+        # only images that were pooled once are measured, every other create skips the pool entirely
+        return image_tag in self.load()
+
+    def record(self, image_tag, hit, seconds):
+        with self.lock:
+            stats = self.load()
+            entry = stats.setdefault(image_tag, empty_stats())
+            count, samples = ('hits', 'hit_seconds') if hit else ('misses', 'miss_seconds')
+            entry[count] += 1
+            entry[samples] = (entry[samples] + [seconds])[-samples_limit:]
+            self.save(stats)
+
+    def print_status(self):
+        stats = self.load()
+        idle = {}
+        for summary in self.members():
+            image_tag = summary['Labels'].get(pool_image_label, summary['Image'])
+            idle.setdefault(image_tag, []).append(summary)
+        print(f"{'IMAGE':<40} | {'IDLE':>4} | {'HITS':>5} | {'MISSES':>6} | {'HIT RATE':>8} | {'READY HIT':>9} | {'READY MISS':>10}")
+        print("-" * 100)
+        for image_tag in sorted(set(idle) | set(stats)):
+            entry = stats.get(image_tag, empty_stats())
+            total = entry['hits'] + entry['misses']
+            rate = f"{entry['hits'] / total:.0%}" if total else '-'
+            print(f"{image_tag:<40} | {len(idle.get(image_tag, [])):>4} | {entry['hits']:>5} | {entry['misses']:>6} | {rate:>8} | "
+                  f"{median_ms(entry['hit_seconds']):>9} | {median_ms(entry['miss_seconds']):>10}")
+        print(("-" * 100) + "\n")
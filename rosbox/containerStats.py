@@ -0,0 +1,141 @@
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .containerIndex import rosbox_label_filter
+from .workspaceCache import format_size
+
+# CPU, memory, network and block I/O of the running rosboxes.
+# The stats API needs two samples a second apart for the CPU usage, so a single call blocks about a
+# second: all rosboxes are sampled at the same time, and the live table keeps one stats stream per rosbox.
+
+max_workers = 32
+
+def parse_stats(name, sample):
+    """Turn one sample of the stats API into the numbers `docker stats` shows."""
+    cpu = sample.get('cpu_stats') or {}
+    precpu = sample.get('precpu_stats') or {}
+    cpu_delta = cpu.get('cpu_usage', {}).get('total_usage', 0) - precpu.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+    online_cpus = cpu.get('online_cpus') or len(cpu.get('cpu_usage', {}).get('percpu_usage') or []) or 1
+    cpu_percent = cpu_delta / system_delta * online_cpus * 100 if cpu_delta > 0 and system_delta > 0 else 0.0
+
+    memory = sample.get('memory_stats') or {}
+    details = memory.get('stats') or {}
+    # the page cache is not counted, like docker stats (cache on cgroup v1, inactive_file on v2)
+    memory_usage = memory.get('usage', 0) - details.get('inactive_file', details.get('cache', 0))
+    memory_limit = memory.get('limit', 0)
+
+    networks = sample.get('networks')
+    net_rx = sum(network.get('rx_bytes', 0) for network in networks.values()) if networks else None
+    net_tx = sum(network.get('tx_bytes', 0) for network in networks.values()) if networks else None
+
+    block_read = 0
+    block_write = 0
+    for entry in (sample.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []:
+        if entry.get('op', '').lower() == 'read':
+            block_read += entry.get('value', 0)
+        elif entry.get('op', '').lower() == 'write':
+            block_write += entry.get('value', 0)
+
+    return {
+        'name': name,
+        'id': sample.get('id'),
+        'cpu_percent': round(cpu_percent, 2),
+        'memory_usage': max(memory_usage, 0),
+        'memory_limit': memory_limit,
+        'memory_percent': round(memory_usage / memory_limit * 100, 2) if memory_limit else 0.0,
+        'net_rx': net_rx,
+        'net_tx': net_tx,
+        'block_read': block_read,
+        'block_write': block_write,
+        'pids': (sample.get('pids_stats') or {}).get('current'),
+    }
+
+def print_table(rows):
+    print(f"{'NAME':<20} | {'CPU %':>7} | {'MEM USAGE / LIMIT':>21} | {'MEM %':>6} | {'NET I/O':>19} | {'BLOCK I/O':>19} | {'PIDS':>5}")
+    print("-" * 115)
+    for row in sorted(rows, key=lambda r: -r['cpu_percent']):
+        memory = f"{format_size(row['memory_usage'])} / {format_size(row['memory_limit'])}"
+        net = f"{format_size(row['net_rx'])} / {format_size(row['net_tx'])}" if row['net_rx'] is not None else 'host network'
+        block = f"{format_size(row['block_read'])} / {format_size(row['block_write'])}"
+        pids = row['pids'] if row['pids'] is not None else '-'
+        print(f"{row['name']:<20} | {row['cpu_percent']:>6.1f}% | {memory:>21} | {row['memory_percent']:>5.1f}% | {net:>19} | {block:>19} | {pids:>5}")
+    print(("-" * 115) + "\n")
+
+class ContainerStats:
+    def __init__(self, client, suffix='rosbox'):
+        self.client = client
+        self.suffix = suffix
+        self.samples = {}
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def running(self):
+        """Return {name: id} of the running rosboxes, one list call filtered on the rosbox label."""
+        summaries = self.client.api.containers(filters=dict(rosbox_label_filter, status='running'))
+        containers = {}
+        for summary in summaries:
+            name = summary['Names'][0].lstrip('/')
+            # idle pool containers don't have the suffix yet
+            if name.endswith('_' + self.suffix):
+                containers[name[:-len('_' + self.suffix)]] = summary['Id']
+        return containers
+
+    def sample(self):
+        """Sample all running rosboxes at once and return their rows."""
+        containers = self.running()
+        if not containers:
+            return []
+        def read(item):
+            name, container_id = item
+            try:
+                return parse_stats(name, self.client.api.stats(container_id, stream=False))
+            except Exception:
+                # stopped while it was sampled
+                return None
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(containers))) as pool:
+            return [row for row in pool.map(read, containers.items()) if row is not None]
+
+    def follow(self, name, container_id):
+        try:
+            for sample in self.client.api.stats(container_id, decode=True, stream=True):
+                with self.lock:
+                    self.samples[name] = parse_stats(name, sample)
+        except Exception:
+            pass
+        with self.lock:
+            self.samples.pop(name, None)
+            self.streams.pop(name, None)
+
+    def live_rows(self):
+        # rosboxes started while the table is shown get a stream too
+        containers = self.running()
+        with self.lock:
+            for name, container_id in containers.items():
+                if name not in self.streams:
+                    thread = threading.Thread(target=self.follow, args=(name, container_id), daemon=True)
+                    self.streams[name] = thread
+                    thread.start()
+            return [row for name, row in self.samples.items() if name in containers]
+
+    def watch(self, interval=2.0, as_json=False):
+        try:
+            # the streams send their first sample after about a second
+            self.live_rows()
+            time.sleep(1.2)
+            while True:
+                rows = self.live_rows()
+                if as_json:
+                    print(json.dumps(rows), flush=True)
+                else:
+                    # clear the screen and draw the table again at the top
+                    sys.stdout.write("\033[H\033[J")
+                    print(time.strftime('%H:%M:%S') + f"  {len(rows)} running rosboxes (ctrl+C to quit)\n")
+                    print_table(rows)
+                    sys.stdout.flush()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
@@ -6,6 +6,13 @@ DEFAULT_IMAGES = {
     "sim": {"base":"universal", "ros":"ros-desktop", "entrypoint":"rosbox", "image-name":"rosbox-sim", "default":"sim"}
 }
 
+# `rosbox build --fast_env` uses the variant of the entrypoint template that bakes the ROS environment into a snapshot
+FAST_ENV_SUFFIX = "-fastenv"
+
+def entrypoint_template(image, fast_env=False):
+    entrypoint = DEFAULT_IMAGES[image]["entrypoint"]
+    return entrypoint + FAST_ENV_SUFFIX if fast_env else entrypoint
+
 DEFAULT_DOCKERHUB_IMAGES = {
     "robot-jetracer": "docker.io/sterren642/rosbox:robot-jetracer-latest",
     "robot-jetank": "docker.io/sterren642/rosbox:robot_jetank-latest",
@@ -13,3 +20,21 @@ DEFAULT_DOCKERHUB_IMAGES = {
     "desktop": "docker.io/sterren642/rosbox:desktop-latest",
     "desktopjazzy": "docker.io/sterren642/rosbox:desktopjazzy-latest"
 }
+
+# resource profiles of `rosbox create --resources`, the `resource_profiles` config key adds and overrides profiles
+DEFAULT_RESOURCE_PROFILES = {
+    # Jetson Nano class boards with 4GB: leaves memory and processes for the host, control nodes may use realtime priorities
+    "arm-board": {"memory": "3G", "swap": "1G", "pids": 1024, "shm_size": "256M", "realtime": True},
+    # boards with 2GB like the Jetson Nano 2GB or a Raspberry Pi
+    "arm-board-small": {"memory": "1536M", "swap": "1G", "pids": 512, "shm_size": "128M", "realtime": True},
+    # a simulator next to other rosboxes: keeps a core and some memory free for RViz and teleop
+    "sim": {"cpus_fraction": 0.75, "memory_fraction": 0.75, "cpu_shares": 512},
+    # rosboxes running ros2_control and other nodes with realtime threads
+    "realtime": {"realtime": True, "cpu_shares": 2048},
+}
+
+# the profile a default image gets when create has no --resources
+DEFAULT_IMAGE_RESOURCES = {
+    "robot-jetracer": "arm-board",
+    "robot-jetank": "arm-board",
+}
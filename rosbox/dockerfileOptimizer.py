@@ -0,0 +1,235 @@
+import os
+import re
+
+# Optimizing pass over a rendered Dockerfile.
+# The templates are written as one small RUN per package group, which gives one layer per group
+# and leaves the apt lists in every layer before the final cleanup. This pass:
+#   - merges consecutive RUN instructions that only do apt work into one layer
+#   - drops `apt-get update` calls whose lists are already fresh in the same layer
+#   - drops update-only and cleanup-only RUN instructions (every apt layer now does both itself)
+#   - cleans the apt lists in the same layer, or with BuildKit keeps apt/pip caches in cache mounts
+
+APT_PREFIX = r'(sudo\s+)?(DEBIAN_FRONTEND=\S+\s+)?apt(-get)?\s+(-\S+\s+)*'
+APT_LISTS_CLEANUP = 'rm -rf /var/lib/apt/lists/*'
+
+APT_CACHE_MOUNTS = [
+    '--mount=type=cache,target=/var/cache/apt,sharing=locked',
+    '--mount=type=cache,target=/var/lib/apt/lists,sharing=locked',
+]
+PIP_CACHE_MOUNT = '--mount=type=cache,target=/root/.cache/pip'
+# the ubuntu images delete downloaded packages after every install, which defeats the apt cache mount
+APT_KEEP_CACHE = [
+    'rm -f /etc/apt/apt.conf.d/docker-clean',
+    'echo \'Binary::apt::APT::Keep-Downloaded-Packages "true";\' | tee /etc/apt/apt.conf.d/keep-cache > /dev/null',
+]
+
+def buildkit_enabled():
+    """Check if Dockerfiles will be built with BuildKit (required for cache mounts)."""
+    return os.environ.get('DOCKER_BUILDKIT') == '1'
+
+def normalize(text):
+    return ' '.join(text.replace('\\\n', ' ').split())
+
+def is_apt_update(segment):
+    return re.fullmatch(APT_PREFIX + r'update(\s+-\S+)*', normalize(segment)) is not None
+
+def has_apt_install(segment):
+    return re.search(r'\bapt(-get)?\s+(-\S+\s+)*install\b', normalize(segment)) is not None
+
+def is_apt_lists_cleanup(segment):
+    return re.fullmatch(r'(sudo\s+)?rm\s+-(rf|fr)\s+/var/lib/apt/lists/\*?', normalize(segment)) is not None
+
+def is_source_change(segment):
+    return re.search(r'add-apt-repository|sources\.list|/keyrings/', normalize(segment)) is not None
+
+def has_pip_install(segment):
+    return re.search(r'\bpip3?\s+install\b|-m\s+pip\s+install\b', normalize(segment)) is not None
+
+def changes_shell_state(segment):
+    return re.search(r'(^|[;&|]\s*)(cd|export|source|\.)\s', normalize(segment)) is not None
+
+def split_commands(command):
+    """Split a shell command on top-level `&&`, leaving quoted strings intact."""
+    segments = []
+    current = ''
+    quote = None
+    i = 0
+    while i < len(command):
+        char = command[i]
+        if quote:
+            if char == '\\' and quote == '"':
+                current += command[i:i + 2]
+                i += 2
+                continue
+            if char == quote:
+                quote = None
+        elif char in ('"', "'"):
+            quote = char
+        elif command.startswith('&&', i):
+            segments.append(current.strip().rstrip('\\').strip())
+            current = ''
+            i += 2
+            continue
+        current += char
+        i += 1
+    segments.append(current.strip())
+    return [s for s in segments if s]
+
+def parse_dockerfile(dockerfile):
+    """Split a Dockerfile in instructions, keeping comments and blank lines as they are."""
+    items = []
+    lines = dockerfile.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not line.strip() or line.lstrip().startswith('#'):
+            items.append({'type': 'text', 'raw': line})
+            i += 1
+            continue
+        raw = [line]
+        while raw[-1].rstrip().endswith('\\') and i + 1 < len(lines):
+            i += 1
+            # comment lines inside a continued instruction are dropped by docker as well
+            if lines[i].lstrip().startswith('#'):
+                continue
+            raw.append(lines[i])
+        i += 1
+        text = '\n'.join(raw)
+        keyword, _, args = text.strip().partition(' ')
+        items.append({'type': 'instruction', 'keyword': keyword.upper(), 'args': args.strip(), 'raw': text})
+    return items
+
+def parse_run(args):
+    """Split RUN arguments in its flags (--mount=...) and its `&&` separated commands."""
+    flags = []
+    rest = args
+    while rest.startswith('--'):
+        flag, _, rest = rest.partition(' ')
+        flags.append(flag)
+        rest = rest.lstrip(' \\\n\t')
+    return flags, split_commands(rest)
+
+def is_mergeable_run(item):
+    if item['type'] != 'instruction' or item['keyword'] != 'RUN':
+        return False
+    flags, segments = parse_run(item['args'])
+    if flags or item['args'].startswith('['):
+        return False
+    return all((is_apt_update(s) or has_apt_install(s)) and not changes_shell_state(s) for s in segments)
+
+def format_run(flags, segments):
+    lines = ['RUN ' + ' \\\n    '.join(flags + [segments[0]])] if flags else ['RUN ' + segments[0]]
+    for segment in segments[1:]:
+        lines.append('    && ' + segment)
+    return ' \\\n'.join(lines)
+
+def merge_apt_runs(items, stats):
+    merged = []
+    group = []
+    hoisted = []
+    pending = []
+
+    def flush():
+        merged.extend(hoisted)
+        if len(group) == 1:
+            merged.append(group[0])
+        elif group:
+            segments = [s for item in group for s in parse_run(item['args'])[1]]
+            merged.append({'type': 'instruction', 'keyword': 'RUN', 'args': ' && '.join(segments),
+                           'raw': format_run([], segments)})
+            stats['runs_merged'] += len(group) - 1
+        merged.extend(pending)
+        group.clear()
+        hoisted.clear()
+        pending.clear()
+
+    for item in items:
+        if is_mergeable_run(item):
+            # comments between merged steps are moved above the merged layer
+            hoisted.extend(text for text in pending if text['raw'].strip())
+            pending.clear()
+            group.append(item)
+        elif item['type'] == 'text' and group:
+            pending.append(item)
+        else:
+            flush()
+            merged.append(item)
+    flush()
+    return merged
+
+def optimize_run(item, buildkit, user, stats, state):
+    flags, segments = parse_run(item['args'])
+    if item['args'].startswith('['):
+        return item
+    if all(is_apt_update(s) for s in segments):
+        stats['updates_removed'] += len(segments)
+        return None
+    if all(is_apt_lists_cleanup(s) for s in segments):
+        return None
+
+    touches_apt = any(is_apt_update(s) or has_apt_install(s) or 'add-apt-repository' in s for s in segments)
+    touches_pip = any(has_pip_install(s) for s in segments)
+    if not touches_apt and not (buildkit and touches_pip and user == 'root'):
+        return item
+
+    # apt needs root, instructions after a `USER` switch go through sudo like the templates do
+    sudo = '' if user == 'root' else 'sudo '
+    new_segments = []
+    fresh = False
+    for segment in segments:
+        if is_apt_update(segment):
+            if fresh:
+                stats['updates_removed'] += 1
+                continue
+            fresh = True
+        elif is_apt_lists_cleanup(segment):
+            continue
+        elif is_source_change(segment):
+            fresh = False
+        elif has_apt_install(segment) and not fresh:
+            # the lists are cleaned at the end of every layer, so each installing layer updates first
+            new_segments.append(sudo + 'apt-get update')
+            fresh = True
+        new_segments.append(segment)
+
+    if any('docker-clean' in segment for segment in segments):
+        state['apt_cache_configured'] = True
+    if buildkit:
+        if touches_apt:
+            flags = flags + [m for m in APT_CACHE_MOUNTS if m not in flags]
+            if not state['apt_cache_configured']:
+                keep_cache = [sudo + APT_KEEP_CACHE[0], APT_KEEP_CACHE[1].replace('tee', sudo + 'tee')]
+                new_segments = keep_cache + new_segments
+                state['apt_cache_configured'] = True
+        if touches_pip and user == 'root' and PIP_CACHE_MOUNT not in flags:
+            flags = flags + [PIP_CACHE_MOUNT]
+    elif touches_apt:
+        new_segments.append(sudo + APT_LISTS_CLEANUP)
+    return dict(item, raw=format_run(flags, new_segments))
+
+def optimize_dockerfile(dockerfile, buildkit=False):
+    """Return the optimized Dockerfile and statistics about what was changed."""
+    stats = {'runs_before': 0, 'runs_after': 0, 'runs_merged': 0, 'updates_removed': 0}
+    items = parse_dockerfile(dockerfile)
+    stats['runs_before'] = sum(1 for item in items if item['type'] == 'instruction' and item['keyword'] == 'RUN')
+
+    state = {'apt_cache_configured': False}
+    user = 'root'
+    optimized = []
+    for item in merge_apt_runs(items, stats):
+        if item['type'] == 'instruction':
+            if item['keyword'] == 'FROM':
+                user = 'root'
+            elif item['keyword'] == 'USER':
+                user = item['args'].split(':')[0]
+            elif item['keyword'] == 'RUN':
+                item = optimize_run(item, buildkit, user, stats, state)
+                if item is None:
+                    continue
+        optimized.append(item)
+
+    stats['runs_after'] = sum(1 for item in optimized if item['type'] == 'instruction' and item['keyword'] == 'RUN')
+    lines = [item['raw'] for item in optimized]
+    # collapse the blank lines left behind by removed instructions
+    text = re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+    return text.strip('\n') + '\n', stats
@@ -0,0 +1,51 @@
+#!/bin/bash
+# Captures what the ROS setup scripts add to a shell into a file that is loaded in one step.
+# usage: rosbox-env-snapshot [overlay setup.bash ...]
+# Without arguments the overlays of the last snapshot are used, or the workspace overlay if it was built.
+# The snapshot holds the exported variables, shell functions and completions the setup scripts define.
+
+env_file="${ROSBOX_ENV_FILE:-$HOME/.rosbox_env}"
+default_overlay="$HOME/ros_ws/install/setup.bash"
+
+overlays=("$@")
+if [ ${#overlays[@]} -eq 0 ]; then
+    if [ -f "$env_file" ]; then
+        read -r -a overlays <<< "$(sed -n 's/^# overlays: //p' "$env_file")"
+    fi
+    if [ ${#overlays[@]} -eq 0 ] && [ -f "$default_overlay" ]; then
+        overlays=("$default_overlay")
+    fi
+fi
+
+declare -A before_vars
+for name in $(compgen -e); do
+    before_vars[$name]="${!name}"
+done
+before_functions="$(declare -F)"
+before_completions="$(complete -p 2>/dev/null)"
+
+source "/opt/ros/$ROS_DISTRO/setup.bash"
+for overlay in "${overlays[@]}"; do
+    if [ -f "$overlay" ]; then
+        source "$overlay"
+    fi
+done
+
+tmp_file="$env_file.$$.tmp"
+{
+    echo "# generated by rosbox-env-snapshot, refresh it with: rosbox-env-snapshot"
+    echo "# overlays: ${overlays[*]}"
+    for name in $(compgen -e); do
+        case "$name" in
+            PWD|OLDPWD|SHLVL|_) continue ;;
+        esac
+        if [ -z "${before_vars[$name]+set}" ] || [ "${before_vars[$name]}" != "${!name}" ]; then
+            printf 'export %s=%q\n' "$name" "${!name}"
+        fi
+    done
+    # the ros2 argcomplete registration is a function plus a `complete` line
+    comm -13 <(echo "$before_functions" | sort) <(declare -F | sort) | while read -r _ _ function_name; do
+        declare -f "$function_name"
+    done
+    comm -13 <(echo "$before_completions" | sort) <(complete -p 2>/dev/null | sort)
+} > "$tmp_file" && mv "$tmp_file" "$env_file"
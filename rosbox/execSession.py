@@ -0,0 +1,140 @@
+import os
+import subprocess
+import sys
+import threading
+
+# Commands in rosboxes over the API connection of the docker client, without the docker CLI.
+# Interactive sessions attach a PTY: the local terminal is put in raw mode, stdin is forwarded to the
+# exec socket and the PTY follows the size of the terminal.
+
+chunk_size = 64 * 1024
+
+def terminal_environment():
+    return [f"TERM={os.environ.get('TERM', 'xterm')}"]
+
+def raw_socket(connection):
+    # the http response wraps the socket of the upgraded connection
+    sock = getattr(connection, '_sock', connection)
+    # a session may stay silent for longer than the API timeout of the client
+    sock.settimeout(None)
+    return sock
+
+def exec_interactive(client, container, command):
+    """Run command in a PTY attached to the local terminal and return its exit code."""
+    if os.name == 'nt':
+        # no termios and no select on the console on windows
+        return subprocess.run(['docker', 'exec', '-it', container.name] + command).returncode
+    import select
+    import signal
+    import socket
+    import termios
+    import tty
+
+    api = client.api
+    exec_id = api.exec_create(container.id, command, stdin=True, tty=True, environment=terminal_environment())['Id']
+    connection = api.exec_start(exec_id, tty=True, socket=True)
+    sock = raw_socket(connection)
+
+    def resize(*_):
+        try:
+            size = os.get_terminal_size(stdout_fd)
+            api.exec_resize(exec_id, height=size.lines, width=size.columns)
+        except Exception:
+            pass
+
+    stdin_fd = sys.stdin.fileno()
+    stdout_fd = sys.stdout.fileno()
+    # with redirected stdin the input is forwarded as it is
+    terminal = os.isatty(stdin_fd)
+    if terminal:
+        old_attributes = termios.tcgetattr(stdin_fd)
+        old_handler = signal.signal(signal.SIGWINCH, resize)
+    try:
+        if terminal:
+            tty.setraw(stdin_fd)
+            resize()
+        inputs = [sock, stdin_fd]
+        while True:
+            readable, _, _ = select.select(inputs, [], [])
+            if sock in readable:
+                data = sock.recv(chunk_size)
+                if not data:
+                    break
+                os.write(stdout_fd, data)
+            if stdin_fd in readable:
+                data = os.read(stdin_fd, chunk_size)
+                if data:
+                    sock.sendall(data)
+                else:
+                    sock.shutdown(socket.SHUT_WR)
+                    inputs.remove(stdin_fd)
+    finally:
+        if terminal:
+            termios.tcsetattr(stdin_fd, termios.TCSADRAIN, old_attributes)
+            signal.signal(signal.SIGWINCH, old_handler)
+        connection.close()
+    return api.exec_inspect(exec_id)['ExitCode']
+
+# writes the output of one rosbox line by line with its name in front, the streams of other rosboxes
+# running at the same time never interleave within a line
+class PrefixedWriter:
+    def __init__(self, prefix, stream, lock):
+        self.prefix = prefix.encode()
+        self.stream = stream
+        self.lock = lock
+        self.buffer = b''
+
+    def write(self, data):
+        self.buffer += data
+        if b'\n' not in self.buffer:
+            return
+        lines, self.buffer = self.buffer.rsplit(b'\n', 1)
+        self.emit(lines.split(b'\n'))
+
+    def close(self):
+        if self.buffer:
+            self.emit([self.buffer])
+            self.buffer = b''
+
+    def emit(self, lines):
+        with self.lock:
+            for line in lines:
+                self.stream.write(self.prefix + line + b'\n')
+            self.stream.flush()
+
+class RawWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+output_lock = threading.Lock()
+
+def exec_stream(client, container, command, prefix=None):
+    """Run command without a PTY, stream its stdout and stderr and return its exit code."""
+    from docker.utils.socket import demux_adaptor, frames_iter
+    api = client.api
+    exec_id = api.exec_create(container.id, command, stdout=True, stderr=True)['Id']
+    if prefix is None:
+        stdout, stderr = RawWriter(sys.stdout.buffer), RawWriter(sys.stderr.buffer)
+    else:
+        stdout = PrefixedWriter(prefix, sys.stdout.buffer, output_lock)
+        stderr = PrefixedWriter(prefix, sys.stderr.buffer, output_lock)
+    connection = api.exec_start(exec_id, socket=True)
+    raw_socket(connection)
+    try:
+        for out, err in (demux_adaptor(*frame) for frame in frames_iter(connection, tty=False)):
+            if out:
+                stdout.write(out)
+            if err:
+                stderr.write(err)
+    finally:
+        stdout.close()
+        stderr.close()
+        connection.close()
+    return api.exec_inspect(exec_id)['ExitCode']
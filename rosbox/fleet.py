@@ -0,0 +1,182 @@
+import contextvars
+import fnmatch
+import sys
+import threading
+import time
+
+from .config import get_state_file
+
+# Fleet mode: the rosbox commands on many docker hosts at once.
+# The hosts are named in the `fleet` config key. Every selected host gets its own ContainerManager on a
+# client that is opened once and reused for all calls to that host, the hosts run in parallel and their
+# output is prefixed with the host name. A host that doesn't answer within `fleet_timeout` is reported
+# as unreachable instead of holding up the others, and every later API call of a host that hangs fails
+# after `fleet_timeout` too (a stop gets its stop timeout on top, exec streams have no timeout).
+
+def normalize_host(host):
+    # a bare hostname means the host is reached over ssh, like `DOCKER_HOST=ssh://...`
+    if '://' not in host:
+        return f"ssh://{host}"
+    return host
+
+def open_client(host, timeout=60):
+    """Connect to a docker host and check it answers, raises when it doesn't."""
+    import docker
+    base_url = normalize_host(host)
+    client = docker.DockerClient(base_url=base_url, timeout=timeout, use_ssh_client=base_url.startswith('ssh://'))
+    client.ping()
+    return client
+
+def select_hosts(config, hosts=None, fleet=False):
+    """Return {name: url} of the hosts picked with --hosts (names, glob patterns or urls) or --fleet."""
+    inventory = config["fleet"]
+    if fleet:
+        return dict(inventory)
+    selected = {}
+    for pattern in [p.strip() for p in hosts.split(',') if p.strip()]:
+        if '://' in pattern:
+            selected[pattern] = pattern
+            continue
+        matches = fnmatch.filter(inventory.keys(), pattern)
+        if not matches:
+            print(f"Error: no fleet host matches '{pattern}', add it to the fleet in the config")
+            exit(1)
+        for name in matches:
+            selected[name] = inventory[name]
+    return selected
+
+# the host of the current thread, a context variable so the bulk workers of a host inherit it
+host_prefix = contextvars.ContextVar('host_prefix', default=None)
+
+# stdout for the host threads: every line gets the name of the host that printed it
+class HostOutput:
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.buffer = HostOutputBuffer(self)
+
+    def write(self, text):
+        prefix = host_prefix.get()
+        if prefix is None:
+            with self.lock:
+                return self.stream.write(text)
+        self.local.pending = getattr(self.local, 'pending', '') + text
+        if '\n' in self.local.pending:
+            lines, self.local.pending = self.local.pending.rsplit('\n', 1)
+            with self.lock:
+                for line in lines.split('\n'):
+                    # progress lines redraw themselves with \r, only the last state is kept
+                    self.stream.write(prefix + line.rsplit('\r', 1)[-1] + '\n')
+        return len(text)
+
+    def flush_host(self):
+        if getattr(self.local, 'pending', ''):
+            self.write('\n')
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        return self.stream.fileno()
+
+class HostOutputBuffer:
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, data):
+        return self.output.write(data.decode('utf-8', errors='replace'))
+
+    def flush(self):
+        self.output.flush()
+
+class Fleet:
+    def __init__(self, config, hosts):
+        self.config = config
+        self.hosts = hosts
+        self.timeout = config["fleet_timeout"]
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def client(self, name):
+        # one client per host and process, its connection pool is reused by every call to the host
+        with self.lock:
+            client = self.clients.get(name)
+        if client is None:
+            client = open_client(self.hosts[name], self.timeout)
+            with self.lock:
+                self.clients[name] = client
+        return client
+
+    def manager(self, name):
+        from .containerIndex import ContainerIndex
+        from .rosbox import ContainerManager
+        # every host has its own index, the local one stays the one of the local daemon
+        index = ContainerIndex(path=get_state_file(f"containers.{name}.json"), suffix=ContainerManager.rosbox_suffix)
+        return ContainerManager(self.config, client=self.client(name), index=index)
+
+    def run(self, action):
+        """Run action(name, manager) on every host in parallel and return {name: (result, error)}."""
+        output = HostOutput(sys.stdout)
+        errors = HostOutput(sys.stderr)
+        results = {}
+        connected = {name: threading.Event() for name in self.hosts}
+        done = {name: threading.Event() for name in self.hosts}
+
+        def work(name):
+            host_prefix.set(f"[{name}] ")
+            try:
+                manager = self.manager(name)
+                connected[name].set()
+                result = (action(name, manager), None)
+            except SystemExit:
+                result = (None, "failed")
+            except Exception as e:
+                result = (None, str(e).splitlines()[0] if str(e) else type(e).__name__)
+            finally:
+                output.flush_host()
+                errors.flush_host()
+            with self.lock:
+                # a host that connected too late was already reported
+                results.setdefault(name, result)
+            connected[name].set()
+            done[name].set()
+
+        sys.stdout, sys.stderr = output, errors
+        try:
+            # daemon threads, so a host that hangs while connecting can't keep rosbox from exiting
+            for name in self.hosts:
+                threading.Thread(target=work, args=(name,), daemon=True).start()
+            deadline = time.monotonic() + self.timeout
+            for name in self.hosts:
+                if not connected[name].wait(max(deadline - time.monotonic(), 0)):
+                    with self.lock:
+                        results.setdefault(name, (None, f"not reachable within {self.timeout}s"))
+                    done[name].set()
+            for name in self.hosts:
+                done[name].wait()
+        finally:
+            sys.stdout, sys.stderr = output.stream, errors.stream
+        return results
+
+    def print_summary(self, results, verb):
+        failed = {name: error for name, (_, error) in results.items() if error is not None}
+        print(f"{len(results) - len(failed)}/{len(results)} hosts {verb}")
+        for name, error in sorted(failed.items()):
+            print(f"  {name}: {error}")
+        return not failed
+
+    def print_list(self, results):
+        print(f"{'HOST':<16} | {'ID':<12} | {'NAME':<20} | {'STATUS':<20} | {'IMAGE':<20}")
+        print("-" * 91)
+        for host in sorted(results):
+            containers, error = results[host]
+            if error is not None:
+                print(f"{host:<16} | {'-':<12} | {'-':<20} | {'unreachable':<20} | {error[:40]}")
+                continue
+            for name, container in sorted(containers.items()):
+                print(f"{host:<16} | {container['id'][:12]:<12} | {name:<20} | {container['status']:<20} | {container['image']:<20}")
+        print(("-" * 91) + "\n")
@@ -0,0 +1,338 @@
+import gzip
+import hashlib
+import io
+import json
+import re
+import tarfile
+
+from .defaults import DEFAULT_IMAGES
+from .dockerfileOptimizer import normalize, parse_dockerfile, parse_run
+from .imageBuilder import DockerfileGenerator, image_label
+from .layerSync import ChunkReader
+from .workspaceCache import format_size
+
+# Layer analysis of a rosbox image.
+#   - every layer is mapped back to the template it came from (base/ros/default/entrypoint) by matching its
+#     instruction against the template instructions, merged apt layers are matched per `&&` command
+#   - the layer tars are scanned from `docker save` to find bytes that are in the image but not visible in it:
+#     files deleted or overwritten by a later layer, and apt/pip caches left in the final image
+
+stage_order = ['from', 'base', 'ros', 'default', 'entrypoint']
+# the full layer tar is only held in memory for small layers, bigger ones are scanned as a stream
+small_member_size = 1024 * 1024
+
+cache_groups = [
+    ('/var/lib/apt/lists/', 'apt lists'),
+    ('/var/cache/apt/', 'apt archives'),
+    ('/root/.cache/pip/', 'pip cache'),
+    ('/home/ubuntu/.cache/pip/', 'pip cache'),
+]
+
+def path_group(path):
+    for prefix, group in cache_groups:
+        if path.startswith(prefix):
+            return group
+    parts = path.strip('/').split('/')
+    return '/' + '/'.join(parts[:3]) if len(parts) > 3 else path
+
+def is_cache_file(path):
+    if path.endswith('/lock') or '/partial/' in path:
+        return False
+    return any(path.startswith(prefix) for prefix, _ in cache_groups)
+
+def parse_created_by(created_by):
+    """Turn a history entry (classic builder or BuildKit) back into `KEYWORD args`."""
+    text = (created_by or '').strip()
+    text = re.sub(r'\s*# buildkit$', '', text)
+    text = re.sub(r'^\|\d+(\s+\S+=\S*)*\s+', '', text)
+    if text.startswith('/bin/sh -c #(nop)'):
+        text = text[len('/bin/sh -c #(nop)'):].strip()
+    elif text.startswith('/bin/sh -c '):
+        text = 'RUN ' + text[len('/bin/sh -c '):]
+    elif text.startswith('RUN /bin/sh -c '):
+        text = 'RUN ' + text[len('RUN /bin/sh -c '):]
+    keyword, _, args = text.partition(' ')
+    return keyword.upper(), normalize(args)
+
+def instruction_keys(keyword, args):
+    # RUN instructions are compared per `&&` command, so apt layers merged by the optimizer still match
+    if keyword == 'RUN':
+        _, segments = parse_run(args)
+        return {('RUN', normalize(re.sub(r'^sudo\s+', '', segment))) for segment in segments}
+    if keyword in ('COPY', 'ADD'):
+        # the history has the resolved source (`file:<hash> in /dest`), only the destination is comparable
+        return {(keyword, args.split()[-1] if args else '')}
+    return {(keyword, args)}
+
+# instruction -> template kinds, from the template files themselves
+class TemplateIndex:
+    def __init__(self, generator=None, templates=None):
+        generator = generator or DockerfileGenerator()
+        sources = {
+            'base': generator.base_templates,
+            'ros': generator.ros_templates,
+            'default': generator.default_templates,
+            'entrypoint': generator.entrypoints_templates,
+        }
+        self.kinds = {}
+        for kind, files in sources.items():
+            names = [templates[kind]] if templates and templates.get(kind) else list(files)
+            for name in names:
+                with open(files[name], 'r') as f:
+                    text = f.read()
+                for item in parse_dockerfile(text):
+                    if item['type'] != 'instruction' or item['keyword'] == 'FROM':
+                        continue
+                    for key in instruction_keys(item['keyword'], normalize(item['args'])):
+                        self.kinds.setdefault(key, set()).add(kind)
+
+    def classify(self, instructions):
+        """Assign a stage to every (keyword, args) of the history, oldest first."""
+        stages = []
+        current = 'from'
+        for keyword, args in instructions:
+            scores = {}
+            for key in instruction_keys(keyword, args):
+                for kind in self.kinds.get(key, ()):
+                    scores[kind] = scores.get(kind, 0) + 1
+            # stages only move forward, an instruction that also exists in an earlier template stays in the current one
+            later = {kind: score for kind, score in scores.items() if stage_order.index(kind) >= stage_order.index(current)}
+            if later and current not in later:
+                current = max(later, key=lambda kind: (later[kind], -stage_order.index(kind)))
+            stages.append(current)
+        return stages
+
+# reads through a member of the outer tar, hashing everything and transparently decompressing gzip layers
+class LayerReader:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.prefix = fileobj.read(2)
+        self.stream = gzip.GzipFile(fileobj=_Raw(self)) if self.prefix == b'\x1f\x8b' else None
+
+    def read_raw(self, size=-1):
+        if self.prefix and 0 <= size <= len(self.prefix):
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+            return data
+        data = self.prefix + (self.fileobj.read(size - len(self.prefix)) if size >= 0 else self.fileobj.read())
+        self.prefix = b''
+        return data
+
+    def read(self, size=-1):
+        data = self.stream.read(size) if self.stream is not None else self.read_raw(size)
+        self.sha256.update(data)
+        return data
+
+    def drain(self):
+        while self.read(1024 * 1024):
+            pass
+        return 'sha256:' + self.sha256.hexdigest()
+
+class _Raw:
+    def __init__(self, reader):
+        self.reader = reader
+
+    def read(self, size=-1):
+        return self.reader.read_raw(size)
+
+# the files, whiteouts and directories of one layer
+class LayerScan:
+    def __init__(self):
+        self.files = {}
+        self.whiteouts = []
+        self.opaque = []
+        self.dirs = set()
+        self.size = 0
+
+    def add(self, member):
+        name = member.name[2:] if member.name.startswith('./') else member.name
+        path = '/' + name.strip('/')
+        directory, _, name = path.rpartition('/')
+        if name == '.wh..wh..opq':
+            self.opaque.append(directory)
+        elif name.startswith('.wh.'):
+            self.whiteouts.append(f"{directory}/{name[len('.wh.'):]}")
+        elif member.isdir():
+            self.dirs.add(path)
+        elif member.isfile():
+            self.files[path] = member.size
+            self.size += member.size
+
+def scan_layer(fileobj):
+    reader = LayerReader(fileobj)
+    scan = LayerScan()
+    with tarfile.open(fileobj=reader, mode='r|') as layer:
+        for member in layer:
+            scan.add(member)
+    # the digest of the uncompressed layer (its diff id) also covers the padding after the last member
+    return reader.drain(), scan
+
+def compute_waste(scans):
+    """Return the waste records of the layers, in layer order."""
+    present = {}
+    dirs = set()
+    waste = {}
+
+    def add(layer, cause, by, path, size):
+        key = (layer, cause, by, path_group(path))
+        record = waste.setdefault(key, {'layer': layer, 'cause': cause, 'by': by, 'paths': key[3], 'files': 0, 'bytes': 0})
+        record['files'] += 1
+        record['bytes'] += size
+
+    def remove(path, by):
+        if path in present:
+            layer, size = present.pop(path)
+            add(layer, 'deleted', by, path, size)
+        if path in dirs:
+            prefix = path + '/'
+            for child in [p for p in present if p.startswith(prefix)]:
+                layer, size = present.pop(child)
+                add(layer, 'deleted', by, child, size)
+
+    for index, scan in enumerate(scans):
+        if scan is None:
+            continue
+        for directory in scan.opaque:
+            prefix = directory + '/'
+            for child in [p for p in present if p.startswith(prefix)]:
+                layer, size = present.pop(child)
+                add(layer, 'deleted', index, child, size)
+        for path in scan.whiteouts:
+            remove(path, index)
+        for path, size in scan.files.items():
+            if path in present:
+                layer, old_size = present[path]
+                add(layer, 'overwritten', index, path, old_size)
+            present[path] = (index, size)
+        dirs.update(scan.dirs)
+    for path, (layer, size) in present.items():
+        if is_cache_file(path):
+            add(layer, 'left in image', None, path, size)
+    return sorted((record for record in waste.values() if record['bytes'] > 0), key=lambda r: -r['bytes'])
+
+class ImageAnalyzer:
+    def __init__(self, client, generator=None):
+        self.client = client
+        self.generator = generator
+
+    def read_image(self, image):
+        """Stream `docker save` and return the image config and the scan of every layer by diff id."""
+        config = None
+        scans = {}
+        with tarfile.open(fileobj=ChunkReader(image.save(chunk_size=1024 * 1024, named=False)), mode='r|') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                name = member.name
+                is_layer_file = name.endswith('layer.tar') or name.startswith('blobs/')
+                is_config_file = name.startswith('blobs/') or (name.endswith('.json') and '/' not in name)
+                data = archive.extractfile(member)
+                if member.size < small_member_size and is_config_file:
+                    content = data.read()
+                    if content.startswith(b'{'):
+                        try:
+                            parsed = json.loads(content)
+                            if isinstance(parsed, dict) and 'rootfs' in parsed:
+                                config = parsed
+                            continue
+                        except ValueError:
+                            pass
+                    if not is_layer_file:
+                        continue
+                    data = io.BytesIO(content)
+                elif not is_layer_file:
+                    continue
+                try:
+                    diff_id, scan = scan_layer(data)
+                except tarfile.TarError:
+                    continue
+                scans[diff_id] = scan
+        return config, scans
+
+    def analyze(self, image_name, scan=True):
+        image = self.client.images.get(image_name)
+        labels = image.labels or {}
+        templates = None
+        if labels.get(image_label) in DEFAULT_IMAGES:
+            templates = DEFAULT_IMAGES[labels[image_label]]
+        index = TemplateIndex(self.generator, templates)
+
+        entries = []
+        if scan:
+            config, scans = self.read_image(image)
+            diff_ids = iter(config['rootfs']['diff_ids'])
+            for history in config.get('history', []):
+                entry = {'created_by': history.get('created_by', ''), 'diff_id': None, 'size': 0, 'scan': None}
+                if not history.get('empty_layer'):
+                    entry['diff_id'] = next(diff_ids, None)
+                    entry['scan'] = scans.get(entry['diff_id'])
+                    entry['size'] = entry['scan'].size if entry['scan'] else 0
+                entries.append(entry)
+        else:
+            for history in reversed(self.client.api.history(image.id)):
+                entries.append({'created_by': history.get('CreatedBy', ''), 'diff_id': None, 'size': history.get('Size', 0), 'scan': None})
+
+        instructions = [parse_created_by(entry['created_by']) for entry in entries]
+        stages = index.classify(instructions)
+        layers = []
+        for number, (entry, (keyword, args), stage) in enumerate(zip(entries, instructions, stages)):
+            if scan and entry['diff_id'] is None:
+                continue
+            if not scan and entry['size'] == 0:
+                continue
+            layers.append({'index': number, 'stage': stage, 'instruction': f"{keyword} {args}".strip(),
+                           'size': entry['size'], 'wasted': 0, 'scan': entry['scan']})
+
+        waste = compute_waste([layer['scan'] for layer in layers]) if scan else []
+        for record in waste:
+            layers[record['layer']]['wasted'] += record['bytes']
+            record['stage'] = layers[record['layer']]['stage']
+            record['layer'] = layers[record['layer']]['index']
+            if record['by'] is not None:
+                record['by'] = layers[record['by']]['index']
+
+        stage_summary = {}
+        for layer in layers:
+            summary = stage_summary.setdefault(layer['stage'], {'stage': layer['stage'], 'layers': 0, 'size': 0, 'wasted': 0})
+            summary['layers'] += 1
+            summary['size'] += layer['size']
+            summary['wasted'] += layer['wasted']
+            del layer['scan']
+        return {
+            'image': image_name,
+            'id': image.id,
+            'template_image': labels.get(image_label),
+            'scanned': scan,
+            'size': sum(layer['size'] for layer in layers),
+            'wasted': sum(layer['wasted'] for layer in layers),
+            'layers': layers,
+            'stages': [stage_summary[stage] for stage in stage_order if stage in stage_summary],
+            'waste': waste,
+        }
+
+def print_report(report, top=15):
+    share = report['wasted'] / report['size'] * 100 if report['size'] else 0
+    print(f"Image {report['image']} ({report['id'][:19]}): {format_size(report['size'])} in {len(report['layers'])} layers"
+          + (f", {format_size(report['wasted'])} wasted ({share:.1f}%)" if report['scanned'] else ''))
+
+    print(f"\n{'STAGE':<12} | {'LAYERS':>6} | {'SIZE':>10} | {'WASTED':>10}")
+    print("-" * 48)
+    for stage in report['stages']:
+        print(f"{stage['stage']:<12} | {stage['layers']:>6} | {format_size(stage['size']):>10} | {format_size(stage['wasted']):>10}")
+
+    print(f"\n{'#':>3} | {'STAGE':<10} | {'SIZE':>10} | {'WASTED':>10} | INSTRUCTION")
+    print("-" * 110)
+    for layer in sorted(report['layers'], key=lambda l: -l['size'])[:top]:
+        print(f"{layer['index']:>3} | {layer['stage']:<10} | {format_size(layer['size']):>10} | {format_size(layer['wasted']):>10} | {layer['instruction'][:70]}")
+
+    if report['waste']:
+        print(f"\n{'WASTED':>10} | {'FILES':>6} | {'CAUSE':<13} | {'ADDED IN':<15} | {'BY':>3} | PATHS")
+        print("-" * 96)
+        for record in report['waste'][:top]:
+            added = f"#{record['layer']} {record['stage']}"
+            by = str(record['by']) if record['by'] is not None else '-'
+            print(f"{format_size(record['bytes']):>10} | {record['files']:>6} | {record['cause']:<13} | {added:<15} | {by:>3} | {record['paths']}")
+    print()
+
+def report_json(report):
+    return json.dumps(report, indent=4)
@@ -1,7 +1,12 @@
-from jinja2 import Environment
 import os
-from pick import pick
+import io
+import hashlib
+import re
+import shutil
+import tarfile
 import json
+from .dockerfileOptimizer import optimize_dockerfile
+from .tracing import traced
 
 # defines
 current_dir = os.path.dirname(__file__)
@@ -15,13 +20,27 @@ default_ros_template = 'ros-desktop'
 default_entrypoint_template = 'it'
 default_image_tag = 'ros2'
 
+# image labels written by rosbox builds
+fingerprint_label = 'rosbox.fingerprint'
+image_label = 'rosbox.image'
+# bump when the way templates are turned into images changes, to invalidate existing fingerprints
+fingerprint_version = 1
+
+# the base template splits an image in stages, in build order, with the context key that fills each stage
+stage_context_keys = {'ros': 'ros_install', 'default': 'default', 'entrypoint': 'entrypoint_setup'}
+
+# directories searched (in order) for files referenced by COPY/ADD in a rendered Dockerfile
+asset_search_paths = [entrypoints_templates_path, default_templates_path, ros_templates_path, base_templates_path]
+
 # Class to generate Dockerfile
 class DockerfileGenerator:
+    @traced('templates.discover')
     def __init__(self):
         self.base_templates = self.load_base_templates_options()
         self.ros_templates = self.load_ros_templates_options()
         self.default_templates = self.load_default_templates_options()
         self.entrypoints_templates = self.load_entrypoints_templates_options()
+        self.optimize_stats = None
 
     def load_base_templates_options(self):
         template_files = {}
@@ -59,7 +78,7 @@ class DockerfileGenerator:
                 template_files[key] = os.path.join(entrypoints_templates_path, filename)
         return template_files
 
-    def generate_dockerfile(self, base_template, ros_template, entrypoint_template, output_file, default_template = None):
+    def read_templates(self, base_template, ros_template, entrypoint_template, default_template = None):
         ros_template = self.ros_templates[ros_template]
         base_template = self.base_templates[base_template]
         if default_template != None:
@@ -82,37 +101,197 @@ class DockerfileGenerator:
             with open(default_template, 'r') as file:
                 default_template_str = file.read()
 
-        # Define the context mapping that will be used to render the base template
-        context = {
+        with open(base_template, 'r') as file:
+            base_template_str = file.read()
+
+        return {
+            'base': base_template_str,
             'ros_install': ros_dockerfile_template,
             'entrypoint_setup': entrypoint_template_str,
             'default': default_template_str
         }
 
+    @traced('template.render')
+    def render_dockerfile(self, base_template, ros_template, entrypoint_template, default_template = None, optimize = True, buildkit = False):
+        templates = self.read_templates(base_template, ros_template, entrypoint_template, default_template)
+
+        # Define the context mapping that will be used to render the base template
+        context = {
+            'ros_install': templates['ros_install'],
+            'entrypoint_setup': templates['entrypoint_setup'],
+            'default': templates['default']
+        }
+
         # Render the base template with the provided context data
-        with open(base_template, 'r') as file:
-            base_template_str = file.read()
+        from jinja2 import Environment
         env = Environment()
-        template_obj = env.from_string(base_template_str)
+        template_obj = env.from_string(templates['base'])
         rendered_dockerfile = template_obj.render(context)
 
+        # Merge apt layers and clean up apt lists in the layer that created them
+        self.optimize_stats = None
+        if optimize:
+            rendered_dockerfile, self.optimize_stats = optimize_dockerfile(rendered_dockerfile, buildkit)
+        return rendered_dockerfile
+
+    # render the image as separate stages (base -> ros -> default -> entrypoint) that can be built on top of each other
+    @traced('template.render_stages')
+    def render_stages(self, base_template, ros_template, entrypoint_template, default_template = None):
+        templates = self.read_templates(base_template, ros_template, entrypoint_template, default_template)
+        context = {key: f'\n#rosbox-stage:{kind}\n' for kind, key in stage_context_keys.items()}
+        from jinja2 import Environment
+        env = Environment()
+        rendered = env.from_string(templates['base']).render(context)
+        parts = re.split(r'^#rosbox-stage:(\w+)$', rendered, flags=re.MULTILINE)
+        stages = [('base', parts[0])]
+        for kind, text in zip(parts[1::2], parts[2::2]):
+            stages.append((kind, templates[stage_context_keys[kind]] + text))
+        return stages
+
+    def generate_dockerfile(self, base_template, ros_template, entrypoint_template, output_file, default_template = None, optimize = True, buildkit = False):
+        rendered_dockerfile = self.render_dockerfile(base_template, ros_template, entrypoint_template, default_template, optimize, buildkit)
+
         # Write the rendered content to the specified output file
         with open(output_file, 'w') as f:
             f.write(rendered_dockerfile)
 
+        return self.collect_assets(rendered_dockerfile)
+
+    # content hash of everything that goes into an image: the template files, the render options and the assets
+    @traced('template.fingerprint')
+    def compute_fingerprint(self, base_template, ros_template, entrypoint_template, default_template = None, optimize = True, buildkit = False):
+        templates = self.read_templates(base_template, ros_template, entrypoint_template, default_template)
+        rendered_dockerfile = self.render_dockerfile(base_template, ros_template, entrypoint_template, default_template, optimize, buildkit)
+        digest = hashlib.sha256()
+        digest.update(json.dumps({
+            'version': fingerprint_version,
+            'templates': templates,
+            'options': {'optimize': optimize, 'buildkit': buildkit},
+        }, sort_keys=True).encode())
+        for arcname, path in sorted(self.collect_assets(rendered_dockerfile).items()):
+            digest.update(arcname.encode())
+            with open(path, 'rb') as file:
+                digest.update(hashlib.sha256(file.read()).digest())
+        return digest.hexdigest()
+
+    # find the template assets (scripts, config files) a rendered Dockerfile copies into the image
+    def collect_assets(self, dockerfile):
+        assets = {}
+        for line in dockerfile.replace('\\\n', ' ').splitlines():
+            parts = line.split()
+            if len(parts) < 3 or parts[0].upper() not in ('COPY', 'ADD'):
+                continue
+            # --from copies come from another stage, not from the build context
+            if any(p.startswith('--from') for p in parts[1:-1]):
+                continue
+            sources = [p for p in parts[1:-1] if not p.startswith('--')]
+            for source in sources:
+                if re.match(r'^[a-z]+://', source):
+                    continue
+                for search_path in asset_search_paths:
+                    path = os.path.join(search_path, source)
+                    if os.path.isfile(path):
+                        assets[source] = path
+                        break
+                else:
+                    raise FileNotFoundError(f"Template asset '{source}' not found in the template directories")
+        return assets
+
+    # copy the template assets next to a generated Dockerfile so it can be built with plain `docker build`
+    def export_assets(self, assets, output_dir):
+        for arcname, path in assets.items():
+            target = os.path.join(output_dir, arcname)
+            os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+            shutil.copyfile(path, target)
+            shutil.copymode(path, target)
+
+# turn the raw JSON stream of the docker build API into structured progress events
+def parse_build_output(raw_events):
+    for raw in raw_events:
+        if 'error' in raw:
+            yield {'type': 'error', 'message': raw['error'].strip()}
+        elif 'stream' in raw:
+            for line in raw['stream'].splitlines():
+                line = line.rstrip()
+                if not line:
+                    continue
+                step = re.match(r'^Step (\d+)/(\d+) : (.*)$', line)
+                if step:
+                    yield {'type': 'step', 'step': int(step.group(1)), 'total': int(step.group(2)), 'instruction': step.group(3)}
+                elif line.strip() == '---> Using cache':
+                    yield {'type': 'cache'}
+                else:
+                    yield {'type': 'log', 'message': line}
+        elif 'status' in raw:
+            yield {'type': 'status', 'id': raw.get('id'), 'status': raw['status'], 'progress': raw.get('progress')}
+        elif 'aux' in raw and 'ID' in raw['aux']:
+            yield {'type': 'image', 'id': raw['aux']['ID']}
+
+# default event handler: print the build progress to the terminal
+def print_build_event(event):
+    if event['type'] == 'step':
+        print(f"[{event['step']}/{event['total']}] {event['instruction']}")
+    elif event['type'] == 'cache':
+        print("    (cached)")
+    elif event['type'] == 'log':
+        print(f"    {event['message']}")
+    elif event['type'] == 'status' and not event['progress']:
+        # skip the per-chunk progress updates of base image pulls
+        status = f"{event['id']}: {event['status']}" if event['id'] else event['status']
+        print(f"    {status}")
+
 # class to build the image
 class ImageBuilder:
-    def __init__(self, dockerfile_path):
+    def __init__(self, dockerfile_path, client=None):
         self.dockerfile_path = dockerfile_path
+        self.client = client
+
+    # build context holding only the Dockerfile and the declared template assets, assembled in memory
+    @traced('build.context')
+    def create_build_context(self, assets=None, dockerfile=None):
+        context = io.BytesIO()
+        with tarfile.open(fileobj=context, mode='w') as tar:
+            if dockerfile is not None:
+                self._add_bytes_to_context(tar, 'Dockerfile', dockerfile.encode(), 0o644)
+            else:
+                self._add_to_context(tar, 'Dockerfile', self.dockerfile_path, 0o644)
+            for arcname, path in sorted((assets or {}).items()):
+                mode = 0o755 if path.endswith('.sh') or os.access(path, os.X_OK) else 0o644
+                self._add_to_context(tar, arcname, path, mode)
+        context.seek(0)
+        return context
 
-    def build_image(self, tag):
-        if os.path.exists(self.dockerfile_path):
+    def _add_to_context(self, tar, arcname, path, mode):
+        with open(path, 'rb') as file:
+            self._add_bytes_to_context(tar, arcname, file.read(), mode)
+
+    def _add_bytes_to_context(self, tar, arcname, data, mode):
+        # fixed metadata so an unchanged context hits the daemon's build cache
+        info = tarfile.TarInfo(arcname)
+        info.size = len(data)
+        info.mode = mode
+        info.mtime = 0
+        tar.addfile(info, io.BytesIO(data))
+
+    # build from the Dockerfile on disk, or from the given Dockerfile text
+    @traced('build.docker')
+    def build_image(self, tag, assets=None, on_event=print_build_event, labels=None, dockerfile=None):
+        if dockerfile is not None or os.path.exists(self.dockerfile_path):
             try:
-                return_code = os.system(f'docker build -t {tag} -f {self.dockerfile_path} .')
-                if return_code == 0:
-                    print("Docker image built successfully")
-                else:
-                    raise Exception(f"Docker build failed with return code {return_code}")
+                if self.client is None:
+                    import docker
+                    self.client = docker.from_env()
+                context = self.create_build_context(assets, dockerfile)
+                raw_events = self.client.api.build(fileobj=context, custom_context=True, tag=tag, rm=True, labels=labels, decode=True)
+                image_id = None
+                for event in parse_build_output(raw_events):
+                    if event['type'] == 'error':
+                        raise Exception(f"Docker build failed: {event['message']}")
+                    if event['type'] == 'image':
+                        image_id = event['id']
+                    on_event(event)
+                print("Docker image built successfully")
+                return image_id
             except Exception as e:
                 print(f"Error building Docker image: {str(e)}")
                 raise
@@ -121,10 +300,11 @@ class ImageBuilder:
 
 # class to build the image using an interactive interface
 class InteractiveBuilder:
-    def __init__(self, dockerfile_path):
+    def __init__(self, dockerfile_path, client=None):
         self.dockerfile_path = dockerfile_path
         self.generator = DockerfileGenerator()
-        self.image_builder = ImageBuilder(self.dockerfile_path)
+        self.image_builder = ImageBuilder(self.dockerfile_path, client)
+        self.assets = {}
         self.selected_base = default_base_template
         self.selected_ros = default_ros_template
         self.selected_entrypoint = default_entrypoint_template
@@ -132,19 +312,22 @@ class InteractiveBuilder:
     def select_base_template(self):
         options = list(self.generator.base_templates.keys())
         title = "Choose a base template:"
+        from pick import pick
         self.selected_base, _ = pick(options, title)
 
     def select_ros_template(self):
         options = list(self.generator.ros_templates.keys())
         title = "Choose a ROS template:"
+        from pick import pick
         self.selected_ros, _ = pick(options, title)
 
     def select_entrypoint_template(self):
         options = list(self.generator.entrypoints_templates.keys())
         title = "Choose an entrypoint template:"
+        from pick import pick
         self.selected_entrypoint, _ = pick(options, title)
 
-    def generate_dockerfile(self, base = None, ros = None, entryPoint = None):
+    def generate_dockerfile(self, base = None, ros = None, entryPoint = None, optimize = True, buildkit = False):
         if base == None:
             self.select_base_template()
         else:
@@ -158,13 +341,18 @@ class InteractiveBuilder:
         else:
             self.selected_entrypoint = entryPoint
 
-        self.generator.generate_dockerfile(
+        self.assets = self.generator.generate_dockerfile(
             self.selected_base,
             self.selected_ros,
             self.selected_entrypoint,
-            self.dockerfile_path)
+            self.dockerfile_path,
+            optimize = optimize,
+            buildkit = buildkit)
         print("Dockerfile generated successfully")
+        stats = self.generator.optimize_stats
+        if stats:
+            print(f"Optimized Dockerfile: {stats['runs_before']} -> {stats['runs_after']} RUN layers, {stats['updates_removed']} redundant apt updates removed")
 
     def build_image(self, tag = None):
-        self.image_builder.build_image(tag if tag is not None else default_image_tag)
+        self.image_builder.build_image(tag if tag is not None else default_image_tag, self.assets)
         print("Docker image built done")
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import re
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Offline image transfer for robots without internet access.
+# `export` streams `docker save` through a compressor straight into a file and writes a checksum manifest,
+# `import` streams the file through the decompressor straight into `docker load`, without a temporary tar.
+#   - zstd (optional `zstandard` package) compresses with its own worker threads
+#   - gzip is compressed in blocks on a thread pool, each block is a gzip member and the members are
+#     concatenated in order, which any gzip reader (and `docker load`) reads as one stream
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+GZIP_MAGIC = b'\x1f\x8b'
+manifest_version = 1
+chunk_size = 2 * 1024 * 1024
+gzip_block_size = 4 * 1024 * 1024
+compression_extensions = {'zstd': '.tar.zst', 'gzip': '.tar.gz', 'none': '.tar'}
+default_levels = {'zstd': 3, 'gzip': 6, 'none': 0}
+
+def zstd_available():
+    try:
+        import zstandard
+        return True
+    except ImportError:
+        return False
+
+def default_compression():
+    return 'zstd' if zstd_available() else 'gzip'
+
+def default_export_path(image_name, compression):
+    name = re.sub(r'[^a-zA-Z0-9_.-]', '_', image_name.split('/')[-1])
+    return name + compression_extensions[compression]
+
+def manifest_path(path):
+    return path + '.manifest.json'
+
+def format_rate(size, seconds):
+    return f"{size / 1024 ** 2:.1f}MB in {seconds:.1f}s ({size / 1024 ** 2 / max(seconds, 1e-6):.1f}MB/s)"
+
+# counts and hashes every chunk passing through
+class HashingStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.sha256.update(chunk)
+            self.size += len(chunk)
+            yield chunk
+
+class VerifiedStream:
+    # the chunks of a HashingStream, the last one is held back until the whole stream matched size and sha256.
+    # The daemon only loads a complete tar, so a stream that doesn't match is cut off before anything is loaded.
+    def __init__(self, stream, size, sha256):
+        self.stream = stream
+        self.size = size
+        self.sha256 = sha256
+        self.mismatch = False
+
+    def __iter__(self):
+        previous = None
+        for chunk in self.stream:
+            if previous is not None:
+                yield previous
+            previous = chunk
+        if self.stream.size != self.size or self.stream.sha256.hexdigest() != self.sha256:
+            self.mismatch = True
+            # not an IOError, the docker client would turn that into a connection error
+            raise ValueError("the decompressed image doesn't match the manifest")
+        if previous is not None:
+            yield previous
+
+def rechunk(chunks, size):
+    """Regroup a stream of chunks into blocks of the given size (the last one can be smaller)."""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+def gzip_member(block, level):
+    # zlib releases the GIL while compressing, so members are compressed in parallel on threads
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(block) + compressor.flush()
+
+def compress_gzip_parallel(chunks, level, threads):
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = deque()
+        for block in rechunk(chunks, gzip_block_size):
+            pending.append(pool.submit(gzip_member, block, level))
+            # bound the memory in flight, and keep the output in order
+            if len(pending) >= threads * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def compress_zstd(chunks, level, threads):
+    import zstandard
+    compressor = zstandard.ZstdCompressor(level=level, threads=threads)
+    chunker = compressor.chunker(chunk_size=chunk_size)
+    for chunk in chunks:
+        for out in chunker.compress(chunk):
+            yield out
+    for out in chunker.finish():
+        yield out
+
+def decompress_gzip(chunks):
+    decompressor = zlib.decompressobj(31)
+    in_member = False
+    for chunk in chunks:
+        while chunk:
+            in_member = True
+            yield decompressor.decompress(chunk)
+            if not decompressor.eof:
+                break
+            # a new gzip member starts after the end of the previous one
+            chunk = decompressor.unused_data
+            decompressor = zlib.decompressobj(31)
+            in_member = False
+    if in_member:
+        raise IOError("the gzip stream is truncated")
+
+def decompress_zstd(chunks):
+    import zstandard
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    for chunk in chunks:
+        out = decompressor.decompress(chunk)
+        if out:
+            yield out
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def detect_compression(path):
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    return 'none'
+
+class ImageTransfer:
+    def __init__(self, client):
+        self.client = client
+
+    def export_image(self, image_name, output_path=None, compression=None, level=None, threads=None):
+        """Save an image to a (compressed) tar file with a checksum manifest next to it."""
+        compression = compression or default_compression()
+        if compression == 'zstd' and not zstd_available():
+            print("Error: zstd compression needs the zstandard package (pip install rosbox-cli[transfer]), or use --compression gzip")
+            exit(1)
+        level = level if level is not None else default_levels[compression]
+        threads = threads or os.cpu_count() or 1
+        output_path = output_path or default_export_path(image_name, compression)
+        image = self.client.images.get(image_name)
+
+        print(f"Exporting {image_name} to {output_path} ({compression}, {threads} threads)")
+        start = time.perf_counter()
+        tar_stream = HashingStream(image.save(chunk_size=chunk_size, named=True))
+        if compression == 'zstd':
+            compressed = compress_zstd(tar_stream, level, threads)
+        elif compression == 'gzip':
+            compressed = compress_gzip_parallel(tar_stream, level, threads)
+        else:
+            compressed = tar_stream
+        file_stream = HashingStream(compressed)
+        tmp_path = output_path + '.part'
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in file_stream:
+                    f.write(chunk)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        seconds = time.perf_counter() - start
+
+        manifest = {
+            'version': manifest_version,
+            'image': image_name,
+            'image_id': image.id,
+            'tags': image.tags,
+            'compression': compression,
+            'file': os.path.basename(output_path),
+            'size': file_stream.size,
+            'sha256': file_stream.sha256.hexdigest(),
+            'tar_size': tar_stream.size,
+            'tar_sha256': tar_stream.sha256.hexdigest(),
+            'created_at': time.time(),
+        }
+        with open(manifest_path(output_path), 'w') as f:
+            json.dump(manifest, f, indent=4)
+
+        ratio = tar_stream.size / file_stream.size if file_stream.size else 0
+        print(f"Image read:    {format_rate(tar_stream.size, seconds)}")
+        print(f"File written:  {format_rate(file_stream.size, seconds)}, ratio {ratio:.2f}")
+        print(f"Manifest:      {manifest_path(output_path)}")
+        return manifest
+
+    def import_image(self, path, verify=True):
+        """Stream a file written by export_image into the daemon, checking it against its manifest first.
+
+        The file is read once more to hash it before anything is loaded, a corrupt file never reaches the daemon.
+        The compressed file is smaller than the image and the read is sequential, so this costs less than the load.
+        """
+        manifest = None
+        if os.path.exists(manifest_path(path)):
+            with open(manifest_path(path), 'r') as f:
+                manifest = json.load(f)
+        elif verify:
+            print(f"Warning: no manifest found ({manifest_path(path)}), the file can't be verified")
+        compression = detect_compression(path)
+        if compression == 'zstd' and not zstd_available():
+            print("Error: the file is zstd compressed, install the zstandard package (pip install rosbox-cli[transfer])")
+            exit(1)
+
+        if verify and manifest is not None:
+            print("Verifying checksum...")
+            file_check = HashingStream(read_file(path))
+            for _ in file_check:
+                pass
+            # the tar is decompressed from the file, a file that matches gives the tar of the manifest
+            if file_check.size != manifest['size'] or file_check.sha256.hexdigest() != manifest['sha256']:
+                print(f"Error: checksum mismatch with {manifest_path(path)}, the file is corrupt. Copy the file again, nothing was loaded")
+                exit(1)
+            print("Checksum OK")
+
+        print(f"Importing {path} ({compression})")
+        start = time.perf_counter()
+        file_stream = HashingStream(read_file(path))
+        if compression == 'zstd':
+            tar_chunks = decompress_zstd(file_stream)
+        elif compression == 'gzip':
+            tar_chunks = decompress_gzip(file_stream)
+        else:
+            tar_chunks = file_stream
+        tar_stream = HashingStream(tar_chunks)
+        # the file matched already, this catches a decompression that gives another tar than the export had
+        body = tar_stream
+        if verify and manifest is not None and 'tar_sha256' in manifest:
+            body = VerifiedStream(tar_stream, manifest['tar_size'], manifest['tar_sha256'])
+
+        loaded = []
+        try:
+            # the generator is sent as a chunked request body, so the tar never touches the disk
+            for event in self.client.api.load_image(iter(body)):
+                if 'error' in event:
+                    print(f"Error: {event['error']}")
+                    exit(1)
+                message = event.get('stream', '').strip()
+                if message:
+                    print(message)
+                    if message.startswith('Loaded image'):
+                        loaded.append(message.split(': ', 1)[-1])
+        except Exception:
+            if getattr(body, 'mismatch', False):
+                print(f"Error: the decompressed image doesn't match the checksum of {manifest_path(path)}, the load was stopped before its end")
+                exit(1)
+            raise
+        seconds = time.perf_counter() - start
+
+        print(f"File read:     {format_rate(file_stream.size, seconds)}")
+        print(f"Image loaded:  {format_rate(tar_stream.size, seconds)}")
+        return loaded
@@ -0,0 +1,207 @@
+import hashlib
+import queue
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .fleet import normalize_host, open_client
+
+# Delta image sync to the docker daemon of a robot.
+# `docker load` reuses every layer whose chain id already exists on the daemon without reading its file
+# from the archive, so only the layers above the longest layer chain the target already has are sent:
+#   1. the target is asked for the layer chains of its images
+#   2. `docker save` of the local image is filtered while it streams, dropping the layer files the target has
+#   3. the partial archive is streamed into `docker load` on the target, which restores the tags from the manifest
+
+chunk_size = 1024 * 1024
+spool_size = 64 * 1024 * 1024
+
+def chain_ids(diff_ids):
+    """Return the chain id of every layer prefix, like the daemon identifies its layers."""
+    chains = []
+    for diff_id in diff_ids:
+        if not chains:
+            chains.append(diff_id)
+        else:
+            chains.append('sha256:' + hashlib.sha256(f"{chains[-1]} {diff_id}".encode()).hexdigest())
+    return chains
+
+def connect_remote(host, timeout=60):
+    try:
+        return open_client(host, timeout)
+    except Exception as e:
+        print(f"Error: could not connect to the docker daemon at {normalize_host(host)}")
+        print(f"  {str(e)}")
+        exit(1)
+
+def uses_containerd_store(client):
+    # the containerd image store loads by content digest and does not reuse layers the archive leaves out
+    driver_status = client.info().get('DriverStatus') or []
+    return any('containerd.snapshotter' in str(value) for _, value in driver_status)
+
+# file object that hands everything written to it to a consumer thread as chunks
+class QueueWriter:
+    def __init__(self, maxsize=16):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.buffer = bytearray()
+        self.size = 0
+        # set by the consumer when it stops reading, a blocked writer gives up instead of waiting forever
+        self.stopped = threading.Event()
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise BrokenPipeError("the target stopped reading the archive")
+
+    def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= chunk_size:
+            self.put(bytes(self.buffer[:chunk_size]))
+            del self.buffer[:chunk_size]
+        return len(data)
+
+    def close(self, error=None):
+        if self.stopped.is_set():
+            return
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.put(error)
+
+    def cancel(self):
+        self.stopped.set()
+
+    def chunks(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+
+# file object over a generator of chunks, so tarfile can read `docker save` as a stream
+class ChunkReader:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        # deleting from the front of a bytearray is cheap, tarfile reads in small records
+        self.buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+class LayerSync:
+    def __init__(self, client, remote):
+        self.client = client
+        self.remote = remote
+        self.stats = {'layers': 0, 'skipped_layers': 0, 'skipped_bytes': 0, 'sent_bytes': 0}
+
+    def remote_chains(self, jobs=8):
+        """Return the chain ids of all layers of all images on the target."""
+        summaries = self.remote.api.images(all=False)
+        def inspect(image_id):
+            try:
+                return self.remote.api.inspect_image(image_id).get('RootFS', {}).get('Layers') or []
+            except Exception:
+                return []
+        chains = set()
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            for diff_ids in pool.map(inspect, [summary['Id'] for summary in summaries]):
+                chains.update(chain_ids(diff_ids))
+        return chains
+
+    def plan(self, image_name):
+        """Return the diff ids of the image, and the ones of the longest prefix the target already has."""
+        diff_ids = self.client.images.get(image_name).attrs['RootFS']['Layers']
+        known = self.remote_chains()
+        present = 0
+        for index, chain in enumerate(chain_ids(diff_ids)):
+            if chain not in known:
+                break
+            present = index + 1
+        return diff_ids, set(diff_ids[:present])
+
+    def filter_archive(self, image_name, skip, writer):
+        try:
+            source = tarfile.open(fileobj=ChunkReader(self.client.images.get(image_name).save(chunk_size=chunk_size, named=True)), mode='r|')
+            with tarfile.open(fileobj=writer, mode='w|') as target:
+                for member in source:
+                    data = source.extractfile(member) if member.isfile() else None
+                    if data is not None and member.name.startswith('blobs/sha256/'):
+                        # OCI layout (docker >= 25): the blob name is the digest of the uncompressed layer
+                        if 'sha256:' + member.name.rsplit('/', 1)[-1] in skip:
+                            self.stats['skipped_bytes'] += member.size
+                            continue
+                    elif data is not None and member.name.endswith('/layer.tar'):
+                        # legacy layout: the directory name is no digest, hash the layer while spooling it
+                        spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+                        digest = hashlib.sha256()
+                        for block in iter(lambda: data.read(chunk_size), b''):
+                            digest.update(block)
+                            spool.write(block)
+                        if 'sha256:' + digest.hexdigest() in skip:
+                            self.stats['skipped_bytes'] += member.size
+                            spool.close()
+                            continue
+                        spool.seek(0)
+                        data = spool
+                    target.addfile(member, data)
+            writer.close()
+        except BaseException as e:
+            writer.close(e)
+
+    def push(self, image_name, tag=None):
+        start = time.perf_counter()
+        diff_ids, skip = self.plan(image_name)
+        self.stats['layers'] = len(diff_ids)
+        self.stats['skipped_layers'] = len(skip)
+        print(f"{len(skip)}/{len(diff_ids)} layers of {image_name} are already on the target")
+        if uses_containerd_store(self.remote):
+            print("Warning: the target uses the containerd image store, which needs every layer in the archive. Sending the full image")
+            skip = set()
+            self.stats['skipped_layers'] = 0
+
+        writer = QueueWriter()
+        producer = threading.Thread(target=self.filter_archive, args=(image_name, skip, writer), daemon=True)
+        producer.start()
+        loaded = []
+        try:
+            for event in self.remote.api.load_image(writer.chunks()):
+                if 'error' in event:
+                    raise RuntimeError(event['error'])
+                message = event.get('stream', '').strip()
+                if message.startswith('Loaded image'):
+                    loaded.append(message.split(': ', 1)[-1])
+        finally:
+            # when the target fails the producer may be blocked on the full queue, holding the local `docker save` open
+            writer.cancel()
+            producer.join()
+        self.stats['sent_bytes'] = writer.size
+
+        if tag:
+            image_id = self.client.images.get(image_name).id
+            self.remote.images.get(image_id).tag(tag)
+            loaded.append(tag)
+        seconds = time.perf_counter() - start
+        sent = self.stats['sent_bytes'] / 1024 ** 2
+        print(f"Sent {sent:.1f}MB in {seconds:.1f}s ({sent / max(seconds, 1e-6):.1f}MB/s), "
+              f"skipped {self.stats['skipped_bytes'] / 1024 ** 2:.1f}MB in {self.stats['skipped_layers']} layers")
+        for name in loaded:
+            print(f"Loaded {name} on the target")
+        return loaded
@@ -0,0 +1,122 @@
+from .defaults import DEFAULT_RESOURCE_PROFILES, DEFAULT_IMAGE_RESOURCES
+from .workspaceCache import parse_size
+
+# CPU, memory and process limits of rosboxes.
+# The rosboxes run privileged and without limits by default, so a simulator can starve the rosbox with RViz
+# and teleop next to it. A resource profile is a named set of limits from the defaults or the
+# `resource_profiles` config key, applied by `create --resources` and changed on a running rosbox by `update`.
+# Docker can only change the CPU and memory limits of an existing container, the others need a new one.
+
+# the keys of a profile, they are described in the README
+profile_keys = ("cpuset", "cpus", "cpus_fraction", "cpu_shares", "memory", "memory_fraction", "swap", "memory_reservation",
+                "pids", "shm_size", "ulimits", "realtime", "rt_runtime")
+cpu_period = 100000
+
+def resource_profiles(config):
+    # a profile of the config replaces the default profile of the same name
+    return dict(DEFAULT_RESOURCE_PROFILES, **config["resource_profiles"])
+
+def resources_help(config):
+    return 'resource profile from {' + ', '.join(sorted(resource_profiles(config))) + '}'
+
+def resolve_profile(config, name=None, image=None, custom=False):
+    """Return the profile of --resources as a dict with its name, the default of the image without one, or None."""
+    if name is None and not custom:
+        name = DEFAULT_IMAGE_RESOURCES.get(image)
+    if name is None or name == 'none':
+        return None
+    profiles = resource_profiles(config)
+    if name not in profiles:
+        print(f"Error: unknown resource profile '{name}', choose from {', '.join(sorted(profiles))} or none")
+        exit(1)
+    unknown = [key for key in profiles[name] if key not in profile_keys]
+    if unknown:
+        print(f"Error: resource profile '{name}' has unknown key(s) {', '.join(unknown)}, choose from {', '.join(profile_keys)}")
+        exit(1)
+    return dict(profiles[name], name=name)
+
+def profile_ulimits(profile):
+    ulimits = {}
+    if profile.get("realtime"):
+        # SCHED_FIFO up to priority 99 and mlockall for the control loops, the rosboxes are privileged already
+        ulimits.update({"rtprio": 99, "memlock": -1})
+    ulimits.update(profile.get("ulimits") or {})
+    return {name: value if isinstance(value, (list, tuple)) else [value, value] for name, value in ulimits.items()}
+
+def needs_host(profile):
+    return bool(profile) and ("cpus_fraction" in profile or "memory_fraction" in profile)
+
+def cpu_memory_options(profile, host):
+    """Return the CPU and memory arguments of containers.create and container.update, host is the daemon info."""
+    options = {}
+    if "cpuset" in profile:
+        options["cpuset_cpus"] = str(profile["cpuset"])
+    cpus = profile.get("cpus")
+    if "cpus_fraction" in profile:
+        cpus = host["NCPU"] * profile["cpus_fraction"]
+    if cpus:
+        options["cpu_period"] = cpu_period
+        options["cpu_quota"] = max(int(cpus * cpu_period), 1000)
+    if "cpu_shares" in profile:
+        options["cpu_shares"] = int(profile["cpu_shares"])
+    memory = parse_size(profile["memory"]) if "memory" in profile else None
+    if "memory_fraction" in profile:
+        memory = int(host["MemTotal"] * profile["memory_fraction"])
+    if memory:
+        options["mem_limit"] = memory
+        # the swap limit of docker counts the memory too
+        options["memswap_limit"] = memory + (parse_size(profile["swap"]) if "swap" in profile else memory)
+    if "memory_reservation" in profile:
+        options["mem_reservation"] = parse_size(profile["memory_reservation"])
+    return options
+
+def create_options(profile, host, shm=False):
+    """Return the arguments of containers.create for a profile."""
+    from docker.types import Ulimit
+    options = cpu_memory_options(profile, host)
+    if "pids" in profile:
+        options["pids_limit"] = int(profile["pids"])
+    if "shm_size" in profile:
+        if shm:
+            print("Warning: the shm_size of the resource profile is not used with --shm, the host /dev/shm is shared")
+        else:
+            options["shm_size"] = parse_size(profile["shm_size"])
+    ulimits = profile_ulimits(profile)
+    if ulimits:
+        options["ulimits"] = [Ulimit(name=name, soft=soft, hard=hard) for name, (soft, hard) in ulimits.items()]
+    if "rt_runtime" in profile:
+        options["cpu_rt_runtime"] = int(profile["rt_runtime"])
+    return options
+
+def update_options(profile, host, current):
+    """Return the arguments of container.update, limits the profile doesn't set are lifted."""
+    options = cpu_memory_options(profile or {}, host)
+    if "cpuset_cpus" not in options and current.get("CpusetCpus"):
+        options["cpuset_cpus"] = f"0-{host['NCPU'] - 1}"
+    if "cpu_quota" not in options and (current.get("CpuQuota") or 0) > 0:
+        options["cpu_quota"] = -1
+    if "cpu_shares" not in options and current.get("CpuShares") not in (None, 0, 1024):
+        options["cpu_shares"] = 1024
+    if "mem_limit" not in options and (current.get("Memory") or 0) > 0:
+        options["mem_limit"] = -1
+        options["memswap_limit"] = -1
+    if "mem_reservation" not in options and (current.get("MemoryReservation") or 0) > 0:
+        options["mem_reservation"] = 0
+    return options
+
+def fixed_differences(profile, current):
+    """Return the limits of the profile that differ on the container but can't be updated."""
+    wanted = create_options(profile or {}, {"NCPU": 1, "MemTotal": 0})
+    differences = []
+    # no limit is 0 or -1 depending on the docker version
+    if max(current.get("PidsLimit") or 0, 0) != wanted.get("pids_limit", 0):
+        differences.append("pids")
+    # with --shm the rosbox uses the /dev/shm of the host
+    if "shm_size" in wanted and current.get("IpcMode") != "host" and current.get("ShmSize") != wanted["shm_size"]:
+        differences.append("shm_size")
+    current_ulimits = {ulimit["Name"]: [ulimit["Soft"], ulimit["Hard"]] for ulimit in current.get("Ulimits") or []}
+    if current_ulimits != profile_ulimits(profile or {}):
+        differences.append("ulimits")
+    if (current.get("CpuRealtimeRuntime") or 0) != wanted.get("cpu_rt_runtime", 0):
+        differences.append("rt_runtime")
+    return differences
@@ -1,24 +1,37 @@
+# PYTHON_ARGCOMPLETE_OK
 from .config import load_config, save_config, update_config
-from .imageBuilder import InteractiveBuilder
-from .defaults import DEFAULT_IMAGES, DEFAULT_DOCKERHUB_IMAGES
-import docker
-from docker.types import Mount
-import subprocess
+from .dockerfileOptimizer import buildkit_enabled
+from .containerIndex import ContainerIndex, complete_rosbox_names
+from .workspaceCache import CACHE_KINDS, parse_cache_kinds, parse_size
+from .backends import get_backend_class, create_image_help, print_shell_timing
+from .resourceProfiles import resources_help, resolve_profile
+from .tracing import span, traced, default_trace_file
+from .defaults import DEFAULT_IMAGES, DEFAULT_DOCKERHUB_IMAGES, FAST_ENV_SUFFIX, entrypoint_template
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+import hashlib
+import time
 import argparse
+import contextvars
+import json
 import os
+import sys
 
-def check_docker():
-    try:
-        result = subprocess.run(['docker', '--version'],
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE,
-                                encoding='utf-8')
-        if result.returncode != 0:
-            print("Error: Docker is not installed. Please install Docker first!")
+# docker, jinja2 and pick are imported where they are needed, so `rosbox --help`
+# and the commands that don't use them start fast
+
+def connect_docker():
+    # an API ping checks that the daemon is reachable without spawning the docker CLI
+    with span('docker.connect'):
+        import docker
+        try:
+            client = docker.from_env()
+            client.ping()
+            return client
+        except docker.errors.DockerException as e:
+            print("Error: Docker daemon is not reachable. Please install and start Docker first!")
+            print(f"  {str(e)}")
             exit(1)
-    except Exception as e:
-        print("Error running docker --version:", e)
-        exit(1)
 
 def check_os():
     if os.name == 'nt':
@@ -34,11 +47,61 @@ class ContainerManager:
     rosbox_suffix = 'rosbox'
     dockerfile_path = 'Dockerfile'
 
-    def __init__(self):
-        self.client = docker.from_env()
-        self.interactive_builder = InteractiveBuilder(self.dockerfile_path)
-        self.config = load_config()
+    # fleet mode passes the client and the index of a remote host
+    def __init__(self, config=None, client=None, index=None):
+        self.config = config if config is not None else load_config()
+        self.index = index if index is not None else ContainerIndex(suffix=self.rosbox_suffix)
+        self._client = client
+        self._interactive_builder = None
+        self._update_checker = None
+        self._workspace_cache = None
+        self._backend = None
+        self._container_pool = None
+
+    # the subsystems below are only created by the commands that need them
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = connect_docker()
+        return self._client
+
+    @property
+    def interactive_builder(self):
+        if self._interactive_builder is None:
+            from .imageBuilder import InteractiveBuilder
+            self._interactive_builder = InteractiveBuilder(self.dockerfile_path, self.client)
+        return self._interactive_builder
+
+    @property
+    def update_checker(self):
+        if self._update_checker is None:
+            from .updateCheck import UpdateChecker
+            self._update_checker = UpdateChecker(self.client, self.config["update_check_ttl"], self.config["offline"])
+        return self._update_checker
+
+    # docker or distrobox, the container lifecycle commands go through it
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = get_backend_class(self.config)(self)
+        return self._backend
 
+    @property
+    def container_pool(self):
+        if self._container_pool is None:
+            from .containerPool import ContainerPool
+            self._container_pool = ContainerPool(self)
+        return self._container_pool
+
+    @property
+    def workspace_cache(self):
+        if self._workspace_cache is None:
+            from .workspaceCache import WorkspaceCache
+            self._workspace_cache = WorkspaceCache(self.client, self.config["cache_max_size"])
+        return self._workspace_cache
+
+    @traced('image.pull')
     def pull_image(self, image):
         try:
             print("Downloading image...")
@@ -53,24 +116,40 @@ class ContainerManager:
             print(f"Error pulling image: {str(e)}")
             exit(1)
 
+    @traced('image.select')
     def select_default_image(self, image, pullOrBuild: bool):
+        import docker
         if image in DEFAULT_IMAGES:
             if pullOrBuild:
                 print(f'use default image {DEFAULT_IMAGES[image]["image-name"]} from dockerhub')
                 # First check if image exists locally
+                image_name = DEFAULT_DOCKERHUB_IMAGES[image]
                 try:
-                    local_image = self.client.images.get(DEFAULT_DOCKERHUB_IMAGES[image])
+                    self.client.images.get(image_name)
+                    if self.update_checker.offline:
+                        print("Offline mode: using the local image without checking for updates")
+                        return image_name
                     try:
-                        # Check for updates
+                        # Check for updates by comparing the local and remote digests
                         print("Checking for updates...")
-                        return self.pull_image(image)
-                        return DEFAULT_DOCKERHUB_IMAGES[image]
+                        if not self.update_checker.needs_update(image_name):
+                            print("Image is up to date")
+                            return image_name
+                        print("A newer image is available")
+                        image_name = self.pull_image(image)
+                        self.update_checker.mark_pulled(image_name)
+                        return image_name
                     except Exception as e:
                         print(f"Warning: Could not check for updates: {str(e)}")
-                        return DEFAULT_DOCKERHUB_IMAGES[image]
+                        return image_name
                 except docker.errors.ImageNotFound:
-                    print(f"Image '{DEFAULT_DOCKERHUB_IMAGES[image]}' not found locally. Pulling from Docker Hub...")
-                    return self.pull_image(image)
+                    if self.update_checker.offline:
+                        print(f"Error: Image '{image_name}' not found locally and offline mode is enabled")
+                        exit(1)
+                    print(f"Image '{image_name}' not found locally. Pulling from Docker Hub...")
+                    image_name = self.pull_image(image)
+                    self.update_checker.mark_pulled(image_name)
+                    return image_name
             else:
                 print(f'use default image {DEFAULT_IMAGES[image]["image-name"]} and build locally')
                 try:
@@ -84,421 +163,872 @@ class ContainerManager:
             print(f"Error: Image '{image}' not found in DEFAULT_IMAGES")
             exit(1)
 
-    def get_image_name_distrobox(self, image_name):
-        return DEFAULT_DOCKERHUB_IMAGES[image_name]
+    # the arguments of containers.create for a rosbox, shared by create and the container pool
+    def container_create_options(self, image_tag, hostname, ros_ws_path=None, ssh_dir=False, host_net=True, caches=None, shm=False, ws_volume=None, resources=None):
+        from docker.types import Mount
+        # create mounts
+        mounts = []
+        if ssh_dir:
+            ssh_path = os.path.expanduser("~/.ssh")
+            if os.path.exists(ssh_path):
+                mounts.append(Mount(
+                    target="/home/ubuntu/.ssh",
+                    source=ssh_path,
+                    type="bind",
+                    read_only=True  # Read-only for security
+                ))
+        extra_environment = []
+        extra_options = {}
+        # named build cache volumes shared by all rosboxes of this image
+        if caches:
+            cache_mounts, cache_environment = self.workspace_cache.mounts(image_tag, caches)
+            mounts.extend(cache_mounts)
+            extra_environment.extend(cache_environment)
+        # host IPC namespace and a FastDDS shared memory profile for zero-copy transport between rosboxes
+        if shm:
+            from .shmTransport import shm_container_options
+            if not host_net:
+                print("Warning: FastDDS only uses shared memory between participants on the same network host, use it without --no_host_net")
+            shm_options, shm_mounts, shm_environment = shm_container_options(self.config["shm_size"])
+            extra_options.update(shm_options)
+            mounts.extend(shm_mounts)
+            extra_environment.extend(shm_environment)
+        # the workspace in a named volume, `rosbox sync` mirrors it to ros_ws_path
+        if ws_volume:
+            from .workspaceSync import container_workspace
+            mounts.append(Mount(target=container_workspace, source=ws_volume, type="volume"))
+        # CPU, memory and process limits of the resource profile
+        if resources:
+            from .resourceProfiles import create_options, needs_host
+            extra_options.update(create_options(resources, self.client.info() if needs_host(resources) else {}, shm))
+        if check_os() == 'windows': # for running on windows
+            # add ros_ws mount for ROS workspace
+            if ros_ws_path and not ws_volume:
+                mounts.append(Mount(
+                    target="/home/ubuntu/ros_ws",
+                    source=os.path.abspath(ros_ws_path),
+                    type="bind",
+                    read_only=False
+                ))
+            # add X11 mount for GUI support on windows
+            if self.config["use_x11"]:
+                mounts.append(Mount(target="/tmp/.X11-unix", source="/run/desktop/mnt/host/wslg/.X11-unix", type="bind"))
+            if self.config["mount_dev_dir"]:
+                mounts.append(Mount(target="/dev", source="/dev", type="bind"))
+            environment = ["DISPLAY=:0"]
+        elif check_os() == 'linux': # for running on linux
+            # add ros_ws mount for ROS workspace
+            if ros_ws_path and not ws_volume:
+                mounts.append(Mount(
+                    target="/home/ubuntu/ros_ws",
+                    source=os.path.abspath(ros_ws_path),
+                    type="bind",
+                    read_only=False,
+                    propagation="rslave"
+                ))
+            # add X11 and Xauthority mounts for GUI support on linux
+            if self.config["use_x11"]:
+                mounts.append(Mount(target="/tmp/.X11-unix", source="/tmp/.X11-unix", type="bind"))
+                mounts.append(Mount(target=os.environ.get('XAUTHORITY'), source=os.environ.get('XAUTHORITY'), type="bind", read_only=True))
+            if self.config["mount_dev_dir"]:
+                mounts.append(Mount(target="/dev", source="/dev", type="bind"))
+            environment = ["DISPLAY=:0", "XAUTHORITY=" + str(os.environ.get('XAUTHORITY'))]
+        else:
+            print("Error: Unsupported OS")
+            exit(1)
+        return dict(
+            hostname=hostname,
+            detach=True,
+            mounts=mounts,
+            labels={"type": "rosbox"},
+            network_mode="host" if host_net else "bridge",
+            environment=environment + extra_environment,
+            privileged=True,
+            entrypoint=["sh", "-c", "sleep infinity"],
+            **extra_options
+        )
 
     # TODO add nvidia suport
-    def create_container_docker(self, image_tag, container_name, ros_ws_path=None, auto_start=True, ssh_dir=False, host_net=True, gpu=False):
+    @traced('container.create')
+    def create_container_docker(self, image_tag, container_name, ros_ws_path=None, auto_start=True, ssh_dir=False, host_net=True, gpu=False, caches=None, shm=False, use_pool=True, labels=None, ws_volume=False, resources=None):
+        import docker
+        name = container_name
         container_name = f"{container_name}_{self.rosbox_suffix}"
         try:
             existing_container = self.client.containers.get(container_name)
-            print(f"Error: Container with name '{container_name.replace('_' + self.rosbox_suffix, '')}' already exists")
+            print(f"Error: Container with name '{name}' already exists")
             exit(1)
         except docker.errors.NotFound:
             pass
+        start = time.perf_counter()
+        options = {'ros_ws': os.path.abspath(ros_ws_path) if ros_ws_path else None, 'ssh_keys': ssh_dir, 'host_net': host_net,
+                   'caches': caches or [], 'shm': shm}
+        if ws_volume:
+            options['ws_volume'] = True
+        # with the values of the profile, so the pool only serves rosboxes created with the same limits
+        if resources:
+            options['resources'] = resources
         try:
-            # create mounts
-            mounts = []
-            if ssh_dir:
-                ssh_path = os.path.expanduser("~/.ssh")
-                if os.path.exists(ssh_path):
-                    mounts.append(Mount(
-                        target="/home/ubuntu/.ssh",
-                        source=ssh_path,
-                        type="bind",
-                        read_only=True  # Read-only for security
-                    ))
-            # create container
-            if check_os() == 'windows': # for running on windows
-                # add ros_ws mount for ROS workspace
-                if ros_ws_path:
-                    mounts.append(Mount(
-                        target="/home/ubuntu/ros_ws",
-                        source=os.path.abspath(ros_ws_path),
-                        type="bind",
-                        read_only=False
-                    ))
-                # add X11 mount for GUI support on windows
-                if self.config["use_x11"]:
-                    mounts.append(Mount(target="/tmp/.X11-unix", source="/run/desktop/mnt/host/wslg/.X11-unix", type="bind"))
-                if self.config["mount_dev_dir"]:
-                    mounts.append(Mount(target="/dev", source="/dev", type="bind"))
-                container = self.client.containers.create(
-                    image_tag, name=container_name,
-                    hostname=container_name.replace('_' + self.rosbox_suffix, ''),
-                    detach=True,
-                    mounts=mounts,
-                    labels={"type": "rosbox"},
-                    network_mode="host" if host_net else "bridge",
-                    environment=["DISPLAY=:0"],
-                    privileged = True,
-                    entrypoint=["sh", "-c", "sleep infinity"]
-                )
-            elif check_os() == 'linux': # for running on linux
-                # add ros_ws mount for ROS workspace
-                if ros_ws_path:
-                    mounts.append(Mount(
-                        target="/home/ubuntu/ros_ws",
-                        source=os.path.abspath(ros_ws_path),
-                        type="bind",
-                        read_only=False,
-                        propagation="rslave"
-                    ))
-                # add X11 and Xauthority mounts for GUI support on linux
-                if self.config["use_x11"]:
-                    mounts.append(Mount(target="/tmp/.X11-unix", source="/tmp/.X11-unix", type="bind"))
-                    mounts.append(Mount(target=os.environ.get('XAUTHORITY'), source=os.environ.get('XAUTHORITY'), type="bind", read_only=True))
-                if self.config["mount_dev_dir"]:
-                    mounts.append(Mount(target="/dev", source="/dev", type="bind"))
-                # create container
-                container = self.client.containers.create(
-                    image_tag, name=container_name,
-                    hostname=container_name.replace('_' + self.rosbox_suffix, ''),
-                    detach=True,
-                    mounts=mounts,
-                    labels={"type": "rosbox"},
-                    network_mode="host" if host_net else "bridge",
-                    environment=["DISPLAY=:0", "XAUTHORITY=" + str(os.environ.get('XAUTHORITY'))],
-                    privileged=True,
-                    entrypoint=["sh", "-c", "sleep infinity"]
-                )
+            # a started container from the pool of this image, if one was created with the same options
+            # pooled containers were created without the extra labels and the workspace volume
+            pooled = use_pool and auto_start and not labels and not ws_volume and self.container_pool.tracks(image_tag)
+            container_id = self.container_pool.claim(image_tag, options, container_name) if pooled else None
+            hit = container_id is not None
+            if hit:
+                print(f"Container {name} taken from the pool")
+                self.index.update(name, id=container_id, status='running', image=image_tag, options=options)
             else:
-                print("Error: Unsupported OS")
-                exit(1)
-
-            print(f"Container {container_name.replace('_' + self.rosbox_suffix, '')} created successfully")
-            # start container
-            if auto_start:
-                container.start()
-                print(f"Container {container_name.replace('_' + self.rosbox_suffix, '')} started successfully")
+                # create container
+                volume = None
+                if ws_volume:
+                    from .workspaceSync import workspace_volume
+                    volume = workspace_volume(name)
+                create_options = self.container_create_options(image_tag, name, ros_ws_path, ssh_dir, host_net, caches, shm, volume, resources)
+                if labels:
+                    create_options['labels'] = dict(create_options['labels'], **labels)
+                container = self.client.containers.create(image_tag, name=container_name, **create_options)
+                container_id = container.id
+                print(f"Container {name} created successfully")
+                self.index.update(name, id=container.id, status='created', image=image_tag, options=options)
+                # start container
+                if auto_start:
+                    container.start()
+                    if caches:
+                        self.workspace_cache.prepare(container, caches)
+                    self.index.update(name, status='running')
+                    print(f"Container {name} started successfully")
+                    if ws_volume and ros_ws_path:
+                        from .workspaceSync import print_plan
+                        print_plan(self.workspace_sync(name).run())
+                elif ws_volume and ros_ws_path:
+                    print(f"Run `rosbox sync run {name}` after starting it to copy the workspace into its volume")
+            if pooled:
+                self.container_pool.wait_ready(container_id)
+                seconds = time.perf_counter() - start
+                self.container_pool.record(image_tag, hit, seconds)
+                print(f"Ready for a shell after {seconds:.2f}s")
         except Exception as e:
             print(f"Error creating container: {str(e)}")
             raise
 
-    def create_container_distrobox(self, image_tag, container_name, home_dir=None, gpu=False):
-        container_name = f"{container_name}_{self.rosbox_suffix}"
-        try:
-            # Check if distrobox is installed
-            result = subprocess.run(['which', 'distrobox'],
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE,
-                                  encoding='utf-8')
-            if result.returncode != 0:
-                print("Error: distrobox is not installed. Please install distrobox first!")
-                exit(1)
-
-            # Prepare command
-            cmd = ['distrobox', 'create', '-i', image_tag, '-n', container_name]
-
-            # Add home directory if specified
-            if home_dir:
-                cmd.extend(['--home', os.path.abspath(home_dir)])
-
-            # Add NVIDIA GPU support if requested
-            if gpu:
-                cmd.extend(['--nvidia'])
-                print("NVIDIA GPU support enabled")
-
-            # Create the distrobox container
-            result = subprocess.run(cmd,
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE,
-                                  encoding='utf-8')
-
-            if result.returncode != 0:
-                print(f"Error creating distrobox container: {result.stderr}")
-                exit(1)
-            else:
-                print(f"Distrobox container {container_name.replace('_' + self.rosbox_suffix, '')} created successfully")
-
-        except Exception as e:
-            print(f"Error creating distrobox container: {str(e)}")
-            raise
+    # a rosbox created without starting it (create --no_start, "start": false in rosbox.json) gets its caches prepared
+    # when it is started, preparing them again only repeats the chown
+    def prepare_caches(self, container):
+        from .workspaceCache import container_cache_kinds
+        caches = container_cache_kinds(container)
+        if caches:
+            self.workspace_cache.prepare(container, caches)
 
+    @traced('container.start')
     def start_container(self, container_name):
         container_name = f"{container_name}_{self.rosbox_suffix}"
         try:
             container = self.client.containers.get(container_name)
             container.start()
+            self.prepare_caches(container)
+            self.index.update(container_name.replace('_' + self.rosbox_suffix, ''), id=container.id, status='running')
             print(f"Container {container_name.replace('_' + self.rosbox_suffix, '')} started successfully")
         except Exception as e:
             print(f"Error starting container: {str(e)}")
             raise
 
-    def enter_container_docker(self, container_name):
+    def enter_container_docker(self, container_name, timing=False):
         container_name = f"{container_name}_{self.rosbox_suffix}"
         try:
+            start = time.perf_counter()
             container = self.client.containers.get(container_name)
             if container.status != 'running':
                 container.start()
+                self.prepare_caches(container)
                 print(f"Container {container_name.replace('_' + self.rosbox_suffix, '')} started before entering")
-            command = f"docker exec -it {container_name} bash"
-            subprocess.run(command, shell=True)
+            if timing:
+                print_shell_timing(time.perf_counter() - start, lambda command: container.exec_run(command))
+            from .execSession import exec_interactive
+            exec_interactive(self.client, container, ['bash'])
         except Exception as e:
             print(f"Error entering container: {str(e)}")
             raise
 
-    def enter_container_distrobox(self, cotnaienr_name):
-        container_name = f"{cotnaienr_name}_{self.rosbox_suffix}"
-        try:
-            # Check if distrobox is installed
-            result = subprocess.run(['which', 'distrobox'],
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE,
-                                  encoding='utf-8')
-            if result.returncode != 0:
-                print("Error: distrobox is not installed. Please install distrobox first!")
-                exit(1)
+    # run a command in a running rosbox, attached to the terminal or streaming its output
+    def exec_container(self, container_name, command, interactive=False, prefix=None):
+        from .execSession import exec_interactive, exec_stream
+        container = self.client.containers.get(f"{container_name}_{self.rosbox_suffix}")
+        if container.status != 'running':
+            raise Exception(f"rosbox {container_name} is not running")
+        if interactive:
+            return exec_interactive(self.client, container, command)
+        return exec_stream(self.client, container, command, prefix)
 
-            # Enter the distrobox container
-            command = f"distrobox enter {container_name}"
-            subprocess.run(command, shell=True)
-        except Exception as e:
-            print(f"Error entering distrobox container: {str(e)}")
-            raise
+    # the sync between the host directory and the workspace volume of a rosbox
+    def workspace_sync(self, container_name, ros_ws_path=None, restore=False):
+        from .workspaceSync import WorkspaceSync, LocalDirEndpoint, ContainerEndpoint, sync_state_file
+        options = self.index.containers.get(container_name, {}).get('options') or {}
+        ros_ws_path = ros_ws_path or options.get('ros_ws')
+        if not ros_ws_path:
+            raise Exception(f"rosbox {container_name} has no host workspace, give it with --ros_ws")
+        container = self.client.containers.get(f"{container_name}_{self.rosbox_suffix}")
+        if container.status != 'running':
+            raise Exception(f"rosbox {container_name} is not running")
+        ignore = self.config["sync_ignore"]
+        return WorkspaceSync(LocalDirEndpoint(ros_ws_path, ignore), ContainerEndpoint(self.client, container, ignore),
+                             sync_state_file(container_name), restore)
+
+    # change the CPU and memory limits of a rosbox to the ones of a resource profile, None lifts them
+    def update_container(self, container_name, resources):
+        from .resourceProfiles import update_options, fixed_differences
+        container = self.client.containers.get(f"{container_name}_{self.rosbox_suffix}")
+        current = container.attrs['HostConfig']
+        container.update(**update_options(resources, self.client.info(), current))
+        options = dict(self.index.containers.get(container_name, {}).get('options') or {})
+        if resources:
+            options['resources'] = resources
+        else:
+            options.pop('resources', None)
+        self.index.update(container_name, id=container.id, options=options)
+        print(f"Container {container_name} updated to " + (f"the {resources['name']} resource profile" if resources else "no resource limits"))
+        differences = fixed_differences(resources, current)
+        if differences:
+            print(f"Warning: {', '.join(differences)} of {container_name} only change when it is created again")
 
-    def stop_container(self, container_name):
+    @traced('container.stop')
+    def stop_container(self, container_name, timeout=None):
         container_name = f"{container_name}_{self.rosbox_suffix}"
         try:
             container = self.client.containers.get(container_name)
-            container.stop()
+            container.stop(timeout=timeout if timeout is not None else self.config["stop_timeout"])
+            self.index.update(container_name.replace('_' + self.rosbox_suffix, ''), id=container.id, status='exited')
             print(f"Container {container_name.replace('_' + self.rosbox_suffix, '')} stopped successfully")
         except Exception as e:
             print(f"Error stopping container: {str(e)}")
             raise
 
     def list_containers_docker(self):
-        containers = [c for c in self.client.containers.list(all=True, filters={"label": "type=rosbox"})]
+        # one batched call for all rosboxes, which also refreshes the local index
+        containers = self.index.sync(self.client)
         print(f"{'ID':<12} | {'NAME':<20} | {'STATUS':<20} | {'IMAGE':<20}")
         print("-" * 72)
-        for container in containers:
-            name = container.name.replace("_" + self.rosbox_suffix, "")
-            print(f"{container.short_id:<12} | {name:<20} | {container.status:<20} | {container.image.tags[0]:<20}")
+        for name, container in sorted(containers.items()):
+            print(f"{container['id'][:12]:<12} | {name:<20} | {container['status']:<20} | {container['image']:<20}")
         print(("-" * 72) + "\n")
 
-    def list_containers_distrobox(self):
-        try:
-            # Check if distrobox is installed
-            result = subprocess.run(['which', 'distrobox'],
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE,
-                                  encoding='utf-8')
-            if result.returncode != 0:
-                print("Error: distrobox is not installed. Please install distrobox first!")
-                return
-
-            # List all distrobox containers
-            result = subprocess.run(['distrobox', 'list'],
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE,
-                                  encoding='utf-8')
-
-            if result.returncode != 0:
-                print(f"Error listing distrobox containers: {result.stderr}")
-                return
-
-            # Filter only distrobox containers with _rosbox suffix
-            containers = []
-            lines = result.stdout.strip().split('\n')
-
-            # Skip header line
-            if len(lines) > 1:
-                header = lines[0]
-                print(header)
-                print("-" * len(header))
-
-                for line in lines[1:]:
-                    if f"_{self.rosbox_suffix}" in line:
-                        print(line)
-                        containers.append(line)
-
-                if not containers:
-                    print(f"No distrobox containers with _{self.rosbox_suffix} suffix found.")
-            else:
-                print("No distrobox containers found.")
-
-        except Exception as e:
-            print(f"Error listing distrobox containers: {str(e)}")
-
+    @traced('container.remove')
     def remove_container_docker(self, container_name):
         container_name = f"{container_name}_{self.rosbox_suffix}"
         try:
             container = self.client.containers.get(container_name)
             if container.status == 'running':
                 print(f"Please stop the {container_name.replace('_' + self.rosbox_suffix, '')} first.")
-                return
+                return False
             container.remove()
+            self.index.remove(container_name.replace('_' + self.rosbox_suffix, ''))
             print(f"Container {container_name.replace('_' + self.rosbox_suffix, '')} removed successfully")
+            return True
         except Exception as e:
             print(f"Error removing container: {str(e)}")
             raise
 
-    def remove_container_distrobox(self, container_name):
-        container_name = f"{container_name}_{self.rosbox_suffix}"
+    # expand names, glob patterns and --all to rosbox names, with one batched list call
+    def resolve_container_names(self, patterns, all_containers=False):
+        is_glob = lambda pattern: any(c in pattern for c in '*?[')
+        # plain names don't need the daemon to be resolved
+        if not all_containers and not any(is_glob(p) for p in patterns):
+            return list(dict.fromkeys(patterns)), []
+        known = list(self.backend.list().keys())
+        if all_containers:
+            return sorted(known), []
+        names = []
+        unmatched = []
+        for pattern in patterns:
+            if is_glob(pattern):
+                matches = sorted(fnmatch.filter(known, pattern))
+                if not matches:
+                    unmatched.append(pattern)
+                names.extend(matches)
+            else:
+                names.append(pattern)
+        return list(dict.fromkeys(names)), unmatched
+
+    # run a lifecycle action on many rosboxes over a bounded thread pool and report per container
+    def run_bulk(self, action, names, jobs, verb):
+        def run(name):
+            try:
+                if action(name) is False:
+                    return name, f"not {verb}"
+                return name, None
+            except SystemExit:
+                return name, "failed"
+            except Exception as e:
+                return name, str(e)
+
+        if not names:
+            return True
+        # every worker runs in a copy of the caller's context, fleet mode keeps the host of its output there
+        contexts = [contextvars.copy_context() for _ in names]
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(names)))) as pool:
+            results = list(pool.map(lambda context, name: context.run(run, name), contexts, names))
+        failed = [(name, error) for name, error in results if error is not None]
+        if len(names) > 1:
+            print(f"{len(names) - len(failed)}/{len(names)} rosboxes {verb}")
+            for name, error in failed:
+                print(f"  {name}: {error}")
+        return not failed
+
+    # default image names resolve to the pulled image first, then to the locally built one
+    def resolve_local_image(self, image):
+        import docker
+        candidates = [image]
+        if image in DEFAULT_IMAGES:
+            candidates = [DEFAULT_DOCKERHUB_IMAGES.get(image), DEFAULT_IMAGES[image]["image-name"]]
+        for candidate in candidates:
+            if candidate is None:
+                continue
+            try:
+                self.client.images.get(candidate)
+                return candidate
+            except docker.errors.ImageNotFound:
+                pass
+        print(f"Error: image '{image}' not found locally, pull or build it first")
+        exit(1)
+
+    def export_image(self, image, output_path=None, compression=None, level=None, threads=None):
+        from .imageTransfer import ImageTransfer
+        image_name = self.resolve_local_image(image)
         try:
-            # Check if distrobox is installed
-            result = subprocess.run(['which', 'distrobox'],
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE,
-                                  encoding='utf-8')
-            if result.returncode != 0:
-                print("Error: distrobox is not installed. Please install distrobox first!")
-                exit(1)
+            ImageTransfer(self.client).export_image(image_name, output_path, compression, level, threads)
+        except Exception as e:
+            print(f"Error exporting image: {str(e)}")
+            exit(1)
 
-            # Remove the distrobox container
-            result = subprocess.run(['distrobox', 'rm', container_name],
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE,
-                                  encoding='utf-8')
+    def import_image(self, path, verify=True):
+        from .imageTransfer import ImageTransfer
+        if not os.path.isfile(path):
+            print(f"Error: file '{path}' not found")
+            exit(1)
+        try:
+            ImageTransfer(self.client).import_image(path, verify)
+        except Exception as e:
+            print(f"Error importing image: {str(e)}")
+            exit(1)
 
-            if result.returncode != 0:
-                print(f"Error removing distrobox container: {result.stderr}")
-                exit(1)
-            else:
-                print(f"Distrobox container {container_name.replace('_' + self.rosbox_suffix, '')} removed successfully")
+    def push_image(self, host, image, tag=None):
+        from .layerSync import LayerSync, connect_remote
+        image_name = self.resolve_local_image(image)
+        remote = connect_remote(host)
+        try:
+            LayerSync(self.client, remote).push(image_name, tag)
+        except Exception as e:
+            print(f"Error pushing image: {str(e)}")
+            exit(1)
 
+    def analyze_image(self, image, as_json=False, top=15, scan=True):
+        from .imageAnalyzer import ImageAnalyzer, print_report, report_json
+        image_name = self.resolve_local_image(image)
+        if not as_json and scan:
+            print(f"Scanning the layers of {image_name}...")
+        try:
+            report = ImageAnalyzer(self.client).analyze(image_name, scan)
         except Exception as e:
-            print(f"Error removing distrobox container: {str(e)}")
-            raise
+            print(f"Error analyzing image: {str(e)}")
+            exit(1)
+        if as_json:
+            print(report_json(report))
+        else:
+            print_report(report, top)
+
+    # check if a local image was built from exactly the same templates and options
+    def is_image_up_to_date(self, image_name, fingerprint):
+        import docker
+        from .imageBuilder import fingerprint_label
+        try:
+            local_image = self.client.images.get(image_name)
+        except docker.errors.ImageNotFound:
+            return False
+        return (local_image.labels or {}).get(fingerprint_label) == fingerprint
 
-    def build_image(self, image, no_build = False):
+    @traced('image.build')
+    def build_image(self, image, no_build = False, optimize = True, force = False, profile = False, profile_file = None, fast_env = False):
         if image not in DEFAULT_IMAGES:
             print(f"Error: Image '{image}' not found in DEFAULT_IMAGES")
             exit(1)
         image_name = DEFAULT_IMAGES[image]["image-name"]
-        print(f"Generating Dockerfile for image {image_name}...")
         base_template = DEFAULT_IMAGES[image]["base"]
         ros_template = DEFAULT_IMAGES[image]["ros"]
-        enteryPoint_template = DEFAULT_IMAGES[image]["entrypoint"]
+        enteryPoint_template = entrypoint_template(image, fast_env)
         default_template = DEFAULT_IMAGES[image]["default"]
-        self.interactive_builder.generator.generate_dockerfile(base_template, ros_template, enteryPoint_template, self.interactive_builder.dockerfile_path, default_template)
-        if not no_build:
+        generator = self.interactive_builder.generator
+        # the API build uses the classic builder, cache mounts only work for a manual BuildKit build
+        buildkit = no_build and buildkit_enabled()
+        fingerprint = generator.compute_fingerprint(base_template, ros_template, enteryPoint_template, default_template, optimize, buildkit)
+        if not no_build and not force and self.is_image_up_to_date(image_name, fingerprint):
+            print(f"Image {image_name} is up to date (fingerprint {fingerprint[:12]}), skipping build. Use --force to rebuild.")
+            return
+        print(f"Generating Dockerfile for image {image_name}...")
+        assets = generator.generate_dockerfile(base_template, ros_template, enteryPoint_template, self.interactive_builder.dockerfile_path, default_template, optimize, buildkit)
+        stats = generator.optimize_stats
+        if stats:
+            print(f"Optimized Dockerfile: {stats['runs_before']} -> {stats['runs_after']} RUN layers, {stats['updates_removed']} redundant apt updates removed")
+        if no_build:
+            # keep the referenced template assets next to the Dockerfile for a manual `docker build`
+            generator.export_assets(assets, os.path.dirname(os.path.abspath(self.interactive_builder.dockerfile_path)))
+        else:
             print(f"Building image {image_name}...")
-            self.interactive_builder.image_builder.build_image(image_name)
+            from .imageBuilder import fingerprint_label, image_label
+            labels = {fingerprint_label: fingerprint, image_label: image}
+            if not profile:
+                self.interactive_builder.image_builder.build_image(image_name, assets, labels=labels)
+                return
+            from .imageBuilder import print_build_event
+            from .buildProfiler import BuildProfile, report_build
+            build_profile = BuildProfile(image, fingerprint)
+            # a failed build is reported too, the slow step is often the one that failed
+            try:
+                self.interactive_builder.image_builder.build_image(image_name, assets, build_profile.wrap(print_build_event), labels)
+            finally:
+                report_build(build_profile, profile_file)
 
-    def build_image_it(self, image_name, no_build):
-        self.interactive_builder.generate_dockerfile(entryPoint = 'rosbox')
-        if not no_build:
+    # build several default images at once, sharing the stages they have in common
+    @traced('image.build_all')
+    def build_images(self, images, jobs, optimize = True, force = False, profile = False, profile_file = None, fast_env = False):
+        for image in images:
+            if image not in DEFAULT_IMAGES:
+                print(f"Error: Image '{image}' not found in DEFAULT_IMAGES")
+                exit(1)
+        from .buildPlanner import BuildPlanner
+        generator = self.interactive_builder.generator
+        planner = BuildPlanner(generator, self.interactive_builder.image_builder, self.client, optimize, profile, fast_env)
+        stages = planner.plan(images)
+        print(f"Building {len(images)} images from {len(stages)} stages with {jobs} workers...")
+        success = planner.build(jobs, force)
+        planner.print_report()
+        if profile:
+            from .buildProfiler import report_build
+            for stage in stages.values():
+                if stage.status == 'built':
+                    report_build(stage.profile, profile_file)
+        if not success:
+            print("Error: not all images were built")
+            exit(1)
+
+    def build_image_it(self, image_name, no_build, optimize = True, fast_env = False):
+        self.interactive_builder.generate_dockerfile(entryPoint = 'rosbox' + (FAST_ENV_SUFFIX if fast_env else ''), optimize = optimize, buildkit = no_build and buildkit_enabled())
+        if no_build:
+            self.interactive_builder.generator.export_assets(self.interactive_builder.assets, os.path.dirname(os.path.abspath(self.dockerfile_path)))
+        else:
             self.interactive_builder.build_image(image_name)
 
-def main():
-    # check first if docker is installed
-    check_docker()
+# names, glob patterns and --all for the commands that act on many rosboxes at once
+def add_bulk_arguments(parser, config):
+    parser.add_argument('name', nargs='*', help='names or glob patterns of the rosboxes').completer = complete_rosbox_names
+    parser.add_argument('--all', '-a', help='all rosboxes', action='store_true')
+    parser.add_argument('--jobs', '-j', help='number of rosboxes handled in parallel', type=int, default=config["bulk_jobs"])
+    add_fleet_arguments(parser)
+
+# the docker hosts of the fleet for the commands that act on many rosboxes
+def add_fleet_arguments(parser):
+    parser.add_argument('--hosts', help='run on these fleet hosts: comma separated names or glob patterns from the `fleet` config, or docker host urls', default=None)
+    parser.add_argument('--fleet', help='run on every host of the fleet', action='store_true')
+
+# start, stop, remove and exec on resolved names, the same for the local daemon and every fleet host
+def run_bulk_command(manager, args, names, command=None):
+    if args.command == 'start':
+        return manager.run_bulk(manager.backend.start, names, args.jobs, 'started')
+    if args.command == 'stop':
+        return manager.run_bulk(lambda name: manager.backend.stop(name, args.timeout), names, args.jobs, 'stopped')
+    if args.command == 'remove':
+        return manager.run_bulk(manager.backend.remove, names, args.jobs, 'removed')
+    if args.command == 'update':
+        return manager.run_bulk(lambda name: manager.update_container(name, args.profile), names, args.jobs, 'updated')
+    def run(name):
+        code = manager.backend.exec(name, command, prefix=f"[{name}] ")
+        if code != 0:
+            raise Exception(f"exit code {code}")
+    return manager.run_bulk(run, names, args.jobs, 'finished')
+
+def run_on_fleet(config, args, command):
+    from .fleet import Fleet, select_hosts
+    hosts = select_hosts(config, args.hosts, args.fleet)
+    if not hosts:
+        print("Error: no fleet hosts, add them to `fleet` in the config")
+        exit(1)
+    fleet = Fleet(config, hosts)
+    if args.command == 'list':
+        results = fleet.run(lambda host, manager: manager.backend.list())
+        fleet.print_list(results)
+        return all(error is None for _, error in results.values())
 
-    manager = ContainerManager()
+    def action(host, manager):
+        # a name or pattern only has to match on one of the hosts
+        known = sorted(manager.backend.list())
+        names = known if args.all else [name for name in known if any(fnmatch.fnmatchcase(name, pattern) for pattern in args.name)]
+        if not run_bulk_command(manager, args, names, command):
+            raise Exception("not all rosboxes succeeded")
+        return names
+    print(f"Running {args.command} on {len(hosts)} hosts: {', '.join(hosts)}")
+    results = fleet.run(action)
+    success = fleet.print_summary(results, 'succeeded')
+    matched = [name for names, error in results.values() if error is None for name in names]
+    for pattern in dict.fromkeys(args.name):
+        if not any(fnmatch.fnmatchcase(name, pattern) for name in matched):
+            print(f"Error: no rosbox matches '{pattern}' on the reachable hosts")
+            success = False
+    return success
+
+def main():
+    config = load_config()
 
     parser = argparse.ArgumentParser(description='rosbox manager')
+    parser.add_argument('--trace', help=f'time the docker API calls, subprocesses and template renders, write them as a Chrome trace ({default_trace_file}) and show the slowest on stderr', action='store_true')
+    parser.add_argument('--trace_file', help=f'file of the Chrome trace (implies --trace, default {default_trace_file})', default=None)
     subparsers = parser.add_subparsers(dest='command', help='Command to execute')
 
     # Create parser for "create" command
     create_parser = subparsers.add_parser('create', help='create rosbox')
-    create_parser.add_argument('image',
-        help='If no flags: default images {' + ', '.join(DEFAULT_IMAGES.keys()) + '}. ' +
-             'If --custom: full Docker image name. ' +
-             'If --build: name default images to build locally')
-    if manager.config["container_manager"] == "distrobox":
-        create_parser.add_argument('name', help='name of the rosbox')
-        create_parser.add_argument('--ros_home', '-w', help='path to the container home', default=None)
-        create_parser.add_argument('--custom', '-c', help='Use a custom image (provide full image name)', action='store_true')
-        create_parser.add_argument('--gpu', help='Enable NVIDIA GPU support', action='store_true')
-    else:
-        create_parser.add_argument('name', help='name of the rosbox')
-        create_parser.add_argument('--custom', '-c', help='Use a custom Docker image (provide full image name)', action='store_true')
-        create_parser.add_argument('--build', '-b', help='Use locally built default image instead of prebuilt one', action='store_true')
-        create_parser.add_argument('--ros_ws', '-w', help='path to the ROS workspace', default=None)
-        create_parser.add_argument('--no_start', help='disable container autostart wen created', action='store_true')
-        create_parser.add_argument('--ssh_keys', '-s', help='mount the ssh dir from host to container', action='store_true')
-        create_parser.add_argument('--no_host_net', help='do not use the host network', action='store_true')
+    create_parser.add_argument('image', help=create_image_help())
+    get_backend_class(config).add_create_arguments(create_parser, config)
     # TODO add nvidia suport
     # create_parser.add_argument('--gpu', help='use nvidia runtime', action='store_true')
 
     # Create parser for "start" command
     start_parser = subparsers.add_parser('start', help='start rosbox')
-    start_parser.add_argument('name', help='name of the rosbox')
+    add_bulk_arguments(start_parser, config)
 
     # Create parser for "enter" command
     enter_parser = subparsers.add_parser('enter', help='start rosbox')
-    enter_parser.add_argument('name', help='name of the rosbox')
+    enter_parser.add_argument('name', help='name of the rosbox').completer = complete_rosbox_names
+    enter_parser.add_argument('--timing', help='measure how long the shell takes to be ready before entering', action='store_true')
+
+    # Create parser for "exec" command
+    exec_parser = subparsers.add_parser('exec', help='run a command in rosboxes: rosbox exec <name> [<name> ...] -- <command>')
+    add_bulk_arguments(exec_parser, config)
+    exec_parser.add_argument('--interactive', '-i', help='attach the command to the terminal (one rosbox)', action='store_true')
 
     # Create parser for "stop" command
     stop_parser = subparsers.add_parser('stop', help='start rosbox')
-    stop_parser.add_argument('name', help='name of the rosbox')
+    add_bulk_arguments(stop_parser, config)
+    stop_parser.add_argument('--timeout', '-t', help='seconds to wait for a rosbox to stop before killing it', type=int, default=config["stop_timeout"])
+
+    # Create parser for "update" command
+    update_parser = subparsers.add_parser('update', help='change the CPU and memory limits of rosboxes to a resource profile')
+    add_bulk_arguments(update_parser, config)
+    update_parser.add_argument('--resources', '-r', help=resources_help(config) + ', none lifts the limits', required=True)
 
     # Create parser for "list" command
-    subparsers.add_parser('list', help='start rosbox')
+    list_parser = subparsers.add_parser('list', help='start rosbox')
+    add_fleet_arguments(list_parser)
+
+    # Create parser for "stats" command
+    stats_parser = subparsers.add_parser('stats', help='show the CPU, memory, network and disk usage of the running rosboxes')
+    stats_parser.add_argument('--once', help='sample once and exit instead of refreshing the table', action='store_true')
+    stats_parser.add_argument('--json', help='print the samples as JSON (one line per refresh)', action='store_true')
+    stats_parser.add_argument('--interval', help='seconds between refreshes', type=float, default=2.0)
 
     # Create parser for "remove" command
     remove_parser = subparsers.add_parser('remove', help='start rosbox')
-    remove_parser.add_argument('name', help='name of the rosbox')
+    add_bulk_arguments(remove_parser, config)
+
+    # Create parser for "up" and "down" commands
+    up_parser = subparsers.add_parser('up', help='create, start or recreate the rosboxes of a manifest until they match it')
+    up_parser.add_argument('name', nargs='*', help='only these rosboxes of the manifest (default all)')
+    up_parser.add_argument('--file', '-f', help='manifest file (default rosbox.json in the current directory)', default='rosbox.json')
+    up_parser.add_argument('--jobs', '-j', help='number of rosboxes handled in parallel', type=int, default=config["bulk_jobs"])
+    up_parser.add_argument('--recreate', help='recreate the rosboxes even if the manifest did not change', action='store_true')
+    up_parser.add_argument('--dry_run', help='only show what up would do', action='store_true')
+    down_parser = subparsers.add_parser('down', help='stop the rosboxes of a manifest')
+    down_parser.add_argument('name', nargs='*', help='only these rosboxes of the manifest (default all)')
+    down_parser.add_argument('--file', '-f', help='manifest file (default rosbox.json in the current directory)', default='rosbox.json')
+    down_parser.add_argument('--jobs', '-j', help='number of rosboxes handled in parallel', type=int, default=config["bulk_jobs"])
+    down_parser.add_argument('--remove', help='remove the rosboxes after stopping them', action='store_true')
+    down_parser.add_argument('--timeout', '-t', help='seconds to wait for a rosbox to stop before killing it', type=int, default=config["stop_timeout"])
+
+    # Create parser for "sync" command
+    sync_parser = subparsers.add_parser('sync', help='mirror the workspace volume of a rosbox (create --ws_volume) and its host directory')
+    sync_subparsers = sync_parser.add_subparsers(dest='sync_command')
+    sync_run_parser = sync_subparsers.add_parser('run', help='sync the changes of both sides once or with --watch until ctrl+C')
+    sync_run_parser.add_argument('name', help='name of the rosbox').completer = complete_rosbox_names
+    sync_run_parser.add_argument('--ros_ws', '-w', help='host directory of the workspace (default the --ros_ws of create)', default=None)
+    sync_run_parser.add_argument('--watch', help='keep syncing every --interval seconds', action='store_true')
+    sync_run_parser.add_argument('--interval', help='seconds between syncs with --watch (default sync_interval from the config)', type=float, default=config["sync_interval"])
+    sync_run_parser.add_argument('--restore', help='fill a side that lost every file from the other side instead of holding the deletions as a conflict', action='store_true')
+    sync_status_parser = sync_subparsers.add_parser('status', help='show the time since the last sync and the changes waiting on each side')
+    sync_status_parser.add_argument('name', nargs='*', help='names of the rosboxes (default all with a workspace volume)').completer = complete_rosbox_names
+    sync_dirs_parser = sync_subparsers.add_parser('dirs', help='sync two local directories with the same engine, the first one wins conflicts')
+    sync_dirs_parser.add_argument('local', help='first directory')
+    sync_dirs_parser.add_argument('other', help='second directory')
+    sync_dirs_parser.add_argument('--watch', help='keep syncing every --interval seconds', action='store_true')
+    sync_dirs_parser.add_argument('--interval', help='seconds between syncs with --watch (default sync_interval from the config)', type=float, default=config["sync_interval"])
+    sync_dirs_parser.add_argument('--restore', help='fill a directory that lost every file from the other one instead of holding the deletions as a conflict', action='store_true')
 
     # Create parser for "build" command
     build_parser = subparsers.add_parser('build', help='build a default image')
-    build_parser.add_argument('image', help='default image choose from {' + ', '.join(DEFAULT_IMAGES.keys()) + '}')
+    build_parser.add_argument('image', nargs='*', help='default image(s) choose from {' + ', '.join(DEFAULT_IMAGES.keys()) + '}')
+    build_parser.add_argument('--all', '-a', help='build all default images', action='store_true')
+    build_parser.add_argument('--jobs', '-j', help='number of stages to build in parallel when building several images', type=int, default=min(4, os.cpu_count() or 1))
     build_parser.add_argument('--no_build', help='do not build the image but only generate the Dockerfile', action='store_true')
+    build_parser.add_argument('--force', '-f', help='rebuild even if the local image matches the templates', action='store_true')
+    build_parser.add_argument('--no_optimize', help='keep the rendered Dockerfile as is (no layer merging or apt cleanup)', action='store_true')
+    build_parser.add_argument('--profile', help='time every build step and compare it with the previous builds', action='store_true')
+    build_parser.add_argument('--fast_env', help='bake the ROS environment into a snapshot that shells load in one step instead of sourcing setup.bash', action='store_true')
+    build_parser.add_argument('--profile_file', help='JSON file with the build profile history (default build_profiles.json next to the config)', default=None)
 
     # Create parser for "ibuilder" command
     ibuilder_parser = subparsers.add_parser('ibuilder', help='Build docker image using a interactive interface to select the templates')
     ibuilder_parser.add_argument('name', help='name of the image')
     ibuilder_parser.add_argument('--no_build', help='do not build the image but only generate the Dockerfile', action='store_true')
+    ibuilder_parser.add_argument('--fast_env', help='use the fast environment snapshot variant of the rosbox entrypoint', action='store_true')
+    ibuilder_parser.add_argument('--no_optimize', help='keep the rendered Dockerfile as is (no layer merging or apt cleanup)', action='store_true')
+
+    # Create parser for "export" command
+    export_parser = subparsers.add_parser('export', help='save an image to a compressed file for offline transfer')
+    export_parser.add_argument('image', help='default image choose from {' + ', '.join(DEFAULT_IMAGES.keys()) + '} or a full image name')
+    export_parser.add_argument('--output', '-o', help='output file (default derived from the image name)', default=None)
+    export_parser.add_argument('--compression', help='zstd needs the zstandard package (default zstd if installed, else gzip)', choices=['zstd', 'gzip', 'none'], default=None)
+    export_parser.add_argument('--level', help='compression level', type=int, default=None)
+    export_parser.add_argument('--threads', help='compression threads (default all cores)', type=int, default=None)
+
+    # Create parser for "import" command
+    import_parser = subparsers.add_parser('import', help='load an image file written by `rosbox export`')
+    import_parser.add_argument('file', help='file written by rosbox export (or any docker save tar, optionally compressed)')
+    import_parser.add_argument('--no_verify', help='do not check the file against its checksum manifest', action='store_true')
+
+    # Create parser for "push-to" command
+    push_parser = subparsers.add_parser('push-to', help='send an image to the docker daemon of a robot, only the layers it is missing')
+    push_parser.add_argument('host', help='docker host of the robot: ssh://user@robot, tcp://robot:2375, unix:///path/docker.sock or a bare ssh hostname')
+    push_parser.add_argument('image', help='default image choose from {' + ', '.join(DEFAULT_IMAGES.keys()) + '} or a full image name')
+    push_parser.add_argument('--tag', '-t', help='extra tag for the image on the robot', default=None)
+
+    # Create parser for "image" command
+    image_parser = subparsers.add_parser('image', help='inspect rosbox images')
+    image_subparsers = image_parser.add_subparsers(dest='image_command')
+    analyze_parser = image_subparsers.add_parser('analyze', help='map the layers to their templates and report wasted bytes')
+    analyze_parser.add_argument('image', help='default image choose from {' + ', '.join(DEFAULT_IMAGES.keys()) + '} or a full image name')
+    analyze_parser.add_argument('--json', help='print the report as JSON', action='store_true')
+    analyze_parser.add_argument('--top', help='number of layers and waste entries in the tables', type=int, default=15)
+    analyze_parser.add_argument('--no_scan', help='only use the image history (fast, no waste detection)', action='store_true')
 
-    args = parser.parse_args()
+    # Create parser for "cache" command
+    cache_parser = subparsers.add_parser('cache', help='manage the shared build cache volumes')
+    cache_subparsers = cache_parser.add_subparsers(dest='cache_command')
+    cache_subparsers.add_parser('stats', help='show the size and users of the cache volumes')
+    cache_prune_parser = cache_subparsers.add_parser('prune', help='shrink or remove cache volumes')
+    cache_prune_parser.add_argument('--max_size', '--max-size', help='shrink every ccache volume to this size (e.g. 2G)', default=None)
+    cache_prune_parser.add_argument('--unused', help='remove the cache volumes no rosbox uses', action='store_true')
+
+    # Create parser for "pool" command
+    pool_parser = subparsers.add_parser('pool', help='keep started rosboxes ready so create only has to rename one')
+    pool_subparsers = pool_parser.add_subparsers(dest='pool_command')
+    pool_fill_parser = pool_subparsers.add_parser('fill', help='create rosboxes until the pool of an image has --size of them')
+    pool_fill_parser.add_argument('image', help=create_image_help())
+    pool_fill_parser.add_argument('--size', '-n', help='number of idle rosboxes to keep (default pool_size from the config)', type=int, default=config["pool_size"])
+    pool_fill_parser.add_argument('--custom', '-c', help='Use a custom Docker image (provide full image name)', action='store_true')
+    pool_fill_parser.add_argument('--build', '-b', help='Use locally built default image instead of prebuilt one', action='store_true')
+    pool_fill_parser.add_argument('--ros_ws', '-w', help='path to the ROS workspace the pooled rosboxes mount', default=None)
+    pool_fill_parser.add_argument('--ssh_keys', '-s', help='mount the ssh dir from host to container', action='store_true')
+    pool_fill_parser.add_argument('--no_host_net', help='do not use the host network', action='store_true')
+    pool_fill_parser.add_argument('--offline', help='never contact the registry, use the local image as is', action='store_true')
+    pool_fill_parser.add_argument('--cache', help='mount shared build cache volumes, comma separated from {' + ', '.join(CACHE_KINDS) + '} (default from the config)',
+                                  nargs='?', const=','.join(config["cache_kinds"]), default=None)
+    pool_fill_parser.add_argument('--shm', help='share the host IPC namespace and use the FastDDS shared memory transport (default from the config)', action='store_true')
+    pool_fill_parser.add_argument('--resources', '-r', help=resources_help(config) + ' (default of the image), none for no limits', default=None)
+    pool_fill_parser.add_argument('--jobs', '-j', help='number of rosboxes created in parallel', type=int, default=config["bulk_jobs"])
+    pool_subparsers.add_parser('status', help='show the idle rosboxes, the hit rate and the time until a shell is ready')
+    pool_drain_parser = pool_subparsers.add_parser('drain', help='remove the idle rosboxes of the pool')
+    pool_drain_parser.add_argument('image', nargs='?', help='only the pool of this image (full image name, default all pools)', default=None)
+
+    # shell completion answers from the local container index, before anything talks to the daemon
+    try:
+        import argcomplete
+        argcomplete.autocomplete(parser)
+    except ImportError:
+        pass
+
+    # everything after `--` is the command of `rosbox exec`, argparse would mix it with the names
+    argv = sys.argv[1:]
+    command = []
+    if '--' in argv:
+        command = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+    if command and args.command != 'exec':
+        parser.error('arguments after -- are only used by exec')
+
+    if args.trace or args.trace_file:
+        from .tracing import enable
+        enable(args.trace_file or default_trace_file, f"rosbox {args.command}")
+
+    # docker is only contacted once a command needs the client
+    manager = ContainerManager(config)
+
+    if args.command and not manager.backend.supports(args.command):
+        print(f"command not supported for {manager.backend.name}")
+        exit(1)
+
+    if args.command in ('start', 'stop', 'remove', 'update', 'exec'):
+        if not args.name and not args.all:
+            parser.error(f'{args.command}: give at least one name or use --all')
+
+    if args.command == 'exec' and not command:
+        exec_parser.error('give the command after --, e.g. rosbox exec <name> -- ls')
+
+    if args.command == 'update':
+        # no default of the image here, the profile is always named
+        args.profile = resolve_profile(config, args.resources, custom=True)
+
+    # fleet mode: the same command on several docker hosts in parallel
+    if getattr(args, 'hosts', None) or getattr(args, 'fleet', False):
+        if manager.backend.name != 'docker':
+            print(f"Error: fleet mode is not supported for {manager.backend.name}")
+            exit(1)
+        if args.command == 'exec' and args.interactive:
+            exec_parser.error('--interactive needs exactly one rosbox on the local daemon')
+        exit(0 if run_on_fleet(config, args, command) else 1)
+
+    if args.command in ('start', 'stop', 'remove', 'update', 'exec'):
+        names, unmatched = manager.resolve_container_names(args.name, args.all)
+        for pattern in unmatched:
+            print(f"Error: no rosbox matches '{pattern}'")
+        if not names and not unmatched:
+            print("No rosboxes found")
 
     if args.command == 'create':
-        if manager.config["container_manager"] == "docker":
-            if args.custom:
-                image = args.image
-            elif args.build:
-                image = manager.select_default_image(args.image, False)
-            else:
-                image = manager.select_default_image(args.image, True)
-            manager.create_container_docker(image, args.name, args.ros_ws, not args.no_start, args.ssh_keys, not args.no_host_net)
-        elif manager.config["container_manager"] == "distrobox":
-            if check_os() != "linux":
-                print("Distrobox is only supported on Linux")
-                exit(1)
-            if args.custom:
-                image = args.image
-            else:
-                image = manager.get_image_name_distrobox(args.image)
-            print(f"Selected image: {image}")
-            manager.create_container_distrobox(image, args.name, args.ros_home, args.gpu)
-    elif args.command == 'start':
-        if manager.config["container_manager"] == "distrobox":
-            print("command not supported for distrobox")
+        manager.backend.create(args)
+    elif args.command in ('start', 'stop', 'remove', 'update'):
+        if not run_bulk_command(manager, args, names) or unmatched:
             exit(1)
-        manager.start_container(args.name)
     elif args.command == 'enter':
-        if manager.config["container_manager"] == "docker":
-            manager.enter_container_docker(args.name)
-        elif manager.config["container_manager"] == "distrobox":
-            manager.enter_container_distrobox(args.name)
-    elif args.command == 'stop':
-        if manager.config["container_manager"] == "distrobox":
-            print("command not supported for distrobox")
+        manager.backend.enter(args.name, args.timing)
+    elif args.command == 'exec':
+        if len(names) == 1 and not args.all:
+            try:
+                exit(manager.backend.exec(names[0], command, args.interactive))
+            except Exception as e:
+                print(f"Error running the command: {str(e)}")
+                exit(1)
+        if args.interactive:
+            exec_parser.error('--interactive needs exactly one rosbox')
+        if not run_bulk_command(manager, args, names, command) or unmatched:
             exit(1)
-        manager.stop_container(args.name)
     elif args.command == 'list':
-        if manager.config["container_manager"] == "docker":
-            manager.list_containers_docker()
-        elif manager.config["container_manager"] == "distrobox":
-            manager.list_containers_distrobox()
-    elif args.command == 'remove':
-        if manager.config["container_manager"] == "docker":
-            manager.remove_container_docker(args.name)
-        elif manager.config["container_manager"] == "distrobox":
-            manager.remove_container_distrobox(args.name)
+        manager.backend.print_list()
+    elif args.command in ('up', 'down'):
+        from .rosboxManifest import ManifestReconciler
+        reconciler = ManifestReconciler(manager, args.file)
+        if args.command == 'up':
+            success = reconciler.up(args.name, max(1, args.jobs), args.recreate, args.dry_run)
+        else:
+            success = reconciler.down(args.name, max(1, args.jobs), args.remove, args.timeout)
+        if not success:
+            exit(1)
+    elif args.command == 'sync':
+        from .workspaceSync import WorkspaceSync, LocalDirEndpoint, print_plan, print_status, status_row, sync_state_file
+        try:
+            if args.sync_command in ('run', 'dirs'):
+                if args.sync_command == 'run':
+                    sync = manager.workspace_sync(args.name, args.ros_ws, args.restore)
+                else:
+                    ignore = manager.config["sync_ignore"]
+                    key = hashlib.sha256(f"{os.path.abspath(args.local)}\0{os.path.abspath(args.other)}".encode()).hexdigest()[:12]
+                    sync = WorkspaceSync(LocalDirEndpoint(args.local, ignore), LocalDirEndpoint(args.other, ignore), sync_state_file(f"dirs-{key}"), args.restore)
+                if args.watch:
+                    sync.watch(max(args.interval, 0.2))
+                else:
+                    print_plan(sync.run())
+            elif args.sync_command == 'status':
+                containers = manager.index.sync(manager.client)
+                names = args.name or sorted(name for name, entry in containers.items() if (entry.get('options') or {}).get('ws_volume'))
+                rows = []
+                for name in names:
+                    running = containers.get(name, {}).get('status') == 'running'
+                    if running:
+                        rows.append(status_row(name, manager.workspace_sync(name)))
+                    else:
+                        print(f"{name} is not running, the changes waiting in it are unknown")
+                if rows:
+                    print_status(rows)
+                elif not names:
+                    print("No rosboxes with a workspace volume")
+            else:
+                sync_parser.print_help()
+        except Exception as e:
+            print(f"Error syncing the workspace: {str(e)}")
+            exit(1)
+    elif args.command == 'stats':
+        from .containerStats import ContainerStats, print_table
+        stats = ContainerStats(manager.client, manager.rosbox_suffix)
+        if args.once:
+            rows = stats.sample()
+            if args.json:
+                print(json.dumps(rows, indent=4))
+            elif rows:
+                print_table(rows)
+            else:
+                print("No running rosboxes")
+        else:
+            stats.watch(max(args.interval, 0.5), args.json)
     elif args.command == 'build':
-        if manager.config["container_manager"] == "distrobox":
-            print("for distrobox will not build the image just save a dockerfile")
-            manager.build_image(args.image, True)
+        images = list(DEFAULT_IMAGES.keys()) if args.all else list(dict.fromkeys(args.image))
+        if not images:
+            build_parser.error('choose at least one image or use --all')
+        if len(images) > 1 and (args.no_build or not manager.backend.builds_images):
+            print("Error: generating only a Dockerfile is supported for a single image")
+            exit(1)
+        if not manager.backend.builds_images:
+            print(f"for {manager.backend.name} will not build the image just save a dockerfile")
+            manager.build_image(images[0], True, not args.no_optimize, fast_env=args.fast_env)
+        elif len(images) > 1:
+            manager.build_images(images, max(1, args.jobs), not args.no_optimize, args.force, args.profile, args.profile_file, args.fast_env)
         else:
-            manager.build_image(args.image, args.no_build)
+            manager.build_image(images[0], args.no_build, not args.no_optimize, args.force, args.profile, args.profile_file, args.fast_env)
     elif args.command == 'ibuilder':
-        if manager.config["container_manager"] == "distrobox":
-            print("for distrobox will not build the image just save a dockerfile")
-            manager.build_image_it(args.name, True)
+        if not manager.backend.builds_images:
+            print(f"for {manager.backend.name} will not build the image just save a dockerfile")
+            manager.build_image_it(args.name, True, not args.no_optimize, args.fast_env)
+        else:
+            manager.build_image_it(args.name, args.no_build, not args.no_optimize, args.fast_env)
+    elif args.command in ('export', 'import'):
+        if args.command == 'export':
+            manager.export_image(args.image, args.output, args.compression, args.level, args.threads)
+        else:
+            manager.import_image(args.file, not args.no_verify)
+    elif args.command == 'push-to':
+        manager.push_image(args.host, args.image, args.tag)
+    elif args.command == 'image':
+        if args.image_command == 'analyze':
+            manager.analyze_image(args.image, args.json, args.top, not args.no_scan)
+        else:
+            image_parser.print_help()
+    elif args.command == 'pool':
+        if args.pool_command == 'fill':
+            if args.size < 1:
+                pool_fill_parser.error('--size must be at least 1')
+            image = manager.backend.resolve_image(args)
+            options = {'ros_ws': os.path.abspath(args.ros_ws) if args.ros_ws else None, 'ssh_keys': args.ssh_keys, 'host_net': not args.no_host_net,
+                       'caches': parse_cache_kinds(args.cache) if args.cache else [], 'shm': args.shm or manager.config["shm"]}
+            resources = resolve_profile(manager.config, args.resources, args.image, args.custom)
+            if resources:
+                options['resources'] = resources
+            if not manager.container_pool.fill(image, options, args.size, args.jobs):
+                exit(1)
+        elif args.pool_command == 'status':
+            manager.container_pool.print_status()
+        elif args.pool_command == 'drain':
+            if not manager.container_pool.drain(args.image, manager.config["bulk_jobs"]):
+                exit(1)
+        else:
+            pool_parser.print_help()
+    elif args.command == 'cache':
+        if args.cache_command == 'stats':
+            manager.workspace_cache.print_stats()
+        elif args.cache_command == 'prune':
+            if args.max_size is None and not args.unused:
+                cache_prune_parser.error('use --max_size and/or --unused')
+            try:
+                parse_size(args.max_size) if args.max_size is not None else None
+            except ValueError as e:
+                cache_prune_parser.error(str(e))
+            if not manager.workspace_cache.prune(args.max_size, args.unused):
+                exit(1)
         else:
-            manager.build_image_it(args.name, args.no_build)
+            cache_parser.print_help()
     else:
         parser.print_help()
 
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+
+from .containerIndex import rosbox_label_filter
+from .defaults import DEFAULT_IMAGES, DEFAULT_DOCKERHUB_IMAGES
+from .resourceProfiles import resolve_profile
+from .workspaceCache import parse_cache_kinds
+
+# Declarative rosboxes: a manifest file names the rosboxes of a setup with their create options,
+# `rosbox up` brings the daemon to that state and `rosbox down` stops it again.
+# Every rosbox created by `up` carries a hash of its options and its image in a label, so comparing the
+# manifest with the daemon is one list call: unchanged rosboxes are left alone, only missing, stopped or
+# changed ones are created, started or recreated, and those run in parallel. A rosbox of the same name
+# that `up` didn't create is never touched without --recreate.
+
+config_hash_label = 'rosbox.config_hash'
+manifest_label = 'rosbox.manifest'
+
+# manifest key -> default, the same options as `rosbox create`
+box_defaults = {
+    "image": None,
+    "custom": False,
+    "build": False,
+    "ros_ws": None,
+    "ssh_keys": False,
+    "host_net": True,
+    "cache": [],
+    "shm": False,
+    "ws_volume": False,
+    "resources": None,
+    "start": True,
+}
+
+# the config keys that change the containers `create` makes
+config_keys = ("use_x11", "mount_dev_dir", "shm_size")
+
+def load_manifest(path, config):
+    """Read a manifest and return {name: options} with the defaults filled in."""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except IOError:
+        print(f"Error: no manifest at {path}, write one or pass it with --file")
+        exit(1)
+    except json.JSONDecodeError as e:
+        print(f"Error: {path} is not valid JSON: {e}")
+        exit(1)
+    boxes = data.get("boxes") if isinstance(data, dict) else None
+    if not isinstance(boxes, dict) or not boxes:
+        print(f"Error: {path} has no rosboxes, list them under \"boxes\"")
+        exit(1)
+    # relative workspace paths are relative to the manifest, not to where rosbox runs
+    base_dir = os.path.dirname(os.path.abspath(path))
+    manifest = {}
+    for name, entry in boxes.items():
+        unknown = [key for key in entry if key not in box_defaults]
+        if unknown:
+            print(f"Error: rosbox '{name}' in {path} has unknown option(s) {', '.join(unknown)}, choose from {', '.join(box_defaults)}")
+            exit(1)
+        box = dict(box_defaults, **entry)
+        if not box["image"]:
+            print(f"Error: rosbox '{name}' in {path} has no image")
+            exit(1)
+        if box["ros_ws"]:
+            box["ros_ws"] = os.path.normpath(os.path.join(base_dir, os.path.expanduser(box["ros_ws"])))
+        # "cache": true uses the cache kinds of the config
+        cache = config["cache_kinds"] if box["cache"] is True else (box["cache"] or [])
+        box["cache"] = parse_cache_kinds(cache)
+        box["shm"] = box["shm"] or config["shm"]
+        # an unknown profile is reported before anything is created
+        resolve_profile(config, box["resources"], box["image"], box["custom"])
+        manifest[name] = box
+    return manifest
+
+def image_tag(box):
+    """The local tag the image of a rosbox is created from, the one select_default_image returns."""
+    if box["custom"] or box["image"] not in DEFAULT_IMAGES:
+        return box["image"]
+    return DEFAULT_IMAGES[box["image"]]["image-name"] if box["build"] else DEFAULT_DOCKERHUB_IMAGES[box["image"]]
+
+def config_hash(box, config, image_id):
+    # `start` is not part of the container, a stopped rosbox is started instead of recreated
+    options = {key: value for key, value in box.items() if key != 'start'}
+    # the limits of the profile and the image the tag points to, so editing a profile or pulling recreates
+    options["resources"] = resolve_profile(config, box["resources"], box["image"], box["custom"])
+    options["image_id"] = image_id
+    options["config"] = {key: config[key] for key in config_keys}
+    return hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()[:16]
+
+class ManifestReconciler:
+    def __init__(self, manager, path):
+        self.manager = manager
+        self.path = os.path.abspath(path)
+        self.manifest = load_manifest(path, manager.config)
+
+    def select(self, names):
+        if not names:
+            return dict(self.manifest)
+        unknown = [name for name in names if name not in self.manifest]
+        if unknown:
+            print(f"Error: {', '.join(unknown)} not in {self.path}")
+            exit(1)
+        return {name: self.manifest[name] for name in names}
+
+    def observe(self):
+        """Return {name: (state, config hash, created by up)} of the rosboxes on the daemon, one list call."""
+        suffix = '_' + self.manager.rosbox_suffix
+        containers = {}
+        for summary in self.manager.client.api.containers(all=True, filters=rosbox_label_filter):
+            name = summary['Names'][0].lstrip('/')
+            if name.endswith(suffix):
+                labels = summary.get('Labels') or {}
+                containers[name[:-len(suffix)]] = (summary['State'], labels.get(config_hash_label), manifest_label in labels)
+        return containers
+
+    def image_id(self, tag):
+        import docker
+        # a missing image is pulled or reported by create
+        try:
+            return self.manager.client.images.get(tag).id
+        except docker.errors.ImageNotFound:
+            return None
+
+    def plan(self, boxes, recreate=False):
+        """Return {name: action} with action one of create, recreate, start, conflict or None (up to date)."""
+        observed = self.observe()
+        image_ids = {}
+        actions = {}
+        for name, box in boxes.items():
+            if name not in observed:
+                actions[name] = 'create'
+                continue
+            state, current_hash, managed = observed[name]
+            if recreate:
+                actions[name] = 'recreate'
+                continue
+            if not managed:
+                # made with `rosbox create`, it may hold work that `up` knows nothing about
+                actions[name] = 'conflict'
+                continue
+            tag = image_tag(box)
+            if tag not in image_ids:
+                image_ids[tag] = self.image_id(tag)
+            if current_hash != config_hash(box, self.manager.config, image_ids[tag]):
+                actions[name] = 'recreate'
+            elif box["start"] and state != 'running':
+                actions[name] = 'start'
+            else:
+                actions[name] = None
+        return actions
+
+    def resolve_images(self, boxes):
+        # one pull or update check per image before the parallel part, rosboxes of the same image share it
+        images = {}
+        for box in boxes.values():
+            key = (box["image"], box["custom"], box["build"])
+            if key not in images:
+                if box["custom"]:
+                    images[key] = box["image"]
+                else:
+                    images[key] = self.manager.select_default_image(box["image"], not box["build"])
+        return {name: images[(box["image"], box["custom"], box["build"])] for name, box in boxes.items()}
+
+    def apply(self, name, action, box, image):
+        manager = self.manager
+        if action == 'start':
+            return manager.start_container(name)
+        if action == 'recreate':
+            print(f"Container {name} changed in the manifest or its image, recreating it")
+            container = manager.client.containers.get(f"{name}_{manager.rosbox_suffix}")
+            if container.status == 'running':
+                manager.stop_container(name)
+            if manager.remove_container_docker(name) is False:
+                return False
+        resources = resolve_profile(manager.config, box["resources"], box["image"], box["custom"])
+        # the id of the image after a pull or update, the one the container is created from
+        labels = {config_hash_label: config_hash(box, manager.config, self.image_id(image)), manifest_label: self.path}
+        # a pooled container can't get the labels after it was created
+        manager.create_container_docker(image, name, box["ros_ws"], box["start"], box["ssh_keys"], box["host_net"],
+                                        caches=box["cache"], shm=box["shm"], use_pool=False, labels=labels, ws_volume=box["ws_volume"], resources=resources)
+
+    def up(self, names=None, jobs=8, recreate=False, dry_run=False):
+        boxes = self.select(names)
+        actions = self.plan(boxes, recreate)
+        pending = {name: action for name, action in actions.items() if action not in (None, 'conflict')}
+        conflicts = sorted(name for name, action in actions.items() if action == 'conflict')
+        for name, action in sorted(actions.items()):
+            if action == 'conflict':
+                print(f"{name:<20} conflict: a rosbox of this name exists that `rosbox up` did not create, remove it or use --recreate")
+            else:
+                print(f"{name:<20} {action or 'up to date'}")
+        if dry_run or not pending:
+            return not conflicts
+        images = self.resolve_images({name: boxes[name] for name, action in pending.items() if action != 'start'})
+        success = self.manager.run_bulk(lambda name: self.apply(name, pending[name], boxes[name], images.get(name)),
+                                        sorted(pending), jobs, 'up')
+        return success and not conflicts
+
+    def down(self, names=None, jobs=8, remove=False, timeout=None):
+        boxes = self.select(names)
+        observed = self.observe()
+        # rosboxes of the same name made with `rosbox create` are not the ones of the manifest
+        for name in sorted(name for name in boxes if name in observed and not observed[name][2]):
+            print(f"Skipping {name}, it was not created by `rosbox up`")
+        present = sorted(name for name in boxes if name in observed and observed[name][2])
+        if not present:
+            print("No rosboxes of the manifest found")
+            return True
+        def run(name):
+            if observed[name][0] == 'running':
+                self.manager.stop_container(name, timeout)
+            if remove:
+                return self.manager.remove_container_docker(name)
+        return self.manager.run_bulk(run, present, jobs, 'removed' if remove else 'stopped')
@@ -0,0 +1,63 @@
+import os
+
+from .config import get_state_file
+from .workspaceCache import parse_size
+
+# Shared memory transport for rosboxes on the same host.
+# With the host IPC namespace every rosbox (and the host) sees the same /dev/shm and SysV segments,
+# so FastDDS can hand large messages over shared memory instead of UDP loopback and X11 clients can use MIT-SHM.
+
+shm_profile_file = 'fastdds_shm.xml'
+shm_profile_target = '/etc/rosbox/fastdds_shm.xml'
+
+FASTDDS_SHM_PROFILE = """<?xml version="1.0" encoding="UTF-8" ?>
+<!-- generated by rosbox, shared memory transport for rosboxes created with --shm -->
+<profiles xmlns="http://www.eprosima.com/XMLSchemas/fastRTPS_Profiles">
+    <transport_descriptors>
+        <transport_descriptor>
+            <transport_id>rosbox_shm</transport_id>
+            <type>SHM</type>
+            <segment_size>{segment_size}</segment_size>
+        </transport_descriptor>
+        <transport_descriptor>
+            <transport_id>rosbox_udp</transport_id>
+            <type>UDPv4</type>
+        </transport_descriptor>
+    </transport_descriptors>
+    <participant profile_name="rosbox_shm_participant" is_default_profile="true">
+        <rtps>
+            <userTransports>
+                <transport_id>rosbox_shm</transport_id>
+                <transport_id>rosbox_udp</transport_id>
+            </userTransports>
+            <useBuiltinTransports>false</useBuiltinTransports>
+        </rtps>
+    </participant>
+</profiles>
+"""
+
+def write_shm_profile(shm_size):
+    """Write the FastDDS profile for the given segment size and return its path on the host."""
+    path = get_state_file(shm_profile_file)
+    profile = FASTDDS_SHM_PROFILE.format(segment_size=parse_size(shm_size))
+    try:
+        with open(path, 'r') as f:
+            if f.read() == profile:
+                return path
+    except IOError:
+        pass
+    with open(path, 'w') as f:
+        f.write(profile)
+    return path
+
+def shm_container_options(shm_size):
+    """Return the extra create arguments, mounts and environment of the shared memory profile."""
+    from docker.types import Mount
+    profile_path = write_shm_profile(shm_size)
+    options = {"ipc_mode": "host"}
+    mounts = [Mount(target=shm_profile_target, source=os.path.abspath(profile_path), type="bind", read_only=True)]
+    environment = [
+        f"FASTRTPS_DEFAULT_PROFILES_FILE={shm_profile_target}",
+        f"FASTDDS_DEFAULT_PROFILES_FILE={shm_profile_target}",
+    ]
+    return options, mounts, environment
@@ -0,0 +1,227 @@
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+# Timed spans for `rosbox --trace`.
+# The spans of rosbox itself, every request to the docker daemon and every subprocess are written as Chrome
+# trace events (open the file in chrome://tracing or https://ui.perfetto.dev) and the slowest ones are summed
+# up on stderr. Without --trace span() returns a shared object that does nothing and nothing is patched.
+
+default_trace_file = 'rosbox_trace.json'
+summary_rows = 10
+
+tracer = None
+
+class NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+no_span = NoSpan()
+
+class Span:
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None and exc_type is not SystemExit:
+            self.args['error'] = exc_type.__name__
+        tracer.add(self.name, self.category, self.start, time.perf_counter(), self.args)
+        return False
+
+def span(name, category='rosbox', **args):
+    """Time a block: `with span('image.pull', image=name): ...`"""
+    if tracer is None:
+        return no_span
+    return Span(name, category, args)
+
+def traced(name, category='rosbox'):
+    """Decorator that times every call of a function."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if tracer is None:
+                return function(*args, **kwargs)
+            with Span(name, category, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class Tracer:
+    def __init__(self, path, name='rosbox'):
+        self.path = path
+        self.name = name
+        self.origin = time.perf_counter()
+        self.events = []
+        self.threads = {}
+        # reentrant: a garbage collection inside add can collect a Popen, whose __del__ records its span here again
+        self.lock = threading.RLock()
+
+    def add(self, name, category, start, end, args=None):
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self.origin) * 1e6, 1),
+            'dur': round((end - start) * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': thread.ident,
+        }
+        if args:
+            event['args'] = {key: str(value) for key, value in args.items()}
+        with self.lock:
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+
+    def write(self):
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                    for tid, name in self.threads.items()]
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}, f)
+        except IOError as e:
+            print(f"Warning: could not write the trace: {e}", file=sys.stderr)
+
+    def print_summary(self):
+        total = (time.perf_counter() - self.origin) * 1000
+        out = sys.stderr
+        print(f"\nTrace: {len(self.events)} spans in {total:.0f}ms, written to {self.path}", file=out)
+        totals = {}
+        for event in self.events:
+            if event['cat'] != 'rosbox':
+                count, duration = totals.get(event['cat'], (0, 0))
+                totals[event['cat']] = (count + 1, duration + event['dur'] / 1000)
+        for category, (count, duration) in sorted(totals.items()):
+            print(f"  {category}: {count} calls, {duration:.0f}ms", file=out)
+        print(f"  {'SPAN':<48} {'MS':>9}", file=out)
+        for event in sorted(self.events, key=lambda e: -e['dur'])[:summary_rows]:
+            print(f"  {event['name'][:48]:<48} {event['dur'] / 1000:>9.1f}", file=out)
+
+    def finish(self):
+        record_open_processes()
+        # the whole command, from --trace being parsed until rosbox exits
+        self.add(self.name, 'rosbox', self.origin, time.perf_counter())
+        self.write()
+        self.print_summary()
+
+# the daemon API path without the version prefix and with short ids, e.g. POST /containers/3f2a1b0c9d8e/start
+def api_span_name(method, url):
+    path = re.sub(r'^[a-z+]+://[^/]*', '', url).split('?')[0]
+    path = re.sub(r'^/v\d+\.\d+', '', path)
+    path = re.sub(r'[0-9a-f]{64}', lambda match: match.group(0)[:12], path)
+    return f"{method} {path}"
+
+def patch_docker():
+    # every docker-py call goes through Session.request of the APIClient
+    with span('import docker'):
+        import docker.api.client
+    api_client = docker.api.client.APIClient
+    request = api_client.request
+
+    @functools.wraps(request)
+    def traced_request(self, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        status = None
+        try:
+            response = request(self, method, url, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            # a streamed response (pull, build, logs) is timed until its headers arrive
+            tracer.add(api_span_name(method, url), 'docker-api', start, time.perf_counter(), {'status': status, 'stream': kwargs.get('stream', False)})
+    api_client.request = traced_request
+
+# the subprocesses started while tracing, so the ones nobody waited for are recorded when rosbox exits
+traced_processes = None
+
+def record_process(process, end=None):
+    start = getattr(process, '_rosbox_trace_start', None)
+    if start is None:
+        return
+    process._rosbox_trace_start = None
+    command = process._rosbox_trace_args
+    command = command if isinstance(command, str) else ' '.join(str(arg) for arg in command)
+    args = {'command': command, 'returncode': process.returncode}
+    # without a wait the exit is only noticed later, the span ends when it was noticed
+    if end is not None:
+        args['end'] = end
+    tracer.add(f"subprocess {command[:60]}", 'subprocess', start, time.perf_counter(), args)
+
+def patch_subprocess():
+    # Popen is under run, check_output and the direct Popen users. A process is timed until it is waited for,
+    # until a poll sees it exit, until its Popen object is collected or, if it is still open, until rosbox exits.
+    global traced_processes
+    import subprocess
+    import weakref
+    traced_processes = weakref.WeakSet()
+    popen_init = subprocess.Popen.__init__
+    popen_wait = subprocess.Popen.wait
+    popen_poll = subprocess.Popen.poll
+    popen_del = subprocess.Popen.__del__
+
+    @functools.wraps(popen_init)
+    def traced_init(self, args, *rest, **kwargs):
+        self._rosbox_trace_start = time.perf_counter()
+        self._rosbox_trace_args = args
+        try:
+            popen_init(self, args, *rest, **kwargs)
+        except BaseException:
+            # a process that could not start has no span
+            self._rosbox_trace_start = None
+            raise
+        traced_processes.add(self)
+
+    @functools.wraps(popen_wait)
+    def traced_wait(self, *args, **kwargs):
+        code = popen_wait(self, *args, **kwargs)
+        record_process(self)
+        return code
+
+    @functools.wraps(popen_poll)
+    def traced_poll(self):
+        code = popen_poll(self)
+        if code is not None:
+            record_process(self, 'poll')
+        return code
+
+    @functools.wraps(popen_del)
+    def traced_del(self, *args, **kwargs):
+        popen_del(self, *args, **kwargs)
+        if getattr(self, '_rosbox_trace_start', None) is not None:
+            record_process(self, 'collected' if self.returncode is not None else 'running when collected')
+    subprocess.Popen.__init__ = traced_init
+    subprocess.Popen.wait = traced_wait
+    subprocess.Popen.poll = traced_poll
+    subprocess.Popen.__del__ = traced_del
+
+def record_open_processes():
+    for process in list(traced_processes or []):
+        if process.poll() is None:
+            record_process(process, 'running at exit')
+
+def enable(path=default_trace_file, name='rosbox'):
+    """Start recording, the trace is written and summed up when rosbox exits."""
+    global tracer
+    if tracer is not None:
+        return
+    import atexit
+    tracer = Tracer(path, name)
+    patch_subprocess()
+    try:
+        patch_docker()
+    except ImportError:
+        pass
+    atexit.register(tracer.finish)
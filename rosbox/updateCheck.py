@@ -0,0 +1,86 @@
+import json
+import time
+
+import docker
+
+from .config import get_state_file
+from .tracing import traced
+
+update_check_file = 'update_check.json'
+
+def split_repository(image_name):
+    """Split an image reference in its repository and tag, without the default docker.io registry."""
+    name = image_name.split('@')[0]
+    for prefix in ('docker.io/', 'index.docker.io/'):
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+    tag = 'latest'
+    if ':' in name.rsplit('/', 1)[-1]:
+        name, tag = name.rsplit(':', 1)
+    if name.startswith('library/'):
+        name = name[len('library/'):]
+    return name, tag
+
+# compares the digest of a local image with the registry manifest, with a TTL cache of the last answer
+class UpdateChecker:
+    def __init__(self, client, ttl=3600, offline=False, cache_file=None, fetch_remote_digest=None):
+        self.client = client
+        self.ttl = ttl
+        self.offline = offline
+        self.cache_file = cache_file if cache_file is not None else get_state_file(update_check_file)
+        # can be replaced to check against a local registry stand-in
+        self.fetch_remote_digest = fetch_remote_digest if fetch_remote_digest is not None else self.registry_digest
+
+    def load_cache(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                return json.load(f)
+        except (IOError, json.JSONDecodeError):
+            return {}
+
+    def save_cache(self, cache):
+        try:
+            with open(self.cache_file, 'w') as f:
+                json.dump(cache, f, indent=4)
+        except IOError as e:
+            print(f"Warning: could not save update check cache: {e}")
+
+    def registry_digest(self, image_name):
+        return self.client.images.get_registry_data(image_name).id
+
+    def local_digests(self, image_name):
+        repository, _ = split_repository(image_name)
+        try:
+            image = self.client.images.get(image_name)
+        except docker.errors.ImageNotFound:
+            return set()
+        digests = set()
+        for repo_digest in image.attrs.get('RepoDigests') or []:
+            repo, _, digest = repo_digest.partition('@')
+            if split_repository(repo)[0] == repository:
+                digests.add(digest)
+        return digests
+
+    @traced('image.update_check')
+    def needs_update(self, image_name):
+        """Return True when the registry has a different image than the local one."""
+        if self.offline:
+            return False
+        local = self.local_digests(image_name)
+        cache = self.load_cache()
+        entry = cache.get(image_name)
+        if entry and time.time() - entry['checked_at'] < self.ttl:
+            return entry['remote_digest'] not in local
+        remote = self.fetch_remote_digest(image_name)
+        cache[image_name] = {'checked_at': time.time(), 'remote_digest': remote}
+        self.save_cache(cache)
+        return remote not in local
+
+    def mark_pulled(self, image_name):
+        """Remember the digest of a freshly pulled image as the latest remote one."""
+        local = self.local_digests(image_name)
+        if len(local) != 1:
+            return
+        cache = self.load_cache()
+        cache[image_name] = {'checked_at': time.time(), 'remote_digest': local.pop()}
+        self.save_cache(cache)
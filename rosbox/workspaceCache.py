@@ -0,0 +1,171 @@
+import re
+
+# Named volumes that keep build caches across rosboxes.
+# A cache volume is shared by all rosboxes created from the same image, so a recreated rosbox
+# starts its first `colcon build` with a warm ccache instead of compiling the workspace from scratch.
+# The size limit of a ccache volume is kept in the ccache.conf inside it, not in the environment of the
+# rosboxes, so a `cache prune --max_size` stays in effect for the builds after it.
+
+cache_volume_label = {"type": "rosbox-cache"}
+cache_label_filter = {"label": "type=rosbox-cache"}
+
+# cache kind -> directory inside the rosbox and the environment that points the tools at it
+CACHE_KINDS = {
+    "ccache": {
+        "target": "/home/ubuntu/.cache/ccache",
+        "environment": [
+            "CCACHE_DIR=/home/ubuntu/.cache/ccache",
+            "CMAKE_C_COMPILER_LAUNCHER=ccache",
+            "CMAKE_CXX_COMPILER_LAUNCHER=ccache",
+        ],
+    },
+    "pip": {
+        "target": "/home/ubuntu/.cache/pip",
+        "environment": ["PIP_CACHE_DIR=/home/ubuntu/.cache/pip"],
+    },
+    "rosdep": {
+        "target": "/home/ubuntu/.ros/rosdep",
+        "environment": [],
+    },
+}
+
+def parse_cache_kinds(value):
+    """Parse a comma separated list of cache kinds."""
+    kinds = [kind.strip() for kind in value.split(',') if kind.strip()] if isinstance(value, str) else list(value)
+    unknown = [kind for kind in kinds if kind not in CACHE_KINDS]
+    if unknown:
+        print(f"Error: unknown cache kind(s) {', '.join(unknown)}, choose from {', '.join(CACHE_KINDS)}")
+        exit(1)
+    return list(dict.fromkeys(kinds))
+
+def cache_volume_name(kind, image_tag):
+    # volume names only allow [a-zA-Z0-9][a-zA-Z0-9_.-]
+    image = re.sub(r'[^a-zA-Z0-9_.-]', '-', image_tag.split('@')[0]).strip('-.')
+    return f"rosbox-{kind}-{image}"
+
+def container_cache_kinds(container):
+    """Return the cache kinds whose volumes are mounted in a container."""
+    targets = {mount.get('Destination') for mount in container.attrs.get('Mounts') or [] if mount.get('Type') == 'volume'}
+    return [kind for kind, cache in CACHE_KINDS.items() if cache["target"] in targets]
+
+def parse_size(size):
+    """Parse a size like 5G, 500M or 1024 (bytes) into bytes."""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([kKmMgGtT]?)i?[bB]?', str(size).strip())
+    if match is None:
+        raise ValueError(f"invalid size '{size}'")
+    factor = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}[match.group(2).lower()]
+    return int(float(match.group(1)) * factor)
+
+def format_size(size):
+    if size is None or size < 0:
+        return '-'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.1f}{unit}" if unit != 'B' else f"{size}B"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+class WorkspaceCache:
+    def __init__(self, client, max_size="5G"):
+        self.client = client
+        self.max_size = max_size
+
+    def ensure_volume(self, kind, image_tag):
+        import docker
+        name = cache_volume_name(kind, image_tag)
+        try:
+            return self.client.volumes.get(name)
+        except docker.errors.NotFound:
+            labels = dict(cache_volume_label, **{"rosbox.cache": kind, "rosbox.image": image_tag})
+            return self.client.volumes.create(name=name, labels=labels)
+
+    def mounts(self, image_tag, kinds):
+        """Return the mounts and the environment for the given cache kinds, creating missing volumes."""
+        from docker.types import Mount
+        mounts = []
+        environment = []
+        for kind in kinds:
+            volume = self.ensure_volume(kind, image_tag)
+            mounts.append(Mount(target=CACHE_KINDS[kind]["target"], source=volume.name, type="volume"))
+            environment.extend(CACHE_KINDS[kind]["environment"])
+        return mounts, environment
+
+    def prepare(self, container, kinds):
+        # docker only copies the directory owner into a new volume when the image has the directory,
+        # images built before the cache directories were added get root owned caches
+        targets = [CACHE_KINDS[kind]["target"] for kind in kinds]
+        command = "chown ubuntu:ubuntu " + " ".join(targets)
+        if "ccache" in kinds:
+            # a new ccache volume gets the limit of the config, an existing one keeps its own (see trim_ccache)
+            conf = f"{CACHE_KINDS['ccache']['target']}/ccache.conf"
+            command = f"[ -f {conf} ] || echo 'max_size = {self.max_size}' > {conf}; chown ubuntu:ubuntu {conf}; " + command
+        container.exec_run(["sh", "-c", command], user="root")
+
+    def volumes(self):
+        """Return the cache volumes with their size and the number of containers using them."""
+        # the disk usage call is the only API that reports volume sizes, and it does so in one round trip
+        usage = {volume['Name']: volume.get('UsageData') or {} for volume in self.client.api.df().get('Volumes') or []}
+        volumes = []
+        for volume in self.client.volumes.list(filters=cache_label_filter):
+            labels = volume.attrs.get('Labels') or {}
+            data = usage.get(volume.name, {})
+            volumes.append({
+                'name': volume.name,
+                'kind': labels.get('rosbox.cache', '-'),
+                'image': labels.get('rosbox.image', '-'),
+                'size': data.get('Size', -1),
+                'ref_count': data.get('RefCount', -1),
+                'volume': volume,
+            })
+        return sorted(volumes, key=lambda v: v['name'])
+
+    def print_stats(self):
+        volumes = self.volumes()
+        print(f"{'VOLUME':<40} | {'KIND':<8} | {'IMAGE':<30} | {'SIZE':>10} | IN USE")
+        print("-" * 104)
+        for volume in volumes:
+            in_use = str(volume['ref_count']) if volume['ref_count'] >= 0 else '-'
+            print(f"{volume['name']:<40} | {volume['kind']:<8} | {volume['image']:<30} | {format_size(volume['size']):>10} | {in_use}")
+        print("-" * 104)
+        total = sum(volume['size'] for volume in volumes if volume['size'] > 0)
+        print(f"{len(volumes)} cache volume(s), {format_size(total)} in total\n")
+
+    def trim_ccache(self, volume, max_size):
+        # ccache cleans itself down to the limit, run it in a throwaway container of the image the cache belongs to.
+        # --max-size also writes the limit to the ccache.conf of the volume, so the next builds don't grow it back.
+        from docker.types import Mount
+        output = self.client.containers.run(
+            volume['image'],
+            ["sh", "-c", f"ccache --max-size {max_size} --cleanup && chown 1000:1000 /cache/ccache.conf"],
+            entrypoint=[],
+            environment=["CCACHE_DIR=/cache"],
+            mounts=[Mount(target="/cache", source=volume['name'], type="volume")],
+            remove=True,
+        )
+        return output.decode('utf-8', errors='replace').strip() if isinstance(output, bytes) else output
+
+    def prune(self, max_size=None, remove_unused=False):
+        """Shrink the ccache volumes to max_size and/or remove cache volumes no rosbox uses anymore."""
+        ok = True
+        for volume in self.volumes():
+            if remove_unused and volume['ref_count'] == 0:
+                try:
+                    volume['volume'].remove()
+                    print(f"Removed unused cache volume {volume['name']} ({format_size(volume['size'])})")
+                except Exception as e:
+                    print(f"Error removing cache volume {volume['name']}: {str(e)}")
+                    ok = False
+                continue
+            if max_size is None or volume['kind'] != 'ccache':
+                continue
+            try:
+                # also run when the volume is below the size, so the limit is set for the next builds
+                self.trim_ccache(volume, max_size)
+                if volume['size'] >= 0 and volume['size'] <= parse_size(max_size):
+                    print(f"{volume['name']}: {format_size(volume['size'])}, already below {max_size}, limit set")
+                else:
+                    print(f"{volume['name']}: trimmed to at most {max_size}")
+            except Exception as e:
+                print(f"Error trimming cache volume {volume['name']}: {str(e)}")
+                ok = False
+        return ok
@@ -0,0 +1,356 @@
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+
+from .config import get_state_file
+from .tracing import span, traced
+
+# Workspace in a docker volume, mirrored to a host directory.
+# Bind mounts through the file sharing layer of Docker Desktop make colcon builds several times slower and
+# don't deliver inotify events, `create --ws_volume` keeps the workspace in a named volume instead. The sync
+# engine compares both sides by content hash against the state of the last sync, so it knows which side
+# changed a file. Changed files go over in batches of one tar archive, build/, install/ and log/ stay where
+# they were built. File hashes are cached by size and modification time, so only changed files are read.
+
+container_workspace = '/home/ubuntu/ros_ws'
+workspace_volume_prefix = 'rosbox-ws-'
+# the ubuntu user of the rosbox images owns the workspace
+workspace_uid = 1000
+batch_bytes = 64 * 1024 * 1024
+batch_files = 500
+chunk_size = 1024 * 1024
+
+def workspace_volume(name):
+    return f"{workspace_volume_prefix}{name}"
+
+def sync_state_file(name):
+    return get_state_file(f"sync.{name}.json")
+
+def is_ignored(path, patterns):
+    """gitignore style: a pattern with a slash is anchored at the workspace root, one without matches any name."""
+    parts = path.split('/')
+    for pattern in patterns:
+        anchored = '/' in pattern.rstrip('/')
+        pattern = pattern.strip('/')
+        if anchored:
+            if any(fnmatch.fnmatchcase('/'.join(parts[:i]), pattern) for i in range(1, len(parts) + 1)):
+                return True
+        elif any(fnmatch.fnmatchcase(part, pattern) for part in parts):
+            return True
+    return False
+
+def batches(paths, sizes):
+    batch, total = [], 0
+    for path in paths:
+        if batch and (len(batch) >= batch_files or total + sizes.get(path, 0) > batch_bytes):
+            yield batch
+            batch, total = [], 0
+        batch.append(path)
+        total += sizes.get(path, 0)
+    if batch:
+        yield batch
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# a directory on this machine
+class LocalDirEndpoint:
+    def __init__(self, root, ignore):
+        self.root = os.path.abspath(root)
+        # the temporary files of an interrupted sync are never synced
+        self.ignore = list(ignore) + ['*.rosbox-sync.tmp']
+        self.name = self.root
+
+    def scan(self, cache):
+        """Return {path: [size, mtime, hash]} of the regular files, hashing only the ones not in the cache."""
+        files = {}
+        for directory, dirnames, filenames in os.walk(self.root):
+            relative_dir = os.path.relpath(directory, self.root).replace(os.sep, '/')
+            prefix = '' if relative_dir == '.' else relative_dir + '/'
+            # ignored directories are not walked at all
+            dirnames[:] = [d for d in dirnames if not is_ignored(prefix + d, self.ignore)]
+            for filename in filenames:
+                path = prefix + filename
+                full_path = os.path.join(directory, filename)
+                if is_ignored(path, self.ignore) or os.path.islink(full_path) or not os.path.isfile(full_path):
+                    continue
+                stat = os.stat(full_path)
+                cached = cache.get(path)
+                if cached and cached[0] == stat.st_size and cached[1] == str(stat.st_mtime_ns):
+                    files[path] = cached
+                else:
+                    files[path] = [stat.st_size, str(stat.st_mtime_ns), file_hash(full_path)]
+        return files
+
+    def full_path(self, path):
+        return os.path.join(self.root, *path.split('/'))
+
+    def export(self, paths):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w') as tar:
+            for path in paths:
+                try:
+                    tar.add(self.full_path(path), arcname=path, recursive=False)
+                except FileNotFoundError:
+                    # deleted since the scan, the next sync sees it
+                    pass
+        return buffer.getvalue()
+
+    def import_archive(self, data, paths, cache):
+        expected = set(paths)
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r') as tar:
+            for member in tar:
+                # only the requested regular files, nothing outside the workspace
+                if not member.isfile() or member.name not in expected:
+                    continue
+                target = self.full_path(member.name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                tmp_path = f"{target}.rosbox-sync.tmp"
+                # hashed while it is written, the cache gets the hash of what actually arrived
+                digest = hashlib.sha256()
+                with tar.extractfile(member) as source, open(tmp_path, 'wb') as f:
+                    for chunk in iter(lambda: source.read(chunk_size), b''):
+                        digest.update(chunk)
+                        f.write(chunk)
+                os.chmod(tmp_path, member.mode & 0o777)
+                os.utime(tmp_path, (member.mtime, member.mtime))
+                os.replace(tmp_path, target)
+                stat = os.stat(target)
+                cache[member.name] = [stat.st_size, str(stat.st_mtime_ns), digest.hexdigest()]
+
+    def delete(self, paths):
+        for path in paths:
+            try:
+                os.remove(self.full_path(path))
+            except FileNotFoundError:
+                pass
+
+# the workspace volume of a rosbox, read and written with exec and the archive API
+class ContainerEndpoint:
+    def __init__(self, client, container, ignore, root=container_workspace):
+        self.client = client
+        self.container = container
+        self.ignore = ignore
+        self.root = root
+        # a recreated rosbox has a new volume, the state of the old one must not be used for it
+        self.name = f"{container.name}:{container.id[:12]}:{root}"
+
+    def run(self, command):
+        api = self.client.api
+        exec_id = api.exec_create(self.container.id, command, user='root', workdir=self.root)['Id']
+        out, err = api.exec_start(exec_id, demux=True)
+        code = api.exec_inspect(exec_id)['ExitCode']
+        if code != 0:
+            raise Exception(f"{command[0]} failed in {self.container.name}: {(err or b'').decode(errors='replace').strip()}")
+        return out or b''
+
+    def prune_expression(self):
+        # the ignore patterns as find arguments, so find doesn't walk build/ and install/
+        expression = []
+        for pattern in self.ignore:
+            anchored = '/' in pattern.rstrip('/')
+            test = ['-path', './' + pattern.strip('/')] if anchored else ['-name', pattern.strip('/')]
+            expression += (['-o'] if expression else []) + test
+        return ['(', *expression, ')', '-prune', '-o'] if expression else []
+
+    def scan(self, cache):
+        output = self.run(['find', '.', *self.prune_expression(), '-type', 'f', '-printf', '%P\\0%s\\0%T@\\0'])
+        fields = output.split(b'\0')
+        files = {}
+        changed = []
+        for i in range(0, len(fields) - 2, 3):
+            path = fields[i].decode('utf-8', errors='surrogateescape')
+            if is_ignored(path, self.ignore):
+                continue
+            size, mtime = int(fields[i + 1]), fields[i + 2].decode()
+            cached = cache.get(path)
+            if cached and cached[0] == size and cached[1] == mtime:
+                files[path] = cached
+            else:
+                files[path] = [size, mtime, None]
+                changed.append(path)
+        # one sha256sum per batch for the files that changed since the last scan
+        sizes = {path: files[path][0] for path in changed}
+        for batch in batches(changed, sizes):
+            for line in self.run(['sha256sum', '-z', '--', *batch]).split(b'\0'):
+                if line:
+                    digest, path = line.decode('utf-8', errors='surrogateescape').split('  ', 1)
+                    files[path][2] = digest
+        return files
+
+    def export(self, paths):
+        return self.run(['tar', '-cf', '-', '--', *paths])
+
+    def import_archive(self, data, paths, cache):
+        # the modification time in the rosbox changes with the copy, those files are hashed again next time
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r') as source, tarfile.open(fileobj=archive, mode='w') as tar:
+            directories = set()
+            for member in source:
+                if not member.isfile():
+                    continue
+                # parent directories first, otherwise docker creates them owned by root
+                parts = member.name.split('/')[:-1]
+                for i in range(1, len(parts) + 1):
+                    directory = '/'.join(parts[:i])
+                    if directory not in directories:
+                        directories.add(directory)
+                        info = tarfile.TarInfo(directory)
+                        info.type, info.mode, info.mtime = tarfile.DIRTYPE, 0o755, int(time.time())
+                        info.uid = info.gid = workspace_uid
+                        tar.addfile(info)
+                member.uid = member.gid = workspace_uid
+                member.uname = member.gname = 'ubuntu'
+                tar.addfile(member, source.extractfile(member))
+                cache.pop(member.name, None)
+        if not self.client.api.put_archive(self.container.id, self.root, archive.getvalue()):
+            raise Exception(f"could not copy files into {self.container.name}")
+
+    def delete(self, paths):
+        self.run(['rm', '-f', '--', *paths])
+
+# two-way sync between two endpoints, `local` wins when both sides changed a file
+class WorkspaceSync:
+    # restore fills a side that became empty from the other side instead of holding its deletions
+    def __init__(self, local, remote, state_path, restore=False):
+        self.local = local
+        self.remote = remote
+        self.state_path = state_path
+        self.restore = restore
+        self.state = self.load()
+
+    def load(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            # a state of other directories says nothing about these
+            if state.get('local_root') == self.local.name and state.get('remote_root') == self.remote.name:
+                return state
+        except (IOError, json.JSONDecodeError):
+            pass
+        return {'local_root': self.local.name, 'remote_root': self.remote.name, 'base': {}, 'local': {}, 'remote': {}}
+
+    def save(self):
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.state_path)
+        except IOError as e:
+            print(f"Warning: could not save the sync state: {e}")
+
+    def plan(self):
+        """Scan both sides and return the paths to push, pull, delete on either side, the conflicts and the held deletions."""
+        with span('sync.scan', side='local'):
+            local = self.local.scan(self.state['local'])
+        with span('sync.scan', side='remote'):
+            remote = self.remote.scan(self.state['remote'])
+        self.state['local'], self.state['remote'] = local, remote
+        base = self.state['base']
+        plan = {'push': [], 'pull': [], 'delete_remote': [], 'delete_local': [], 'conflicts': [], 'held': [], 'empty_side': None}
+        if base and (not local or not remote):
+            # A side that lost every file may have been recreated rather than emptied, deleting everything on the
+            # other side could lose the workspace and copying it back could undo a deletion, so the user decides.
+            if self.restore:
+                base = self.state['base'] = {}
+            else:
+                plan['empty_side'] = 'local' if not local else 'remote'
+        for path in sorted(set(local) | set(remote) | set(base)):
+            local_hash = local[path][2] if path in local else None
+            remote_hash = remote[path][2] if path in remote else None
+            base_hash = base.get(path)
+            if local_hash == remote_hash:
+                continue
+            if local_hash == base_hash:
+                plan['pull' if remote_hash else 'held' if plan['empty_side'] else 'delete_local'].append(path)
+            elif remote_hash == base_hash:
+                plan['push' if local_hash else 'held' if plan['empty_side'] else 'delete_remote'].append(path)
+            else:
+                # changed on both sides: a deletion never wins over a change, otherwise the local version is kept
+                plan['conflicts'].append(path)
+                plan['push' if local_hash or not remote_hash else 'pull'].append(path)
+        return plan
+
+    def transfer(self, source, target, paths, files, cache):
+        sizes = {path: files[path][0] for path in paths}
+        for batch in batches(paths, sizes):
+            data = source.export(batch)
+            target.import_archive(data, batch, cache)
+
+    @traced('sync.run')
+    def run(self):
+        """Sync once and return the plan that was applied."""
+        start = time.perf_counter()
+        plan = self.plan()
+        local, remote = self.state['local'], self.state['remote']
+        self.transfer(self.local, self.remote, plan['push'], local, remote)
+        self.transfer(self.remote, self.local, plan['pull'], remote, local)
+        for batch in batches(plan['delete_remote'], {}):
+            self.remote.delete(batch)
+        for batch in batches(plan['delete_local'], {}):
+            self.local.delete(batch)
+        for path in plan['delete_remote'] + plan['delete_local']:
+            local.pop(path, None)
+            remote.pop(path, None)
+        # both sides have the same files now, the local hashes are the base of the next sync
+        base = self.state['base']
+        self.state['base'] = {path: entry[2] for path, entry in local.items()}
+        # a held deletion stays one until it is resolved, without its base the file would be copied back
+        for path in plan['held']:
+            self.state['base'][path] = base[path]
+        self.state['last_sync'] = time.time()
+        self.state['duration'] = time.perf_counter() - start
+        self.save()
+        return plan
+
+    def watch(self, interval):
+        try:
+            while True:
+                plan = self.run()
+                print_plan(plan, quiet=True)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+def print_plan(plan, quiet=False):
+    to_remote = len(plan['push']) + len(plan['delete_remote'])
+    to_local = len(plan['pull']) + len(plan['delete_local'])
+    if quiet and not to_remote and not to_local and not plan['held']:
+        return
+    print(time.strftime('%H:%M:%S') + f"  {len(plan['push'])} copied and {len(plan['delete_remote'])} deleted in the rosbox, "
+          f"{len(plan['pull'])} copied and {len(plan['delete_local'])} deleted on the host")
+    for path in plan['conflicts']:
+        print(f"  conflict: {path} changed on both sides")
+    if plan['held']:
+        empty, other = ('the host', 'in the rosbox') if plan['empty_side'] == 'local' else ('the rosbox', 'on the host')
+        print(f"  conflict: every file was deleted on {empty}, {len(plan['held'])} file(s) {other} are neither deleted nor copied back. "
+              f"Delete them {other} too, or sync with --restore to copy them back")
+
+def print_status(rows):
+    print(f"{'NAME':<20} | {'HOST DIRECTORY':<30} | {'LAST SYNC':>10} | {'TOOK':>7} | {'TO ROSBOX':>9} | {'TO HOST':>7} | {'CONFLICTS':>9}")
+    print("-" * 113)
+    for row in rows:
+        print(f"{row['name']:<20} | {row['local'][-30:]:<30} | {row['lag']:>10} | {row['took']:>7} | {row['to_remote']:>9} | {row['to_local']:>7} | {row['conflicts']:>9}")
+    print(("-" * 113) + "\n")
+
+def status_row(name, sync):
+    """The lag of a sync: the time since the last sync and the changes waiting on each side."""
+    state = sync.state
+    plan = sync.plan()
+    return {
+        'name': name,
+        'local': sync.local.root,
+        'lag': f"{time.time() - state['last_sync']:.0f}s ago" if state.get('last_sync') else 'never',
+        'took': f"{state['duration']:.2f}s" if state.get('duration') is not None else '-',
+        'to_remote': len(plan['push']) + len(plan['delete_remote']),
+        'to_local': len(plan['pull']) + len(plan['delete_local']),
+        'conflicts': len(plan['conflicts']) + len(plan['held']),
+    }
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+import docker
+
+from rosbox.updateCheck import UpdateChecker
+
+image_name = 'docker.io/sterren642/rosbox:sim-latest'
+old_digest = 'sha256:' + '1' * 64
+new_digest = 'sha256:' + '2' * 64
+
+class FakeImage:
+    def __init__(self, repo_digests):
+        self.attrs = {'RepoDigests': list(repo_digests)}
+
+class FakeImages:
+    def __init__(self):
+        # tag -> repo digests of the local image, as after a pull
+        self.repo_digests = {}
+
+    def get(self, tag):
+        if tag not in self.repo_digests:
+            raise docker.errors.ImageNotFound(f"No such image: {tag}")
+        return FakeImage(self.repo_digests[tag])
+
+class FakeClient:
+    def __init__(self):
+        self.images = FakeImages()
+
+# fetch_remote_digest of UpdateChecker, answers with `digest` and counts the requests
+class FakeRegistry:
+    def __init__(self, digest):
+        self.digest = digest
+        self.reachable = True
+        self.requests = 0
+
+    def __call__(self, image_name):
+        self.requests += 1
+        if not self.reachable:
+            raise ConnectionError("registry unreachable")
+        return self.digest
+
+class UpdateCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.client = FakeClient()
+        self.client.images.repo_digests[image_name] = [f"sterren642/rosbox@{old_digest}"]
+        self.registry = FakeRegistry(old_digest)
+        self.checker = UpdateChecker(self.client, ttl=3600, cache_file=os.path.join(self.workdir.name, 'update_check.json'),
+                                     fetch_remote_digest=self.registry)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_cold_cache_asks_the_registry(self):
+        self.assertFalse(self.checker.needs_update(image_name))
+        self.assertEqual(self.registry.requests, 1)
+
+    def test_fresh_cache_answers_without_the_registry(self):
+        self.checker.needs_update(image_name)
+        # a newer image in the registry is not seen while the cached answer is fresh
+        self.registry.digest = new_digest
+        self.assertFalse(self.checker.needs_update(image_name))
+        self.assertEqual(self.registry.requests, 1)
+
+    def test_expired_cache_sees_a_digest_mismatch(self):
+        self.checker.needs_update(image_name)
+        self.registry.digest = new_digest
+        self.checker.ttl = 0
+        self.assertTrue(self.checker.needs_update(image_name))
+        self.assertEqual(self.registry.requests, 2)
+
+    def test_missing_local_image_needs_an_update(self):
+        del self.client.images.repo_digests[image_name]
+        self.assertTrue(self.checker.needs_update(image_name))
+
+    def test_unreachable_registry_raises_and_keeps_the_cache(self):
+        self.checker.needs_update(image_name)
+        self.checker.ttl = 0
+        self.registry.reachable = False
+        with self.assertRaises(ConnectionError):
+            self.checker.needs_update(image_name)
+        self.assertEqual(self.checker.load_cache()[image_name]['remote_digest'], old_digest)
+
+    def test_offline_never_asks(self):
+        self.checker.offline = True
+        self.assertFalse(self.checker.needs_update(image_name))
+        self.assertEqual(self.registry.requests, 0)
+
+    def test_pulled_image_is_cached_as_the_remote_digest(self):
+        self.registry.digest = new_digest
+        self.client.images.repo_digests[image_name] = [f"sterren642/rosbox@{new_digest}"]
+        self.checker.mark_pulled(image_name)
+        self.assertFalse(self.checker.needs_update(image_name))
+        self.assertEqual(self.registry.requests, 0)
+
+if __name__ == '__main__':
+    unittest.main()